@@ -0,0 +1,60 @@
+"""
+Aho–Corasick automaton for finding many substrings in one pass over a text.
+
+The automaton is compiled once from a list of patterns; `find(text)` then walks
+the text character by character and reports every pattern that occurs in it
+(including overlapping and nested occurrences), in O(len(text) + matches)
+independently of the number of patterns.
+"""
+from collections import deque
+
+
+class AhoCorasick:
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns: List of strings; find() reports their indexes in this list
+        """
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].append(index)
+
+        # Breadth-first: failure links point to the longest proper suffix in the trie,
+        # and every node also reports the patterns of its failure chain.
+        # Nodes of depth 1 keep failing to the root.
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """Indexes of the patterns that occur in text (empty patterns always occur)."""
+        found = {index for index, pattern in enumerate(self.patterns) if not pattern}
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
@@ -0,0 +1,355 @@
+"""
+Persistent BM25 index over the `chunks` table.
+
+The index is built once per language (see `db/gen_bm25_index.py`) and stored as
+numpy arrays under `db/bm25/{language}/`, which are memory-mapped when loaded.
+Scoring an arbitrary doc_id / domain subset filters the postings instead of
+rebuilding a BM25Okapi model, and reproduces the BM25Okapi scores that
+`get_chunks_from_db` + `BM25Retriever` would give for the same subset,
+including the merging of short chunks into the following chunk.
+"""
+import json
+import math
+import os
+import threading
+from collections import Counter
+import numpy as np
+from tokenizer import tokenize, tokenizer_version
+from token_store import save_array
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/bm25'))
+INDEX_FORMAT = 2
+
+# BM25Okapi defaults (rank_bm25)
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+# Chunks shorter than this are joined with the next chunk (see get_chunks_from_db)
+SHORT_CHUNK_LENGTH = {"zh": 10, "en": 30}
+CHUNK_SEPARATOR = '. '
+
+ARRAYS = [
+    'row_ids', 'row_doc_ids', 'row_domains', 'row_chars', 'row_lengths',
+    'row_offsets', 'row_terms', 'row_tfs',
+    'row_joined', 'joined_lengths', 'joined_offsets', 'joined_terms', 'joined_tfs',
+    'term_offsets', 'post_rows', 'post_tfs', 'idf',
+]
+
+_INDEXES = {}
+_LOCK = threading.Lock()
+
+
+def is_short_chunk(content, language):
+    return len(content) < SHORT_CHUNK_LENGTH.get(language, SHORT_CHUNK_LENGTH["en"])
+
+
+##################################
+# Build
+##################################
+
+def build_index(rows, language, output_dir, token_store=None):
+    """
+    Build the index from `(id, doc_id, domain, content)` rows ordered by id.
+
+    Args:
+        rows: Chunk rows of a single language
+        language: Language code ('en' or 'zh')
+        output_dir: Directory the index files are written to
+        token_store: Optional TokenStore to take the chunk tokens from
+    """
+    vocab = {}
+    domains = []
+    row_ids, row_doc_ids, row_domains, row_chars, row_lengths = [], [], [], [], []
+    row_offsets, row_terms, row_tfs = [0], [], []
+    row_joined, joined_lengths = [], []
+    joined_offsets, joined_terms, joined_tfs = [0], [], []
+
+    for chunk_id, doc_id, domain, content in rows:
+        tokens = token_store.get(chunk_id, content) if token_store is not None else None
+        if tokens is None:
+            tokens = tokenize(content, language)
+        if domain not in domains:
+            domains.append(domain)
+        row_ids.append(chunk_id)
+        row_doc_ids.append(doc_id)
+        row_domains.append(domains.index(domain))
+        row_chars.append(len(content))
+        row_lengths.append(len(tokens))
+        for token, tf in Counter(tokens).items():
+            row_terms.append(vocab.setdefault(token, len(vocab)))
+            row_tfs.append(tf)
+        row_offsets.append(len(row_terms))
+        # A short chunk may be joined with the next one; the separator can change how
+        # its tail is tokenized (e.g. jieba keeps "---." together), so keep that bag too
+        if is_short_chunk(content, language):
+            tokens = tokenize(content + CHUNK_SEPARATOR, language)
+            row_joined.append(len(joined_lengths))
+            joined_lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                joined_terms.append(vocab.setdefault(token, len(vocab)))
+                joined_tfs.append(tf)
+            joined_offsets.append(len(joined_terms))
+        else:
+            row_joined.append(-1)
+
+    arrays = {
+        'row_ids': np.array(row_ids, dtype=np.int64),
+        'row_doc_ids': np.array(row_doc_ids, dtype=np.int64),
+        'row_domains': np.array(row_domains, dtype=np.int16),
+        'row_chars': np.array(row_chars, dtype=np.int64),
+        'row_lengths': np.array(row_lengths, dtype=np.int64),
+        'row_offsets': np.array(row_offsets, dtype=np.int64),
+        'row_terms': np.array(row_terms, dtype=np.int32),
+        'row_tfs': np.array(row_tfs, dtype=np.int32),
+        'row_joined': np.array(row_joined, dtype=np.int64),
+        'joined_lengths': np.array(joined_lengths, dtype=np.int64),
+        'joined_offsets': np.array(joined_offsets, dtype=np.int64),
+        'joined_terms': np.array(joined_terms, dtype=np.int32),
+        'joined_tfs': np.array(joined_tfs, dtype=np.int32),
+    }
+
+    # Invert the forward (row -> terms) arrays into postings (term -> rows)
+    entry_rows = np.repeat(np.arange(len(row_ids), dtype=np.int32), np.diff(arrays['row_offsets']))
+    order = np.argsort(arrays['row_terms'], kind='stable')
+    arrays['post_rows'] = entry_rows[order]
+    arrays['post_tfs'] = arrays['row_tfs'][order]
+    term_counts = np.bincount(arrays['row_terms'], minlength=len(vocab))
+    arrays['term_offsets'] = np.concatenate([[0], np.cumsum(term_counts)]).astype(np.int64)
+
+    os.makedirs(output_dir, exist_ok=True)
+    meta = {
+        'format': INDEX_FORMAT,
+        'language': language,
+        'tokenizer_version': tokenizer_version(language),
+        'num_rows': len(row_ids),
+        'num_terms': len(vocab),
+        'domains': domains,
+    }
+    index = BM25Index(meta, list(vocab), arrays)
+    # IDF table for the unfiltered corpus, so whole-language queries skip the df pass
+    arrays['idf'] = index.subset_idf(index.units(np.arange(len(row_ids))))
+
+    for name in ARRAYS:
+        save_array(os.path.join(output_dir, f"{name}.npy"), arrays[name])
+    with open(os.path.join(output_dir, 'vocab.json'), 'w') as f:
+        json.dump(list(vocab), f, ensure_ascii=False)
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    print(f"Saved BM25 index ({len(row_ids)} chunks, {len(vocab)} terms) to {output_dir}")
+
+
+##################################
+# Load
+##################################
+
+def load_bm25_index(language):
+    """
+    Load the prebuilt index for a language once per process.
+
+    Returns:
+        BM25Index, or None if the index has not been built
+    """
+    with _LOCK:
+        if language not in _INDEXES:
+            _INDEXES[language] = BM25Index.load(os.path.join(INDEX_DIR, language))
+        return _INDEXES[language]
+
+
+class Units:
+    """Chunk rows of a subset grouped into merged retrieval units."""
+
+    def __init__(self, positions, merged, unit_of_position, terminators, sizes, lengths, joined):
+        self.positions = positions                # subset rows (index positions), ascending
+        self.merged = merged                      # whether each subset row is joined with the next one
+        self.unit_of_position = unit_of_position  # unit number of each subset row
+        self.terminators = terminators            # last subset row of every unit
+        self.sizes = sizes                        # number of chunk rows in every unit
+        self.lengths = lengths                    # token length of every unit
+        self.joined = joined                      # (positions, units, terms, tfs) entries of joined rows
+
+    def __len__(self):
+        return len(self.terminators)
+
+
+def gather(offsets, terms, tfs, slots):
+    """Concatenate the forward-array entries of the given slots, in slot order."""
+    starts = offsets[slots]
+    counts = offsets[slots + 1] - starts
+    entries = np.arange(int(counts.sum())) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return counts, terms[entries].astype(np.int64), tfs[entries].astype(np.int64)
+
+
+class BM25Index:
+    def __init__(self, meta, vocab, arrays):
+        self.meta = meta
+        self.language = meta['language']
+        self.vocab = vocab
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.domains = meta['domains']
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.num_rows = meta['num_rows']
+        self.num_terms = meta['num_terms']
+
+    @classmethod
+    def load(cls, index_dir):
+        meta_path = os.path.join(index_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            logger.warning("[BM25Index] No index found at %s, falling back to in-memory BM25", index_dir)
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT or meta.get('tokenizer_version') != tokenizer_version(meta['language']):
+            logger.warning("[BM25Index] Index at %s is stale, falling back to in-memory BM25 (rebuild it)", index_dir)
+            return None
+        with open(os.path.join(index_dir, 'vocab.json'), 'r') as f:
+            vocab = json.load(f)
+        arrays = {name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode='r') for name in ARRAYS}
+        logger.info("[BM25Index] Loaded %s chunks from %s", meta['num_rows'], index_dir)
+        return cls(meta, vocab, arrays)
+
+    def select(self, prediction=None, doc_id=None):
+        """Index positions of the rows get_chunks_from_db would return, in id order."""
+        if prediction and doc_id:
+            return np.flatnonzero(np.isin(self.row_doc_ids, list(doc_id)))
+        if prediction:
+            if prediction not in self.domains:
+                return np.array([], dtype=np.int64)
+            return np.flatnonzero(self.row_domains == self.domains.index(prediction))
+        return np.arange(self.num_rows)
+
+    def units(self, positions):
+        """Group subset rows into units, joining short chunks with the next one."""
+        threshold = SHORT_CHUNK_LENGTH.get(self.language, SHORT_CHUNK_LENGTH["en"])
+        chars = self.row_chars[positions]
+        merged = np.zeros(len(positions), dtype=bool)
+        # Only raw-short rows can be merged; a merged row carries its length into the next one
+        carried = {}
+        for i in np.flatnonzero(chars < threshold).tolist():
+            if i == len(positions) - 1:
+                break
+            length = int(chars[i]) + carried.get(i, 0)
+            if length < threshold:
+                merged[i] = True
+                carried[i + 1] = length + len(CHUNK_SEPARATOR)
+        terminators = np.flatnonzero(~merged)
+        unit_of_position = np.searchsorted(terminators, np.arange(len(positions)))
+        sizes = np.diff(np.concatenate([[-1], terminators]))
+
+        # Merged rows use their "joined" token bag, the last row of a unit its own bag
+        joined_positions = np.flatnonzero(merged)
+        slots = self.row_joined[positions[joined_positions]]
+        counts, terms, tfs = gather(self.joined_offsets, self.joined_terms, self.joined_tfs, slots)
+        joined = (np.repeat(joined_positions, counts), np.repeat(unit_of_position[joined_positions], counts), terms, tfs)
+
+        row_lengths = np.where(merged, 0, self.row_lengths[positions])
+        row_lengths[joined_positions] = self.joined_lengths[slots]
+        lengths = np.bincount(unit_of_position, weights=row_lengths, minlength=len(terminators)).astype(np.int64)
+        return Units(positions, merged, unit_of_position, terminators, sizes, lengths, joined)
+
+    def term_frequencies(self, term_id, units, full=False):
+        """Frequency of a term in every unit of the subset."""
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        rows = self.post_rows[start:end]
+        tfs = self.post_tfs[start:end]
+        if full:
+            hits = rows
+        else:
+            hits = np.searchsorted(units.positions, rows)
+            hits[hits == len(units.positions)] = 0
+            keep = units.positions[hits] == rows if len(units.positions) else np.zeros(len(rows), dtype=bool)
+            hits, tfs = hits[keep], tfs[keep]
+        keep = ~units.merged[hits]
+        tf = np.bincount(units.unit_of_position[hits[keep]], weights=tfs[keep], minlength=len(units)).astype(np.int64)
+        _, joined_units, joined_terms, joined_tfs = units.joined
+        matches = joined_terms == term_id
+        if matches.any():
+            tf += np.bincount(joined_units[matches], weights=joined_tfs[matches], minlength=len(units)).astype(np.int64)
+        return tf
+
+    def subset_idf(self, units):
+        """BM25Okapi idf of every term over the units (eps floor applied, NaN if absent)."""
+        raw_positions = units.terminators
+        counts, raw_terms, _ = gather(self.row_offsets, self.row_terms, self.row_tfs, units.positions[raw_positions])
+        joined_positions, _, joined_terms, _ = units.joined
+        entry_positions = np.concatenate([np.repeat(raw_positions, counts), joined_positions])
+        # Entries in corpus order: BM25Okapi sums idfs in first-appearance order,
+        # keeping that order makes the eps floor (and so the scores) match bit for bit
+        order = np.argsort(entry_positions, kind='stable')
+        entry_terms = np.concatenate([raw_terms, joined_terms])[order]
+        entry_units = units.unit_of_position[entry_positions[order]]
+        keys = np.unique(entry_units * self.num_terms + entry_terms)
+        df = np.bincount(keys % self.num_terms, minlength=self.num_terms)
+        terms, first = np.unique(entry_terms, return_index=True)
+        idf = np.full(self.num_terms, np.nan)
+        n = len(units)
+        idf_sum = 0
+        for term_id in terms[np.argsort(first)].tolist():
+            idf[term_id] = math.log(n - df[term_id] + 0.5) - math.log(df[term_id] + 0.5)
+            idf_sum += idf[term_id]
+        average_idf = idf_sum / len(terms) if len(terms) else 0.0
+        idf[idf < 0] = EPSILON * average_idf
+        return idf
+
+    def get_scores(self, query_tokens, units):
+        """BM25Okapi scores of the tokenized query for every unit, as BM25Okapi.get_scores."""
+        return self.get_score_matrix([query_tokens], units)[:, 0]
+
+    def get_score_matrix(self, queries_tokens, units):
+        """
+        Scores of several tokenized queries at once, one column per query.
+
+        Term frequencies and idfs are computed once for the union of the query terms,
+        then every column accumulates its terms in query order like BM25Okapi does.
+        """
+        if not len(units):
+            return np.zeros((0, len(queries_tokens)))
+        full = len(units.positions) == self.num_rows
+        avgdl = int(units.lengths.sum()) / len(units)
+        queries_term_ids = [[self.term_ids.get(q) for q in tokens] for tokens in queries_tokens]
+        idf = {}
+        tf = {}
+        for term_id in set(t for term_ids in queries_term_ids for t in term_ids if t is not None):
+            tf[term_id] = self.term_frequencies(term_id, units, full)
+            df = int(np.count_nonzero(tf[term_id]))
+            if df:
+                idf[term_id] = math.log(len(units) - df + 0.5) - math.log(df + 0.5)
+        if full:
+            idf = {term_id: float(self.idf[term_id]) for term_id in idf}
+        elif any(value < 0 for value in idf.values()):
+            # Negative idfs are floored at eps * average idf over the whole subset vocabulary
+            subset_idf = self.subset_idf(units)
+            idf = {term_id: float(subset_idf[term_id]) for term_id in idf}
+        # Column 0 is all zeros and pads queries whose terms do not appear in the subset
+        columns = [np.zeros(len(units))]
+        column_of = {}
+        for term_id in idf:
+            q_freq = tf[term_id]
+            column_of[term_id] = len(columns)
+            columns.append((idf[term_id] or 0) * (q_freq * (K1 + 1) /
+                                                  (q_freq + K1 * (1 - B + B * units.lengths / avgdl))))
+        weights = np.stack(columns, axis=1)
+        query_columns = [[column_of[t] for t in term_ids if t in column_of] for term_ids in queries_term_ids]
+        width = max((len(c) for c in query_columns), default=0)
+        padded = np.zeros((len(query_columns), width), dtype=np.int64)
+        for i, c in enumerate(query_columns):
+            padded[i, :len(c)] = c
+        score = np.zeros((len(units), len(query_columns)))
+        for j in range(width):
+            score += weights[:, padded[:, j]]
+        return score
+
+    def unit_ids(self, units, unit_indices):
+        """Chunk ids making up each requested unit, in content order."""
+        members = []
+        for u in unit_indices:
+            end = units.terminators[u]
+            start = end - units.sizes[u] + 1
+            members.append([int(self.row_ids[p]) for p in units.positions[start:end + 1]])
+        return members
@@ -0,0 +1,66 @@
+"""
+Shared read-only access to `db/dataset.db` for the query-time code.
+
+Every thread gets its own pooled connection per database file, opened once in
+read-only mode (`mode=ro`, `query_only`) and tuned for reads: memory-mapped
+I/O, a large page cache and in-memory temp storage. Statements are compiled
+once per connection and reused from its statement cache, so a query no longer
+pays for opening the database, parsing the schema or preparing its SQL.
+
+The database is switched to WAL by the writers (gen_dataset_db / ingest_dataset,
+see enable_wal), so the main.py query workers read concurrently with each other
+and with an ingest in progress.
+"""
+import os
+import sqlite3
+import threading
+
+DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/dataset.db'))
+MMAP_SIZE = 1 << 30
+# Negative cache_size is in KiB
+CACHE_SIZE_KB = 64 * 1024
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+def connect_read_only(path=DB_PATH):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, cached_statements=CACHED_STATEMENTS)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def get_connection(path=DB_PATH):
+    """The calling thread's read-only connection to path, opened on first use."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    if path not in connections:
+        connections[path] = connect_read_only(path)
+    return connections[path]
+
+
+def query(sql, params=(), path=DB_PATH):
+    """All rows of a read query on the calling thread's connection."""
+    return get_connection(path).execute(sql, params).fetchall()
+
+
+def query_one(sql, params=(), path=DB_PATH):
+    return get_connection(path).execute(sql, params).fetchone()
+
+
+def close_connections():
+    """Close the calling thread's connections, e.g. before the database file is replaced."""
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+def enable_wal(path=DB_PATH):
+    """Switch a database to WAL journaling (persistent; done by the writers)."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
@@ -1,48 +1,52 @@
 import re
 import numpy as np
-from ollama import Client
 import os
 import sys
-from utils import load_ollama_config
-import faiss
 import json
 from chunker import chunk_documents
 from runtime_chunker import chunk_row_chunks
-from retriever import create_retriever, get_chunks_from_db
+from token_store import sentence_token_key
+from retriever import create_retriever, create_chunk_retriever, get_chunks_from_db
 from generator import generate_answer
 from rank_bm25 import BM25Okapi
 from router_utils import specific_router
+from faiss_registry import get_faiss_index
+from data_access import get_connection
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.embedding_service import embed_query
+from My_RAG.log_config import get_logger
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../db')))
 from Connection import Connection
+
+logger = get_logger(__name__)
 DB_PATH = "db/dataset.db"
 
 def default_chain(query, language="en", prediction=None, doc_id=[], doc_names=[]):
     prediction_from_query_db, doc_id = embedding_query_db_router(query, language)
-    print("prediction_from_query_db: ", prediction_from_query_db, "doc_id: ", doc_id)
+    logger.debug("prediction_from_query_db: %s doc_id: %s", prediction_from_query_db, doc_id)
     prediction_from_query = embedding_query_router(query, language)
-    print("prediction_from_query: ", prediction_from_query)
+    logger.debug("prediction_from_query: %s", prediction_from_query)
     prediction, total_doc_id = specific_router(query)
-    print("prediction: ", prediction, "total_doc_id: ", total_doc_id)
+    logger.debug("prediction: %s total_doc_id: %s", prediction, total_doc_id)
 
     if prediction!=prediction_from_query_db and prediction!=prediction_from_query:
         doc_id = total_doc_id
 
     query_text = query['query']['content']
     modified_query_text = get_remove_names_from_text(query_text, doc_names)
-    print("query_text: ", query_text)
-    print("modified_query_text: ", modified_query_text)
+    logger.debug("query_text: %s", query_text)
+    logger.debug("modified_query_text: %s", modified_query_text)
 
     # 1. Retrieve bigger chunks(use BM25)
-    row_chunks = get_chunks_from_db(prediction, doc_id, language)
-    retriever = create_retriever(row_chunks, language)
+    retriever = create_chunk_retriever(prediction, doc_id, language)
     
-    print("[1] retrieve with bigger chunks:")
+    logger.debug("[1] retrieve with bigger chunks:")
     retrieved_chunks = retriever.retrieve(query_text, threshold=0) # retrieve as much as possible
-    print('chunks: ', len(retrieved_chunks))
+    logger.debug("chunks: %s", len(retrieved_chunks))
 
     # 2. Retrieve smaller chunks(use BM25)
-    print("[2] retrieve with smaller chunks and extract document name:")
+    logger.debug("[2] retrieve with smaller chunks and extract document name:")
     small_retrieved_chunks, small_chunks = create_smaller_chunks_without_names(language, retrieved_chunks, doc_names)
     retriever_2 = create_retriever(small_retrieved_chunks, language)
     retrieved_small_chunks = retriever_2.retrieve(modified_query_text, top1_check=True) # retrieve for higher than the top 1 score * 0.5
@@ -50,10 +54,10 @@ def default_chain(query, language="en", prediction=None, doc_id=[], doc_names=[]
     for index, chunk in enumerate(retrieved_small_chunks):
         return_chunks.append(small_chunks[chunk['chunk_index']])
 
-    print('chunks: ', len(return_chunks))
+    logger.debug("chunks: %s", len(return_chunks))
 
     # 3. Generate Answer
-    print("[3] generate answer:")
+    logger.debug("[3] generate answer:")
     answer = generate_answer(query['query']['content'], return_chunks, language)
     if ("无法回答" in answer or 'Unable to answer' in answer):
         return answer, return_chunks
@@ -61,13 +65,13 @@ def default_chain(query, language="en", prediction=None, doc_id=[], doc_names=[]
     #4. Fine-tune retriever
     retrieve_answer = get_remove_names_from_text(answer, doc_names)
     final_retrieve = modified_query_text + " " + retrieve_answer
-    print("[4] rerieve for final answer: {}".format(final_retrieve))
+    logger.debug("[4] rerieve for final answer: %s", final_retrieve)
     retrieved_small_chunks = retriever_2.retrieve(final_retrieve, top1_check=True) # retrieve for higher than the top 1 score * 0.5
     
     return_chunks = []
     for index, chunk in enumerate(retrieved_small_chunks):
         return_chunks.append(small_chunks[chunk['chunk_index']])
-    print('final chunks: ', len(return_chunks))
+    logger.debug("final chunks: %s", len(return_chunks))
     return answer, return_chunks
 
 ########## Helper Functions ##########
@@ -78,7 +82,8 @@ def create_smaller_chunks_without_names(language="en", retrieved_chunks=[], doc_
     for index, chunk in enumerate(small_chunks):
         small_retrieved_chunks.append({
             "page_content": get_remove_names_from_text(chunk['page_content'], doc_names),
-            "chunk_index": index
+            "chunk_index": index,
+            "token_key": sentence_token_key(chunk)
         })
     return small_retrieved_chunks, small_chunks
 
@@ -90,12 +95,8 @@ def get_remove_names_from_text(content, doc_names = []):
 
 
 def get_embedding(text, language="en"):
-    ollama_config = load_ollama_config()
-    ollama_host = ollama_config["host"]
-    client = Client(host=ollama_host)
-    # Using the same model as generator/router_llm
-    response = client.embeddings(model="qwen3-embedding:0.6b", prompt=text)
-    return np.array(response['embedding'], dtype='float32').reshape(1, -1)
+    # Shared, batching embedding client (qwen3-embedding:0.6b)
+    return embed_query(text)
 
 def embedding_query_router(query, language="en"):
     content = query['query']['content']
@@ -103,20 +104,17 @@ def embedding_query_router(query, language="en"):
     try:
         query_embedding = get_embedding(content, language)
 
-        # Load FAISS index
-        index = faiss.read_index("db/faiss/documents/" + language + "/" + language + ".index")
+        # FAISS index and mapping are loaded once per process
+        entry = get_faiss_index("documents", language)
 
         # Search for nearest neighbors 
-        D, I = index.search(query_embedding, 1)
+        D, I = entry.index.search(query_embedding, 1)
 
-        # Get mapping from FAISS ID to document ID
-        mapping_path = "db/faiss/documents/" + language + "/" + language + "_mapping.json"
-        with open(mapping_path, 'r') as f:
-            mapping = json.load(f)
-        id = [mapping[str(id)] for id in I[0]]
+        # Map FAISS IDs to document IDs
+        id = entry.ids(I[0])
 
         # Get document
-        conn = Connection(DB_PATH)
+        conn = get_connection()
         placeholders = ','.join('?' for _ in id)
         # Query chunks table because FAISS index is built from chunks
         cursor = conn.execute(f"SELECT domain FROM documents WHERE id in ({placeholders})", id)
@@ -124,7 +122,7 @@ def embedding_query_router(query, language="en"):
         if row:
             prediction = row[0]
     except Exception as e:
-        print(f"Error in embedding_query_router: {e}")
+        logger.warning("Error in embedding_query_router: %s", e)
     return prediction
 
 def embedding_query_db_router(query, language="en"):
@@ -132,20 +130,17 @@ def embedding_query_db_router(query, language="en"):
     try:
         query_embedding = get_embedding(content, language)
 
-        # Load FAISS index
-        index = faiss.read_index("db/faiss/queries/" + language + "/" + language + ".index")
+        # FAISS index and mapping are loaded once per process
+        entry = get_faiss_index("queries", language)
 
         # Search for nearest neighbors 
-        D, I = index.search(query_embedding, 5)
+        D, I = entry.index.search(query_embedding, 5)
 
-        # Get mapping from FAISS ID to document ID
-        mapping_path = "db/faiss/queries/" + language + "/" + language + "_mapping.json"
-        with open(mapping_path, 'r') as f:
-            mapping = json.load(f)
-        id = [mapping[str(id)] for id in I[0]]
+        # Map FAISS IDs to query IDs
+        id = entry.ids(I[0])
 
         # Get document
-        conn = Connection(DB_PATH)
+        conn = get_connection()
         placeholders = ','.join('?' for _ in id)
         # Query chunks table because FAISS index is built from chunks
         cursor = conn.execute(f"SELECT domain, query_id, jsonl FROM queries WHERE id in ({placeholders})", id)
@@ -168,5 +163,5 @@ def embedding_query_db_router(query, language="en"):
             doc_id = []
         return prediction, doc_id
     except Exception as e:
-        print(f"Error in embedding_query_router: {e}")
+        logger.warning("Error in embedding_query_router: %s", e)
         return None, []
\ No newline at end of file
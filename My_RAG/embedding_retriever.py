@@ -1,39 +1,34 @@
 import os
 import sys
-import json
 import numpy as np
-import faiss
 import sqlite3
-from ollama import Client
-from utils import load_ollama_config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.embedding_service import embed_query
+from faiss_registry import get_faiss_index
+from data_access import get_connection
 
 DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/dataset.db'))
 
 def get_query_embedding(text):
-    ollama_config = load_ollama_config()
-    ollama_host = ollama_config["host"]
-    client = Client(host=ollama_host)
-    # Using the same model as generator/router_llm
-    response = client.embeddings(model="qwen3-embedding:0.6b", prompt=text)
-    return np.array(response['embedding'], dtype='float32').reshape(1, -1)
+    # Shared, batching embedding client (qwen3-embedding:0.6b)
+    return embed_query(text)
 
 def get_chunks_rows(language="en", doc_ids=None, domain=None):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     if domain and doc_ids:
         placeholders = ','.join('?' for _ in doc_ids)
-        cursor.execute(f"SELECT id, content FROM chunks WHERE doc_id IN ({placeholders})", doc_ids)
+        cursor.execute(f"SELECT id, content FROM chunks WHERE doc_id IN ({placeholders}) ORDER BY id", doc_ids)
         rows = cursor.fetchall()
         if not rows:
             return []
     elif domain:
         placeholders = ','.join('?' for _ in domain)
-        cursor.execute(f"SELECT id, content FROM chunks WHERE domain IN ({placeholders})", domain)
+        cursor.execute(f"SELECT id, content FROM chunks WHERE domain IN ({placeholders}) ORDER BY id", domain)
         rows = cursor.fetchall()
         if not rows:
             return []
     else:
-        cursor.execute("SELECT id, content FROM chunks")
+        cursor.execute("SELECT id, content FROM chunks ORDER BY id")
         rows = cursor.fetchall()
         if not rows:
             return []
@@ -49,52 +44,28 @@ def embedding_retriever(query, language="en", doc_ids=None, domain=None, top_k=5
     # Get query embedding
     query_embedding = get_query_embedding(query)
     
-    # Paths
-    base_dir = os.path.dirname(__file__)
-    index_path = os.path.join(base_dir, f"../db/faiss/chunks/{language}/{language}.index")
-    mapping_path = os.path.join(base_dir, f"../db/faiss/chunks/{language}/{language}_mapping.json")
-    
-    # Load index and mapping
-    if not os.path.exists(index_path) or not os.path.exists(mapping_path):
-        print(f"Error: FAISS index or mapping not found at {index_path}")
+    # Index and mapping are loaded once per process
+    entry = get_faiss_index("chunks", language)
+    if entry is None:
         return []
-
-    index = faiss.read_index(index_path)
-    with open(mapping_path, 'r') as f:
-        mapping = json.load(f) # FAISS ID (str) -> Chunk ID (int)
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     rows = get_chunks_rows(language, doc_ids, domain)
     if not rows:
         return []
 
-    chunk_ids = [row[0] for row in rows]
+    chunk_ids = np.array([row[0] for row in rows], dtype=np.int64)
     chunk_contents = {row[0]: row[1] for row in rows}
     
-    # 2. Invert mapping to find FAISS IDs for these chunk IDs
-    # mapping is str(faiss_id) -> chunk_id
-    # We need chunk_id -> faiss_id
-    chunk_to_faiss = {v: int(k) for k, v in mapping.items()}
-    
-    vectors = []
-    valid_chunk_ids = []
-    
-    for cid in chunk_ids:
-        if cid in chunk_to_faiss:
-            fid = chunk_to_faiss[cid]
-            try:
-                # Reconstruct vector from FAISS index
-                vec = index.reconstruct(fid)
-                vectors.append(vec)
-                valid_chunk_ids.append(cid)
-            except Exception as e:
-                print(f"Error reconstructing vector for chunk {cid} (FAISS ID {fid}): {e}")
+    # 2. Find FAISS IDs for these chunk IDs (-1 if the chunk has no vector)
+    chunk_faiss_ids = entry.rows(chunk_ids)
+    has_vector = chunk_faiss_ids >= 0
+    valid_chunk_ids = chunk_ids[has_vector].tolist()
     
-    if not vectors:
+    if not valid_chunk_ids:
         return []
         
-    vectors_np = np.array(vectors)
+    # Gather the subset from the contiguous vector matrix in one step
+    vectors_np = entry.vectors()[chunk_faiss_ids[has_vector]]
     
     # 3. Calculate similarity (L2 distance)
     # query_embedding is (1, d), vectors_np is (n, d)
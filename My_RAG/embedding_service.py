@@ -0,0 +1,129 @@
+"""
+Shared embedding client for the Ollama embed endpoint.
+
+The process-wide `Client` of llm_gateway is reused for every request, texts
+are sent in batches through `Client.embed`, and concurrent single-query callers
+(`embed_query`) are coalesced by a background worker into one batched request.
+
+Note that `/api/embed` returns L2-normalized vectors, so the FAISS indexes
+under `db/faiss/` must be built with this module too (the generate_faiss.py
+scripts do) for query and index vectors to be comparable.
+
+Requests have the timeout and retries of the generate requests (`timeout` /
+`retries` of the ollama config), and `embed_query` stops waiting once the
+request in flight and its own could both have used up their retries, so a hung
+endpoint fails the queries waiting on it instead of stalling them.
+
+Vectors are looked up in / stored to the persistent cache of llm_cache, except
+for the bulk index builds, which have their own checkpoints.
+"""
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_gateway import get_client, call_with_retries, max_request_time
+from My_RAG import llm_cache
+from My_RAG.tracing import span
+
+EMBEDDING_MODEL = "qwen3-embedding:0.6b"
+# Largest number of texts sent in one embed request
+MAX_BATCH_SIZE = 64
+# How long the worker waits for more queries before sending a batch (seconds)
+COALESCE_WINDOW = 0.005
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+class EmbeddingService:
+    def __init__(self, model=EMBEDDING_MODEL, max_batch_size=MAX_BATCH_SIZE, window=COALESCE_WINDOW):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self._pending = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def embed(self, texts, cache=True):
+        """
+        Embed texts with as few requests as possible.
+
+        Args:
+            texts: List of strings
+            cache: Reuse and store vectors in the persistent cache
+
+        Returns:
+            float32 array of shape (len(texts), dim)
+        """
+        with span('embedding', model=self.model, texts=len(texts)) as attributes:
+            vectors = llm_cache.get_embeddings(self.model, texts) if cache else [None] * len(texts)
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            attributes['cached'] = len(texts) - len(missing)
+            for start in range(0, len(missing), self.max_batch_size):
+                batch = missing[start:start + self.max_batch_size]
+                inputs = [texts[i] for i in batch]
+                response = call_with_retries(lambda: get_client().embed(model=self.model, input=inputs), self.model)
+                for i, vector in zip(batch, response['embeddings']):
+                    vectors[i] = vector
+                if cache:
+                    llm_cache.put_embeddings(self.model, inputs, response['embeddings'])
+        return np.array(vectors, dtype='float32')
+
+    def embed_query(self, text):
+        """
+        Embed one text, batched together with queries submitted concurrently.
+
+        Returns:
+            float32 array of shape (1, dim)
+        """
+        with span('embedding', model=self.model, texts=1):
+            future = Future()
+            self._pending.put((text, future))
+            self._ensure_worker()
+            # The worker may be busy with another batch before this one
+            return future.result(timeout=2 * max_request_time()).reshape(1, -1)
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            # Collect whatever else arrives within the window, up to one full batch
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._pending.get(timeout=self.window))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.embed([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+def get_embedding_service(model=EMBEDDING_MODEL):
+    with _services_lock:
+        if model not in _services:
+            _services[model] = EmbeddingService(model)
+        return _services[model]
+
+
+def embed_texts(texts, model=EMBEDDING_MODEL, cache=True):
+    """Embed a list of texts in batches, as a (len(texts), dim) float32 array."""
+    return get_embedding_service(model).embed(texts, cache)
+
+
+def embed_query(text, model=EMBEDDING_MODEL):
+    """Embed a single query as a (1, dim) float32 array, coalescing concurrent calls."""
+    return get_embedding_service(model).embed_query(text)
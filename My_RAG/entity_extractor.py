@@ -1,10 +1,12 @@
 import re
 from typing import Dict, List, Optional
-from ollama import Client
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from My_RAG.utils import load_ollama_config
+from My_RAG.llm_gateway import generate
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
 
 def extract_entities_with_llm(query: str, language: str = "en") -> Dict[str, List[str]]:
     """
@@ -72,9 +74,7 @@ If a category has no entities, return an empty list [].
 Return ONLY JSON, no other text."""
 
     try:
-        ollama_config = load_ollama_config()
-        client = Client(host=ollama_config["host"])
-        response = client.generate(model=ollama_config["model"], prompt=prompt)
+        response = generate(prompt=prompt)
         
         # Parse JSON response
         import json
@@ -101,7 +101,7 @@ Return ONLY JSON, no other text."""
         return default_entities
         
     except Exception as e:
-        print(f"Error extracting entities with LLM: {e}")
+        logger.warning("Error extracting entities with LLM: %s", e)
         return {
             'years': [],
             'months': [],
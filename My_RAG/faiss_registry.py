@@ -0,0 +1,159 @@
+"""
+Process-wide registry of the FAISS indexes under `db/faiss/{chunks,documents,queries}/{language}/`.
+
+Each index and its `{language}_mapping.json` (FAISS ID -> table id, and the
+ntotal and sha1 of the index file it was written with) are read once per process
+and shared by every caller, so a query no longer pays for deserializing the index. FAISS IDs
+are either the row numbers of a plain flat index or, for IndexIDMap2 indexes
+(see db/faiss/faiss_builder.py), the table ids themselves. The mapping is kept
+as numpy arrays: `label_to_id[faiss_id]`, `row_to_id[row]` for every stored row
+and its inverse `id_to_row[id]` (-1 for ids without a vector). The stored
+vectors are exposed as one contiguous float32 matrix, so a subset of them can be
+gathered with a single fancy index instead of per-id reconstruct().
+"""
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+import faiss
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
+
+FAISS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/faiss'))
+KINDS = ('chunks', 'documents', 'queries')
+
+_INDEXES = {}
+_LOCK = threading.Lock()
+
+
+class FaissEntry:
+    def __init__(self, index, mapping):
+        self.index = index
+        self.label_to_id = np.full(max(mapping, default=-1) + 1, -1, dtype=np.int64)
+        self.label_to_id[list(mapping)] = list(mapping.values())
+        if isinstance(index, faiss.IndexIDMap):
+            self.storage = faiss.downcast_index(index.index)
+            labels = faiss.vector_to_array(index.id_map)
+        else:
+            self.storage = index
+            labels = np.arange(index.ntotal)
+        self.row_to_id = self.label_ids(labels)
+        mapped = np.flatnonzero(self.row_to_id >= 0)
+        self.id_to_row = np.full(int(self.row_to_id.max()) + 1 if len(mapped) else 0, -1, dtype=np.int64)
+        self.id_to_row[self.row_to_id[mapped]] = mapped
+        self._vectors = None
+        self._vectors_lock = threading.Lock()
+
+    def label_ids(self, labels):
+        """Table ids of FAISS IDs (-1 for unknown IDs and the -1 FAISS returns for missing results)."""
+        labels = np.asarray(labels, dtype=np.int64).ravel()
+        ids = np.full(len(labels), -1, dtype=np.int64)
+        known = (labels >= 0) & (labels < len(self.label_to_id))
+        ids[known] = self.label_to_id[labels[known]]
+        return ids
+
+    def ids(self, labels):
+        """Table ids of FAISS search results, skipping missing results."""
+        ids = self.label_ids(labels)
+        return ids[ids >= 0].tolist()
+
+    def vectors(self):
+        """All stored vectors as an (ntotal, d) float32 matrix indexed by stored row."""
+        with self._vectors_lock:
+            if self._vectors is None:
+                index = self.storage
+                if isinstance(index, faiss.IndexFlat):
+                    # View of the flat index storage (no copy, works with mmap too)
+                    self._vectors = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+                else:
+                    self._vectors = index.reconstruct_n(0, index.ntotal)
+            return self._vectors
+
+    def rows(self, ids):
+        """Stored rows of table ids (-1 for ids without a vector)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self.id_to_row))
+        rows[known] = self.id_to_row[ids[known]]
+        return rows
+
+
+def index_paths(kind, language):
+    index_dir = os.path.join(FAISS_DIR, kind, language)
+    return os.path.join(index_dir, f"{language}.index"), os.path.join(index_dir, f"{language}_mapping.json")
+
+
+def read_index(index_path, mmap=False):
+    if mmap:
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            # Not every index type can be memory-mapped
+            logger.warning("[FaissRegistry] Cannot mmap %s (%s), reading it into memory", index_path, e)
+    return faiss.read_index(index_path)
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_mapping(mapping_path, index_path, index):
+    """
+    {FAISS ID: table id} of an index, or None when the mapping was written for
+    another index file, e.g. by a save interrupted between its two renames.
+    """
+    with open(mapping_path, 'r') as f:
+        data = json.load(f)
+    if 'mapping' in data:
+        mapping, ntotal, sha1 = data['mapping'], data['ntotal'], data.get('index_sha1')
+    else:
+        # Written before the index fingerprint was stored: one entry per vector
+        mapping, ntotal, sha1 = data, len(data), None
+    if ntotal != index.ntotal or (sha1 is not None and sha1 != file_sha1(index_path)):
+        return None
+    return {int(label): table_id for label, table_id in mapping.items()}
+
+
+def get_faiss_index(kind, language, mmap=False):
+    """
+    Load a FAISS index and its mapping once per process.
+
+    Args:
+        kind: 'chunks', 'documents' or 'queries'
+        language: Language code ('en' or 'zh')
+        mmap: Memory-map the index file instead of reading it (used on first load only)
+
+    Returns:
+        FaissEntry, or None if the index or mapping file is missing, or the mapping
+        was written for another version of the index
+    """
+    key = (kind, language)
+    with _LOCK:
+        if key not in _INDEXES:
+            index_path, mapping_path = index_paths(kind, language)
+            if not os.path.exists(index_path) or not os.path.exists(mapping_path):
+                logger.warning("[FaissRegistry] FAISS index or mapping not found at %s", index_path)
+                return None
+            index = read_index(index_path, mmap)
+            mapping = read_mapping(mapping_path, index_path, index)
+            if mapping is None:
+                logger.warning("[FaissRegistry] %s was written for another version of %s; rebuild it",
+                               mapping_path, index_path)
+                return None
+            _INDEXES[key] = FaissEntry(index, mapping)
+            logger.info("[FaissRegistry] Loaded %s/%s index with %s vectors", kind, language, index.ntotal)
+        return _INDEXES[key]
+
+
+def clear_faiss_indexes():
+    """Forget the loaded indexes, e.g. after they were rebuilt on disk."""
+    with _LOCK:
+        _INDEXES.clear()
@@ -1,7 +1,12 @@
-from ollama import Client
 from pathlib import Path
 import yaml
-from utils import load_ollama_config
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_gateway import generate
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
 
 
 def load_prompts(type="default"):
@@ -16,14 +21,12 @@ def generate_answer(query, context_chunks, language="en", type="default"):
     context = "\n\n".join([chunk['page_content'] for chunk in context_chunks])
     prompts = load_prompts(type)
     if language not in prompts:
-        print(f"Warning: Language '{language}' not found in prompts. Falling back to 'en'.")
+        logger.warning("Warning: Language '%s' not found in prompts. Falling back to 'en'.", language)
         language = "en"
         
     prompt_template = prompts[language]
     prompt = prompt_template.format(query=query, context=context)
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
         #  "num_ctx": 8192, # [4096, 8192, 32768]
          "temperature": 0.5, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
          "top_p": 0.9,
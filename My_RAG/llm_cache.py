@@ -0,0 +1,180 @@
+"""
+Persistent cache of LLM generate responses and embeddings.
+
+Entries are stored in a SQLite file keyed by the sha256 of (kind, model,
+request), where the request is the prompt plus options for generation and the
+input text for embeddings. Re-running the pipeline therefore skips every Ollama
+call whose request is byte-identical to an earlier run. When the file grows
+past its size bound, the least recently used entries are evicted.
+
+Optional keys of the ollama config:
+- `cache`: false disables the cache (default true)
+- `cache_path`: SQLite file (default db/llm_cache.db)
+- `cache_max_mb`: size bound of the cached values (default 512)
+
+The cache can also be bypassed per process with `set_cache_enabled(False)`
+(`main.py --no_cache`) or the environment variable `LLM_CACHE=0`.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.utils import load_ollama_config
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
+
+CACHE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/llm_cache.db'))
+DEFAULT_MAX_MB = 512
+# Evict down to this fraction of the bound, so eviction does not run on every insert
+EVICT_TO = 0.9
+
+_cache = None
+_enabled = os.getenv("LLM_CACHE", "1").lower() not in ("0", "false", "off")
+_lock = threading.Lock()
+
+
+class LLMCache:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache(last_used)")
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def get(self, kind, key):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses[kind] += 1
+                return None
+            self.conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits[kind] += 1
+            return row[0]
+
+    def put(self, kind, key, value):
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, kind, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, value, len(value), time.time())
+            )
+            self.size += len(value) - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TO
+        freed = 0
+        keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM cache ORDER BY last_used"):
+            if self.size - freed <= target:
+                break
+            keys.append((key,))
+            freed += size
+        self.conn.executemany("DELETE FROM cache WHERE key = ?", keys)
+        self.size -= freed
+        logger.info("[LLMCache] Evicted %s entries (%.1f MB)", len(keys), freed / 2**20)
+
+    def stats(self):
+        kinds = sorted(set(self.hits) | set(self.misses))
+        return {kind: {'hits': self.hits[kind], 'misses': self.misses[kind]} for kind in kinds}
+
+
+def set_cache_enabled(enabled):
+    """Turn the cache on or off for this process (bypass)."""
+    global _enabled
+    _enabled = enabled
+
+
+def get_cache():
+    """The process-wide cache, or None when it is disabled or cannot be opened."""
+    global _cache
+    if not _enabled:
+        return None
+    config = load_ollama_config()
+    if not config.get("cache", True):
+        return None
+    with _lock:
+        if _cache is None:
+            path = config.get("cache_path", CACHE_PATH)
+            try:
+                _cache = LLMCache(path, float(config.get("cache_max_mb", DEFAULT_MAX_MB)) * 2**20)
+            except sqlite3.Error as e:
+                logger.warning("[LLMCache] Cannot open %s (%s), caching disabled", path, e)
+                set_cache_enabled(False)
+                return None
+        return _cache
+
+
+def make_key(kind, model, request):
+    payload = json.dumps([kind, model, request], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def generate_key(model, prompt, options=None, kwargs={}):
+    return make_key('generate', model, {'prompt': prompt, 'options': options, **kwargs})
+
+
+def get_response(key):
+    """Cached generate response (a dict) for a generate_key(), or None."""
+    cache = get_cache()
+    value = cache.get('generate', key) if cache else None
+    return json.loads(value) if value is not None else None
+
+
+def put_response(key, response):
+    cache = get_cache()
+    if cache is None:
+        return
+    response = response.model_dump(mode='json') if hasattr(response, 'model_dump') else dict(response)
+    # The token context is never reused and is by far the largest field
+    response.pop('context', None)
+    cache.put('generate', key, json.dumps(response, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def get_embeddings(model, texts):
+    """Cached vectors of texts, None for the texts that are not cached."""
+    cache = get_cache()
+    if cache is None:
+        return [None] * len(texts)
+    vectors = []
+    for text in texts:
+        value = cache.get('embed', make_key('embed', model, text))
+        vectors.append(np.frombuffer(value, dtype='float32') if value is not None else None)
+    return vectors
+
+
+def put_embeddings(model, texts, vectors):
+    cache = get_cache()
+    if cache is None:
+        return
+    for text, vector in zip(texts, vectors):
+        cache.put('embed', make_key('embed', model, text), np.asarray(vector, dtype='float32').tobytes())
+
+
+def cache_stats():
+    """Hit / miss counters per kind ('generate', 'embed') of this process."""
+    return _cache.stats() if _cache is not None else {}
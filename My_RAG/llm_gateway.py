@@ -0,0 +1,211 @@
+"""
+Shared, async-capable access to the Ollama generate endpoint for all chains.
+
+All generate requests run on one background event loop through a pooled
+`AsyncClient` per host. The number of requests in flight is bounded per model,
+every attempt has a timeout, and timeouts, connection errors and 429/5xx
+responses are retried with exponential backoff.
+
+- `generate(...)` is the blocking call used by the chains; calls made from
+  several threads (e.g. the sub-questions of the name chain) run concurrently,
+- `agenerate(...)` is the coroutine version.
+
+Optional keys of the ollama config:
+- `max_in_flight`: an int for every model, or a mapping of model name to int (default 4)
+- `timeout`: seconds per attempt (default 300)
+- `retries`: extra attempts after a failure (default 2)
+
+Responses are looked up in / stored to the persistent cache of llm_cache first
+(from the default executor, the cache is blocking SQLite I/O).
+The ollama client (and its httpx / pydantic stack) is imported by the first request.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.utils import load_ollama_config
+from My_RAG import llm_cache
+from My_RAG.tracing import span
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_TIMEOUT = 300
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF = 1.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# ollama.Client / AsyncClient / ResponseError once load_ollama() ran (or stand-ins set before it)
+Client = None
+AsyncClient = None
+ResponseError = None
+
+_clients = {}
+_async_clients = {}
+_limits = {}
+_lock = threading.Lock()
+_loop = None
+
+
+def load_ollama():
+    global Client, AsyncClient, ResponseError
+    if ResponseError is None:
+        import ollama
+        Client = Client or ollama.Client
+        AsyncClient = AsyncClient or ollama.AsyncClient
+        ResponseError = ollama.ResponseError
+
+
+def get_client(host=None):
+    """
+    Blocking Client shared by the process for a host (the configured host by
+    default), with the configured timeout on every request.
+    """
+    if host is None:
+        host = load_ollama_config()["host"]
+    load_ollama()
+    with _lock:
+        if host not in _clients:
+            _clients[host] = Client(host=host, timeout=request_timeout())
+        return _clients[host]
+
+
+def get_loop():
+    """Event loop of the gateway, running in a daemon thread."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-gateway", daemon=True).start()
+        return _loop
+
+
+def max_in_flight(model):
+    limit = load_ollama_config().get("max_in_flight", DEFAULT_MAX_IN_FLIGHT)
+    if isinstance(limit, dict):
+        limit = limit.get(model, DEFAULT_MAX_IN_FLIGHT)
+    return max(1, int(limit))
+
+
+def request_timeout():
+    """Seconds allowed per request attempt."""
+    return float(load_ollama_config().get("timeout", DEFAULT_TIMEOUT))
+
+
+def request_retries():
+    return int(load_ollama_config().get("retries", DEFAULT_RETRIES))
+
+
+def max_request_time():
+    """Longest a request can take with its retries: every attempt timing out, plus the backoff between them."""
+    retries = request_retries()
+    return (retries + 1) * request_timeout() + RETRY_BACKOFF * (2 ** retries - 1)
+
+
+def is_retryable(error):
+    import httpx
+    if isinstance(error, ResponseError):
+        return error.status_code in RETRY_STATUS
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError, httpx.TransportError))
+
+
+async def _generate(prompt, model, options, host, kwargs):
+    # Runs on the gateway loop only, so the clients and semaphores below are never shared across loops
+    config = load_ollama_config()
+    model = model or config["model"]
+    host = host or config["host"]
+    load_ollama()
+    if host not in _async_clients:
+        _async_clients[host] = AsyncClient(host=host)
+    if model not in _limits:
+        _limits[model] = asyncio.Semaphore(max_in_flight(model))
+    # The cache is SQLite on disk: read and written from the default executor,
+    # so the requests in flight on the loop never wait on its I/O or its lock
+    loop = asyncio.get_running_loop()
+    with span('llm', model=model) as attributes:
+        cache_key = None
+        if not kwargs.get("stream"):
+            cache_key = llm_cache.generate_key(model, prompt, options, kwargs)
+            cached = await loop.run_in_executor(None, llm_cache.get_response, cache_key)
+            if cached is not None:
+                attributes.update(token_counts(cached), cached=True)
+                return cached
+        retries = request_retries()
+        for attempt in range(retries + 1):
+            try:
+                async with _limits[model]:
+                    response = await asyncio.wait_for(
+                        _async_clients[host].generate(model=model, prompt=prompt, options=options, **kwargs),
+                        request_timeout())
+                if cache_key is not None:
+                    await loop.run_in_executor(None, llm_cache.put_response, cache_key, response)
+                attributes.update(token_counts(response), attempts=attempt + 1)
+                return response
+            except Exception as e:
+                if attempt == retries or not is_retryable(e):
+                    raise
+                delay = RETRY_BACKOFF * 2 ** attempt
+                logger.warning("[LLMGateway] %s request failed (%s: %s), retrying in %.0fs", model, type(e).__name__, e, delay)
+                await asyncio.sleep(delay)
+
+
+def call_with_retries(call, description):
+    """
+    Blocking request (e.g. an embed call of get_client()) retried like the
+    generate requests: retryable errors are retried with exponential backoff.
+    """
+    retries = request_retries()
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = RETRY_BACKOFF * 2 ** attempt
+            logger.warning("[LLMGateway] %s request failed (%s: %s), retrying in %.0fs", description, type(e).__name__, e, delay)
+            time.sleep(delay)
+
+
+def token_counts(response):
+    """Prompt / completion token counts reported by Ollama (None for streamed responses)."""
+    if not hasattr(response, 'get'):
+        return {}
+    return {'prompt_tokens': response.get('prompt_eval_count'), 'completion_tokens': response.get('eval_count')}
+
+
+async def agenerate(prompt, model=None, options=None, host=None, **kwargs):
+    """
+    client.generate on the gateway, waiting for a free slot of the model.
+
+    Args:
+        prompt: Prompt text
+        model: Model name (the configured model by default)
+        options: Ollama generation options
+        host: Ollama host (the configured host by default)
+
+    Returns:
+        The Ollama generate response
+    """
+    coroutine = _generate(prompt, model, options, host, kwargs)
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        return await coroutine
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+
+def generate(prompt, model=None, options=None, host=None, **kwargs):
+    """Blocking agenerate(), for the synchronous chains."""
+    return run(agenerate(prompt, model, options, host, **kwargs))
+
+
+def run(coroutine):
+    """Run a coroutine on the gateway loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop()).result()
@@ -1,7 +1,13 @@
-from retriever import create_retriever, get_chunks_from_db
+from retriever import create_retriever, create_chunk_retriever, get_chunks_from_db
 from retriever import DenseRetriever
 from generator import generate_answer
-from ollama import Client
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_gateway import generate
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
 
 def llm_router_chain(query, language):
     query_text = query['query']['content']
@@ -10,7 +16,7 @@ def llm_router_chain(query, language):
     new_query = expand_query(query_text, language)
     #new_query = expand_query_2(query_text, language)
     #new_query = expand_query_3(query_text, language)  # Uses FAISS dense retrieval
-    print("new_query: ", new_query)
+    logger.debug("new_query: %s", new_query)
     # 2. Retrieve chunks
     retrieved_chunks = retrieve_chunks(new_query, language)
     # retrieved_chunks = retrieve_chunks_with_dense(new_query, language)
@@ -46,8 +52,7 @@ def expand_query(query, language="en", size=3):
         **Output Format: Organize as a list, one per line, without numbering, preamble, or conclusion.**
         """
     try:
-        client = Client()
-        response = client.generate(model="granite4:3b", prompt=prompt, stream=False)
+        response = generate(prompt=prompt, stream=False)
         expanded_keywords = [line.strip().lstrip('0123456789.)-• ')
                     for line in response.get("response", "").split('\n')
                     if line.strip()]
@@ -55,7 +60,7 @@ def expand_query(query, language="en", size=3):
         combined_query = query + " " + " ".join(expanded_keywords)
         return combined_query
     except Exception as e:
-        print(f"Error: {e}")
+        logger.warning("Error: %s", e)
         return query
 
 
@@ -75,8 +80,7 @@ def expand_query_2(query, language="en"):
         reasoning: [Your thinking process]
         answer: [Your answer]"""
     try:
-        client = Client()
-        response = client.generate(model="granite4:3b", prompt=prompt, stream=False)
+        response = generate(prompt=prompt, stream=False)
         # Extract only the reasoning part
         full_response = response.get("response", "")
         reasoning = ""
@@ -96,7 +100,7 @@ def expand_query_2(query, language="en"):
         # Combine query with reasoning only
         return query + " " + reasoning
     except Exception as e:
-        print(f"Error: {e}")
+        logger.warning("Error: %s", e)
         return query
 
 def expand_query_3(query, language="en"):
@@ -182,11 +186,10 @@ def expand_query_3(query, language="en"):
             Write your new rephrased query that is different from the old ones and has a score as high as possible.
             Write the text in square brackets."""
     
-    print("prompt: ", prompt)
+    logger.debug("prompt: %s", prompt)
     # 3. Return expanded query
     try:
-        client = Client()
-        response = client.generate(model="granite4:3b", prompt=prompt, stream=False)
+        response = generate(prompt=prompt, stream=False)
         full_response = response.get("response", "").strip()
         
         # Extract text from square brackets
@@ -199,12 +202,11 @@ def expand_query_3(query, language="en"):
             expanded_query = full_response
         return expanded_query
     except Exception as e:
-        print(f"Error: {e}")
+        logger.warning("Error: %s", e)
         return query
 
 def retrieve_chunks(query, language="en", doc_ids=[]):
-    row_chunks = get_chunks_from_db(None, doc_ids, language)
-    retriever = create_retriever(row_chunks, language)
+    retriever = create_chunk_retriever(None, doc_ids, language)
     retrieved_chunks = retriever.retrieve(query, top_k=10)
     return retrieved_chunks
 
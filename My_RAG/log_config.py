@@ -0,0 +1,79 @@
+"""
+Logging of the router pipeline.
+
+Modules log through `logger = get_logger(__name__)` (imported as
+`My_RAG.log_config`, like llm_gateway, so there is one configuration) with
+%-style arguments, e.g. `logger.debug("retrieved_chunks: %s", retrieved_chunks)`:
+the message (and the str() of a chunk list) is only built when the level is
+enabled, so leave the formatting to the logger instead of passing it an f-string.
+
+Levels come from the `logging` section of the config file:
+
+```yaml
+logging:
+  level: INFO                 # level of every module
+  format: "%(message)s"
+  levels:                     # per-module levels, by module name
+    name_router_chain: DEBUG
+  quiet: false
+```
+
+Quiet mode (`quiet: true`, `main.py --quiet` or RAG_QUIET=1) is the production
+setting: only warnings and errors are logged and the lower levels are turned off
+process-wide with `logging.disable`, so a disabled call returns on an integer
+comparison, before per-module levels or formatting are looked at.
+"""
+import logging
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.utils import load_config
+
+ROOT = 'rag'
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_FORMAT = '%(message)s'
+
+_configured = False
+
+
+def get_logger(name):
+    """Logger of a module, "rag.<module>" whether it was imported as `chunker` or `My_RAG.chunker`."""
+    if not _configured:
+        configure_logging()
+    return logging.getLogger(f"{ROOT}.{name.rsplit('.', 1)[-1]}")
+
+
+def logging_config():
+    """`logging` section of the config file, {} without one (or without a config file)."""
+    try:
+        return load_config().get('logging') or {}
+    except FileNotFoundError:
+        return {}
+
+
+def configure_logging(quiet=None):
+    """
+    (Re)configure the "rag" loggers from the config file; `quiet` overrides its
+    `quiet` setting (None keeps it).
+    """
+    global _configured
+    _configured = True
+    config = logging_config()
+    if quiet is None:
+        quiet = bool(config.get('quiet', False)) or os.environ.get('RAG_QUIET', '') not in ('', '0')
+
+    root = logging.getLogger(ROOT)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(config.get('format', DEFAULT_FORMAT)))
+    root.handlers = [handler]
+    root.propagate = False
+    root.setLevel(str(config.get('level', DEFAULT_LEVEL)).upper())
+    for module, level in (config.get('levels') or {}).items():
+        logging.getLogger(f"{ROOT}.{module}").setLevel(str(level).upper())
+
+    if quiet:
+        root.setLevel(logging.WARNING)
+        logging.disable(logging.INFO)
+    else:
+        logging.disable(logging.NOTSET)
+    return quiet
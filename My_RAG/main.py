@@ -1,34 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from tqdm import tqdm
 from utils import load_jsonl, save_jsonl
-from chunker import chunk_documents
-from runtime_chunker import chunk_row_chunks
-from retriever import create_retriever, get_chunks_from_db
 from generator import generate_answer
 import argparse
 from router import router
-from embedding_retriever import embedding_retriever
 from router_utils import cache_document_names
-from rank_bm25 import BM25Okapi
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_cache import set_cache_enabled, cache_stats
+from My_RAG.semantic_cache import get_semantic_cache, MODES, MAX_DISTANCE, DEFAULT_MAX_MB
+from My_RAG.tracing import trace_query, trace_path, write_traces, summarize, format_summary
+from My_RAG.log_config import get_logger, configure_logging
 
-def main(query_path, docs_path, language, output_path):
+logger = get_logger(__name__)
+
+LANGUAGES = ['en', 'zh']
+WARMUP_WORKERS = 4
+
+def answer_query(query, language, cache=None, cache_mode="off", traces=None):
+    with trace_query(query['query']['query_id']) as trace:
+        answer_traced_query(query, language, cache, cache_mode)
+    if traces is not None:
+        traces.append(trace)
+    return query
+
+def answer_traced_query(query, language, cache=None, cache_mode="off"):
+    query_text = query['query']['content']
+    logger.info("Routing query[%s]: %s", query['query']['query_id'], query_text)
+    try:
+        hit = embedding = None
+        if cache is not None:
+            embedding, hit = cache.lookup(query_text, language)
+        if hit is None:
+            # Route query to chains
+            answer, return_chunks = router(query, language)
+            if cache is not None:
+                cache.store(query_text, language, answer, [chunk["page_content"] for chunk in return_chunks], embedding)
+        else:
+            logger.info("[SemanticCache] reusing the %s of: %s (distance %.4f)", cache_mode, hit['query'], hit['distance'])
+            return_chunks = [{"page_content": reference} for reference in hit['references']]
+            answer = hit['answer'] if cache_mode == "answer" else generate_answer(query_text, return_chunks, language)
+    except Exception:
+        # A failing query gets an empty prediction instead of aborting the whole batch
+        logger.exception("Error processing query[%s]:", query['query']['query_id'])
+        answer, return_chunks = "", []
+    # save answer and chunks
+    query["prediction"]["content"] = answer
+    query["prediction"]["references"] = [chunk["page_content"] for chunk in return_chunks]
+    return query
+
+def warmup(languages):
+    """
+    Start loading in background threads what the first queries would otherwise
+    load: the chains, and the name matcher, BM25 index, token store, tokenizer
+    and sentence splitter of each language. Returns the futures of the loads.
+    """
+    from router import load_chains
+    from router_utils import get_name_matcher
+    from bm25_index import load_bm25_index
+    from token_store import load_token_store
+    from tokenizer import tokenize
+    from runtime_chunker import split_sentences
+    tasks = [load_chains]
+    for language in languages:
+        tasks += [partial(get_name_matcher, language), partial(load_bm25_index, language),
+                  partial(load_token_store, language), partial(tokenize, "warm up", language),
+                  partial(split_sentences, "Warm up. Done.", language)]
+    # nltk and jieba are imported under the locks of tokenizer.load_nltk / load_jieba,
+    # so the tasks need no ordering
+    executor = ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup")
+    futures = [executor.submit(task) for task in tasks]
+    executor.shutdown(wait=False)
+    return futures
+
+def main(query_path, docs_path, language, output_path, workers=1, use_cache=True,
+         semantic_cache="off", semantic_cache_distance=MAX_DISTANCE, trace=True, warm=False,
+         semantic_cache_max_mb=DEFAULT_MAX_MB):
+    if not use_cache:
+        set_cache_enabled(False)
+    # Preload while the document names and queries are read
+    futures = warmup([language] if language else LANGUAGES) if warm else []
+    cache = get_semantic_cache(max_distance=semantic_cache_distance, max_mb=semantic_cache_max_mb) if semantic_cache != "off" else None
     # 0. Cache document names at startup (for LLM-based routing)
-    print("Caching document names from database...")
+    logger.info("Caching document names from database...")
     cache_document_names(language)
     
     # 1. Load Queries
     queries = load_jsonl(query_path)
+    traces = [] if trace else None
+    for future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            # The query that needs it loads it again (and reports the error)
+            logger.warning("Warmup failed: %s", e)
 
-    for query in tqdm(queries, desc="Processing Queries"):
-        print("Routing query[{}]: {}".format(query['query']['query_id'], query['query']['content']))
-        # Route query to chains
-        answer, return_chunks = router(query, language)
-        # save answer and chunks
-        query["prediction"]["content"] = answer
-        query["prediction"]["references"] = [chunk["page_content"] for chunk in return_chunks]
+    if workers > 1:
+        # Queries run concurrently; in-flight LLM requests are bounded per model by llm_gateway.
+        # map() keeps the input order, so the output file is identical to a serial run.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(tqdm(executor.map(lambda query: answer_query(query, language, cache, semantic_cache, traces), queries),
+                      total=len(queries), desc="Processing Queries"))
+    else:
+        for query in tqdm(queries, desc="Processing Queries"):
+            answer_query(query, language, cache, semantic_cache, traces)
 
     save_jsonl(output_path, queries)
     print("Predictions saved.")
     print(output_path)
+    for kind, counts in cache_stats().items():
+        print(f"LLM cache [{kind}]: {counts['hits']} hits, {counts['misses']} misses")
+    if cache is not None:
+        print(f"Semantic cache: {cache.hits} hits, {cache.misses} misses")
+    if traces:
+        # In input order, whatever order the workers finished in
+        order = {query['query']['query_id']: index for index, query in enumerate(queries)}
+        traces.sort(key=lambda trace: order.get(trace.query_id, len(order)))
+        write_traces(trace_path(output_path), traces)
+        print(f"Traces saved to {trace_path(output_path)}")
+        print(format_summary(summarize(traces)))
     print("=====================================")
 
 if __name__ == "__main__":
@@ -37,5 +129,20 @@ if __name__ == "__main__":
     parser.add_argument('--docs_path', help='Path to the documents file')
     parser.add_argument('--language', help='Language to filter queries (zh or en), if not specified, process all')
     parser.add_argument('--output', help='Path to the output file')
+    parser.add_argument('--workers', type=int, default=1, help='Number of queries processed concurrently [default: 1]')
+    parser.add_argument('--no_cache', action='store_true', help='Bypass the persistent LLM / embedding cache')
+    parser.add_argument('--semantic_cache', choices=MODES, default='off',
+                        help='Reuse the answer (answer) or the references (retrieval) of a near-duplicate answered query [default: off]')
+    parser.add_argument('--semantic_cache_distance', type=float, default=MAX_DISTANCE,
+                        help=f'Largest cosine distance of a near-duplicate query [default: {MAX_DISTANCE}]')
+    parser.add_argument('--semantic_cache_max_mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'Size bound of the semantic cache, least recently used answers are evicted [default: {DEFAULT_MAX_MB}]')
+    parser.add_argument('--no_trace', action='store_true', help='Do not write the per-query stage trace next to the output file')
+    parser.add_argument('--quiet', action='store_true', help='Only log warnings and errors (see the logging section of the config)')
+    parser.add_argument('--warmup', action='store_true', help='Preload the chains, indexes and tokenizers while the queries are loaded')
     args = parser.parse_args()
-    main(args.query_path, args.docs_path, args.language, args.output)
+    if args.quiet:
+        configure_logging(quiet=True)
+    main(args.query_path, args.docs_path, args.language, args.output, args.workers, not args.no_cache,
+         args.semantic_cache, args.semantic_cache_distance, not args.no_trace, args.warmup,
+         args.semantic_cache_max_mb)
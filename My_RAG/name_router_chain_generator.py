@@ -2,12 +2,17 @@ from chunker import chunk_documents
 from runtime_chunker import chunk_row_chunks
 from retriever import create_retriever, get_chunks_from_db
 from rank_bm25 import BM25Okapi
-from utils import load_ollama_config
-from ollama import Client
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_gateway import generate
+from My_RAG.log_config import get_logger
 import ast
 from generator import generate_answer
 import json
 
+logger = get_logger(__name__)
+
 def query_classifier(query, language="en"):
     if (language == 'en'):
         prompt = """
@@ -73,17 +78,15 @@ Reasoning: [One sentence explaining why]
 Label: [SIMPLE or COMPLEX]
     """
     prompt = prompt.format(query=query)
-    print("query_classifier: ", prompt)
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    logger.debug("query_classifier: %s", prompt)
+    response = generate(options={
          "temperature": 0.1, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
          "top_p": 0.9,
          "top_k": 40,
          "max_tokens": 2048,
         #  "stream": True,
     }, prompt=prompt)
-    print("query_classifier: ", response["response"])
+    logger.debug("query_classifier: %s", response["response"])
     return response["response"]
 
 def generate_complex_answer(query, docs, language="en"):
@@ -154,9 +157,7 @@ Answer in Simplified Chinese.
 ### Final Answer(Simplified Chinese)
 '''
     prompt = prompt.format(context="\n".join([doc['content'] for doc in docs]), query=query)
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
         "num_ctx": 32768,
         "temperature": 0.3, 
         "max_tokens": 1024,
@@ -188,14 +189,12 @@ User Query: {query}
 """
 
     prompt = prompt.format(query=query, doc_names=doc_names)
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
          "temperature": 0.1, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
     }, prompt=prompt)
 
     queries = response["response"]
-    print("queries: ", queries)
+    logger.debug("queries: %s", queries)
     return queries
 
 
@@ -223,9 +222,7 @@ Context:
     context = "\n".join([chunk['page_content'] for chunk in context])
     prompt = prompt.format(query=query, context=context)
     
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
          "temperature": 0.3, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
          "max_tokens": 1024,
          "top_p": 0.9,
@@ -236,7 +233,7 @@ Context:
     }, prompt=prompt)
 
     answer = response["response"]
-    print("answer: ", answer)
+    logger.debug("answer: %s", answer)
     return answer
 
 def generate_combined_questions_answer(original_query, queries, combined_answers, combined_chunks, language="en", doc_names=[]): 
@@ -298,16 +295,14 @@ You are a concise synthesis assistant. Your goal is to construct a single, direc
     sub_query = "\n\n".join([f"Question: {query[1]}\nAnswer: {answer}" for query, answer in zip(queries, combined_answers)])
     prompt = prompt.format(query=original_query, context=context, sub_query=sub_query)
     
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
          "temperature": 0.3, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
          "max_tokens": 1024,
          "stop": ["\n\n"],
     }, prompt=prompt)
 
     answer = response["response"]
-    print("answer: ", answer)
+    logger.debug("answer: %s", answer)
     return answer
 
 def compare_then_generate_answer(original_query, queries, combined_answers, combined_chunks, language="en", doc_names=[]): 
@@ -375,16 +370,14 @@ You are a precise data comparison assistant.
     sub_query = "\n\n".join([f"Question: {query[1]}\nAnswer: {answer}" for query, answer in zip(queries, combined_answers)])
     prompt = prompt.format(query=original_query, context=context, sub_query=sub_query)
     
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
          "temperature": 0.1, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
          "max_tokens": 1024,
          "stop": ["\n\n"],
     }, prompt=prompt)
 
     answer = response["response"]
-    print("compare answer: ", answer)
+    logger.debug("compare answer: %s", answer)
 
     if language == "en":
         final_prompt="""
@@ -465,16 +458,14 @@ Your task is to convert these into a single, grammatically correct, and strictly
 """
     context = "\n\n".join([chunk['metadata']['name'] + ": " + chunk['page_content'] for chunk in combined_chunks])
     prompt = final_prompt.format(answer=answer, query=original_query, context=context)
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
          "temperature": 0.1, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
          "max_tokens": 1024,
          "stop": ["\n\n"],
     }, prompt=prompt)
 
     answer = response["response"]
-    print("final compare answer: ", answer)
+    logger.debug("final compare answer: %s", answer)
 
     return answer
 
@@ -529,9 +520,7 @@ You are a helpful Q&A assistant. Answer the user's question using ONLY the provi
 ### Answer
         """
     prompt = prompt.format(context="\n".join([doc['content'] for doc in docs]), query=query)
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
         "num_ctx": 32768,
         "temperature": 0.3, # [0.0, 1.0], 0.0 is more deterministic, 1.0 is more random and creative
         "max_tokens": 1024,
@@ -539,6 +528,6 @@ You are a helpful Q&A assistant. Answer the user's question using ONLY the provi
     }, prompt=prompt)
 
     answer = response["response"]
-    print("final compare answer: ", answer)
+    logger.debug("final compare answer: %s", answer)
     return answer
     
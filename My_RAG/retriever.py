@@ -1,104 +1,154 @@
 from rank_bm25 import BM25Okapi
-import jieba
-from nltk.stem import PorterStemmer
-import re
-from ollama import Client
-from utils import load_ollama_config
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.embedding_service import get_embedding_service
+from My_RAG.tracing import traced
+from My_RAG.log_config import get_logger
+from tokenizer import cached_tokenize
+from token_store import tokenize_corpus
+from bm25_index import load_bm25_index, is_short_chunk, CHUNK_SEPARATOR
+
+logger = get_logger(__name__)
 
 class BM25Retriever:
+    @traced('bm25_build')
     def __init__(self, chunks, language="en"):
         self.chunks = chunks
         self.language = language
         self.corpus = [chunk['page_content'] for chunk in chunks]
-        self.stopwords = []
-        self.stemmer = PorterStemmer()
-        
-        if language == "zh":
-            self.tokenized_corpus = [list(jieba.cut(doc)) for doc in self.corpus]
-        else:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            stopwords_path = os.path.join(script_dir, 'english.stop')
-            self.stopwords = open(stopwords_path, 'r').read().split()
-            self.tokenized_corpus = []
-            for doc in self.corpus:
-                tokens = self.clean(doc).split()
-                tokens = [token for token in tokens if token not in self.stopwords]
-                stemmed_tokens = [self.stemmer.stem(token) for token in tokens]
-                self.tokenized_corpus.append(stemmed_tokens)
-        
+        self.tokenized_corpus = tokenize_corpus(chunks, language)
         self.bm25 = BM25Okapi(self.tokenized_corpus)
+        self.doc_len = np.array(self.bm25.doc_len)
 
-    def clean(self, string):
-        string = string.lower()
-        # Remove punctuation
-        string = re.sub(r"[.,!?;:'\"()]", " ", string)
-        # Normalize whitespace
-        string = re.sub(r"\s+", " ", string)
-        return string.strip()
-
+    @traced('bm25_score')
     def retrieve(self, query, top_k=5, top1_check=False, threshold=0):
-        if self.language == "zh":
-            tokenized_query = list(jieba.cut(query))
-        else:
-            tokens = self.clean(query).split()
-            tokens = [token for token in tokens if token not in self.stopwords]
-            tokenized_query = [self.stemmer.stem(token) for token in tokens]
-
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        # Get top_k indices sorted by score
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
-        
-        # Filter by threshold (since sorted, can cut off when score drops below threshold)
-        if threshold > -1:
-            filtered_indices = []
-            for idx in top_indices:
-                if scores[idx] > threshold:
-                    filtered_indices.append(idx)
-                else:
-                    break  # Scores are sorted, so we can stop here
-            top_indices = filtered_indices
-        
-        # Apply top1_check if needed
-        if top1_check and len(top_indices) > 1:
-            top_score = scores[top_indices[0]]
-            # Keep only chunks with score > top_score/2
-            filtered = []
-            for idx in top_indices:
-                if scores[idx] > top_score/2:
-                    filtered.append(idx)
-                else:
-                    break
-            top_indices = filtered
-        
+        scores = self.bm25.get_scores(cached_tokenize(query, self.language))
+        top_indices = rank_indices(scores, top1_check, threshold)
         # Get the actual chunks
         top_chunks = [self.chunks[i] for i in top_indices]
         return top_chunks
 
+    @traced('bm25_score')
+    def retrieve_many(self, queries, top_k=5, top1_check=False, threshold=0):
+        """retrieve() for several queries, scored together in one score matrix."""
+        scores = self.get_score_matrix([cached_tokenize(query, self.language) for query in queries])
+        return [[self.chunks[i] for i in rank_indices(scores[:, q], top1_check, threshold)]
+                for q in range(len(queries))]
+
+    def get_score_matrix(self, queries_tokens):
+        """BM25Okapi.get_scores of every tokenized query, one column per query."""
+        bm25 = self.bm25
+        columns = [np.zeros(len(self.chunks))]
+        column_of = {}
+        for tokens in queries_tokens:
+            for q in tokens:
+                if q in column_of:
+                    continue
+                q_freq = np.array([(doc.get(q) or 0) for doc in bm25.doc_freqs])
+                column_of[q] = len(columns)
+                columns.append((bm25.idf.get(q) or 0) * (q_freq * (bm25.k1 + 1) /
+                                                         (q_freq + bm25.k1 * (1 - bm25.b + bm25.b * self.doc_len / bm25.avgdl))))
+        weights = np.stack(columns, axis=1)
+        width = max((len(tokens) for tokens in queries_tokens), default=0)
+        # Column 0 is all zeros and pads the shorter queries
+        padded = np.zeros((len(queries_tokens), width), dtype=np.int64)
+        for i, tokens in enumerate(queries_tokens):
+            padded[i, :len(tokens)] = [column_of[q] for q in tokens]
+        # Add the terms in query order so every column equals BM25Okapi.get_scores exactly
+        score = np.zeros((len(self.chunks), len(queries_tokens)))
+        for j in range(width):
+            score += weights[:, padded[:, j]]
+        return score
+
+class IndexedBM25Retriever:
+    """BM25 retriever over a subset of the prebuilt chunk index (see bm25_index.py)."""
+
+    @traced('bm25_build')
+    def __init__(self, index, prediction=None, doc_id=[], language="en"):
+        self.index = index
+        self.language = language
+        self.units = index.units(index.select(prediction, doc_id))
+
+    @traced('bm25_score')
+    def retrieve(self, query, top_k=5, top1_check=False, threshold=0):
+        scores = self.index.get_scores(cached_tokenize(query, self.language), self.units)
+        top_indices = rank_indices(scores, top1_check, threshold)
+        return self.get_unit_chunks(top_indices)
+
+    @traced('bm25_score')
+    def retrieve_many(self, queries, top_k=5, top1_check=False, threshold=0):
+        """retrieve() for several queries, scored together in one score matrix."""
+        scores = self.index.get_score_matrix([cached_tokenize(query, self.language) for query in queries], self.units)
+        ranked = [rank_indices(scores[:, q], top1_check, threshold) for q in range(len(queries))]
+        # One chunk lookup for all the queries
+        units = np.unique(np.concatenate(ranked)) if ranked else np.zeros(0, dtype=np.int64)
+        chunk_of = dict(zip(units.tolist(), self.get_unit_chunks(units)))
+        return [[chunk_of[u] for u in top_indices.tolist()] for top_indices in ranked]
+
+    def get_unit_chunks(self, unit_indices):
+        """Build chunk dicts shaped like get_chunks_from_db rows for the given units."""
+        members = self.index.unit_ids(self.units, unit_indices)
+        rows = get_chunks_by_ids([chunk_id for ids in members for chunk_id in ids])
+        chunks = []
+        for ids in members:
+            content = CHUNK_SEPARATOR.join(rows[chunk_id][1] for chunk_id in ids)
+            chunks.append({"id": ids[-1], "page_content": content, "name": rows[ids[-1]][0]})
+        return chunks
+
+def rank_indices(scores, top1_check=False, threshold=0):
+    """
+    Indices of the scores sorted from best to worst, keeping only scores above
+    the threshold (if threshold > -1) and, with top1_check, above half the top score.
+    Ties keep their corpus order, like a stable sort.
+    """
+    scores = np.asarray(scores)
+    if threshold > -1:
+        candidates = np.flatnonzero(scores > threshold)
+    else:
+        candidates = np.arange(len(scores))
+    top_indices = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    # Apply top1_check if needed
+    if top1_check and len(top_indices) > 1:
+        top_score = scores[top_indices[0]]
+        # Keep only chunks with score > top_score/2
+        top_indices = top_indices[scores[top_indices] > top_score/2]
+    return top_indices
+
 def create_retriever(chunks, language):
     """Creates a BM25 retriever from document chunks."""
     return BM25Retriever(chunks, language)
 
-import sqlite3
-import os
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/dataset.db'))
+def create_chunk_retriever(prediction, doc_id, language):
+    """
+    Creates a BM25 retriever over the chunks get_chunks_from_db would return,
+    using the prebuilt index when available instead of re-tokenizing the chunks.
+    """
+    index = load_bm25_index(language)
+    if index is None:
+        return create_retriever(get_chunks_from_db(prediction, doc_id, language), language)
+    return IndexedBM25Retriever(index, prediction, doc_id, language)
 
+from data_access import get_connection
+
+@traced('db_fetch')
 def get_chunks_from_db(prediction, doc_id, language):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     if (prediction and doc_id):
         placeholders = ','.join('?' for _ in doc_id)
-        cursor.execute(f"SELECT id, name, content FROM chunks WHERE doc_id IN ({placeholders})", doc_id)
+        cursor.execute(f"SELECT id, name, content FROM chunks WHERE doc_id IN ({placeholders}) ORDER BY id", doc_id)
         rows = cursor.fetchall()
         if not rows:
             return []
     elif (prediction):
-        cursor.execute(f"SELECT id, name, content FROM chunks WHERE domain = ? and language = ?", (prediction, language))
+        cursor.execute(f"SELECT id, name, content FROM chunks WHERE domain = ? and language = ? ORDER BY id", (prediction, language))
         rows = cursor.fetchall()
         if not rows:
             return []
     else:
-        cursor.execute("SELECT id, name, content FROM chunks where language = ?", (language,))
+        cursor.execute("SELECT id, name, content FROM chunks where language = ? ORDER BY id", (language,))
         rows = cursor.fetchall()
         if not rows:
             return []
@@ -108,19 +158,26 @@ def get_chunks_from_db(prediction, doc_id, language):
         if (index == len(rows) - 1):
             chunks.append({"id": row[0], "page_content": row[2], "name": row[1]})
             break
-        if language == "zh":
-            if (len(row[2]) < 10 and index < len(rows) - 1):
-                # together with the next chunk
-                rows[index+1][2] = row[2] +'. ' + rows[index+1][2]
-                continue
-        else:
-            if (len(row[2]) < 30 and index < len(rows) - 1):
-                # together with the next chunk
-                rows[index+1][2] = row[2] +'. ' + rows[index+1][2]
-                continue
+        if (is_short_chunk(row[2], language) and index < len(rows) - 1):
+            # together with the next chunk
+            rows[index+1][2] = row[2] + CHUNK_SEPARATOR + rows[index+1][2]
+            continue
         chunks.append({"id": row[0], "page_content": row[2], "name": row[1]})
     return chunks
 
+@traced('db_fetch')
+def get_chunks_by_ids(chunk_ids):
+    """Returns {chunk id: (name, content)} for the given chunk ids."""
+    cursor = get_connection().cursor()
+    rows = {}
+    for start in range(0, len(chunk_ids), 500):
+        batch = chunk_ids[start:start + 500]
+        placeholders = ','.join('?' for _ in batch)
+        cursor.execute(f"SELECT id, name, content FROM chunks WHERE id IN ({placeholders})", batch)
+        for row in cursor.fetchall():
+            rows[row[0]] = (row[1], row[2])
+    return rows
+
 class DenseRetriever:
     """Dense retriever using FAISS pre-computed embeddings."""
     
@@ -140,45 +197,28 @@ class DenseRetriever:
         self.use_faiss = use_faiss
         self.corpus = [chunk['page_content'] for chunk in chunks]
         
-        # Load Ollama configuration for host
-        ollama_config = load_ollama_config()
-        self.client = Client(host=ollama_config["host"])
+        # Shared Ollama client that batches embedding requests
+        self.embedder = get_embedding_service(embedding_model)
         
         if use_faiss:
-            # Load pre-computed FAISS index
-            import faiss
-            import json
-            from pathlib import Path
-            
-            faiss_dir = Path(__file__).parent.parent / "db" / "faiss" / "chunks" / language
-            index_path = faiss_dir / f"{language}.index"
-            mapping_path = faiss_dir / f"{language}_mapping.json"
-            
-            if not index_path.exists():
-                raise FileNotFoundError(f"FAISS index not found: {index_path}")
-            
-            print(f"[DenseRetriever] Loading FAISS index from {index_path}...")
-            self.faiss_index = faiss.read_index(str(index_path))
+            # Pre-computed FAISS index, shared by every retriever in the process
+            from faiss_registry import get_faiss_index, index_paths
             
-            # Load mapping (FAISS ID -> Chunk ID)
-            with open(mapping_path, 'r') as f:
-                self.faiss_to_chunk_id = json.load(f)
-                # Convert string keys to int
-                self.faiss_to_chunk_id = {int(k): v for k, v in self.faiss_to_chunk_id.items()}
+            self.faiss_entry = get_faiss_index("chunks", language)
+            if self.faiss_entry is None:
+                raise FileNotFoundError(f"FAISS index not found: {index_paths('chunks', language)[0]}")
+            self.faiss_index = self.faiss_entry.index
             
             # Create chunk_id to index mapping
             self.chunk_id_to_idx = {chunk['id'] if 'id' in chunk else i: i 
                                    for i, chunk in enumerate(chunks)}
             
-            print(f"[DenseRetriever] Loaded FAISS index with {self.faiss_index.ntotal} vectors")
+            logger.info("[DenseRetriever] Using FAISS index with %s vectors", self.faiss_index.ntotal)
         else:
             # Generate embeddings on-the-fly (slow!)
-            print(f"[DenseRetriever] Generating embeddings for {len(self.corpus)} chunks using {embedding_model}...")
-            self.chunk_embeddings = []
-            for doc in self.corpus:
-                response = self.client.embeddings(model=self.embedding_model, prompt=doc)
-                self.chunk_embeddings.append(response['embedding'])
-            print(f"[DenseRetriever] Embeddings generated successfully")
+            logger.info("[DenseRetriever] Generating embeddings for %s chunks using %s...", len(self.corpus), embedding_model)
+            self.chunk_embeddings = list(self.embedder.embed(self.corpus))
+            logger.debug("[DenseRetriever] Embeddings generated successfully")
 
     def cosine_similarity(self, vec1, vec2):
         import numpy as np
@@ -186,6 +226,7 @@ class DenseRetriever:
         vec2 = np.array(vec2)
         return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
 
+    @traced('dense_retrieve')
     def retrieve(self, query, top_k=5, top1_check=False, threshold=0):
         """
         Retrieve top-k most similar chunks using embedding similarity.
@@ -201,8 +242,7 @@ class DenseRetriever:
             List of top-k most similar chunks
         """
         # Generate query embedding
-        query_response = self.client.embeddings(model=self.embedding_model, prompt=query)
-        query_embedding = query_response['embedding']
+        query_embedding = self.embedder.embed_query(query)[0]
         
         if self.use_faiss:
             # Use FAISS search
@@ -215,11 +255,10 @@ class DenseRetriever:
             # Convert L2 distances to cosine similarities (approximate)
             # For normalized vectors: cosine_sim ≈ 1 - (L2_dist^2 / 2)
             similarities = []
-            for faiss_idx, dist in zip(faiss_indices[0], distances[0]):
-                if faiss_idx == -1:  # FAISS returns -1 for empty results
+            for chunk_id, dist in zip(self.faiss_entry.label_ids(faiss_indices[0]).tolist(), distances[0]):
+                if chunk_id == -1:  # FAISS returns -1 for empty results
                     continue
-                chunk_id = self.faiss_to_chunk_id.get(int(faiss_idx))
-                if chunk_id is not None and chunk_id in self.chunk_id_to_idx:
+                if chunk_id in self.chunk_id_to_idx:
                     chunk_idx = self.chunk_id_to_idx[chunk_id]
                     # Convert L2 distance to approximate cosine similarity
                     sim = 1 - (dist / 2)
@@ -242,7 +281,7 @@ class DenseRetriever:
         top_indices = [idx for idx, sim in similarities[:top_k]]
         top_scores = [sim for idx, sim in similarities[:top_k]]
         
-        print(f"[DenseRetriever] Top {len(top_scores)} similarities: {[f'{s:.3f}' for s in top_scores[:5]]}")
+        logger.debug("[DenseRetriever] Top %s similarities: %s", len(top_scores), np.round(top_scores[:5], 3))
         
         # Filter by threshold
         if threshold > 0:
@@ -254,7 +293,7 @@ class DenseRetriever:
                     filtered_scores.append(score)
                 else:
                     break
-            print(f"[DenseRetriever] Threshold={threshold}: {len(top_indices)} → {len(filtered_indices)} chunks")
+            logger.debug("[DenseRetriever] Threshold=%s: %s → %s chunks", threshold, len(top_indices), len(filtered_indices))
             top_indices = filtered_indices
             top_scores = filtered_scores
         
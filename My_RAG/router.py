@@ -1,18 +1,28 @@
 import re
+import importlib
 import numpy as np
-from ollama import Client
 import os
 import sys
-from summary_router_chain import summary_router_chain
-from name_router_chain import name_router_chain
-from time_router_chain import time_router_chain
-from default_chain import default_chain
-from llm_router_chain import llm_router_chain
 from entity_extractor import extract_entities
+from router_utils import get_name_matcher
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../db')))
-from Connection import Connection
-DB_PATH = "db/dataset.db"
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.tracing import span
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
+
+# The chains (and the retrievers and models they use) are imported when a query
+# is first routed to them, or all at once by load_chains (main.py --warmup)
+CHAINS = ['summary_router_chain', 'name_router_chain', 'time_router_chain', 'llm_router_chain']
+
+def get_chain(name):
+    """The function `name` of the module `name`, e.g. get_chain('time_router_chain')."""
+    return getattr(importlib.import_module(name), name)
+
+def load_chains():
+    for name in CHAINS:
+        get_chain(name)
 
 def is_summary_router(query, language):
     query_text = query['query']['content']
@@ -27,41 +37,43 @@ def is_summary_router(query, language):
 def router(query, language="en"):
     ## Step 0. Extract entities from query
     query_text = query['query']['content']
-    entities = extract_entities(query_text, language, use_llm=False)  # Use regex for speed
-    print(f"[Router] Extracted entities: {entities}")
+    with span('entity_extraction'):
+        entities = extract_entities(query_text, language, use_llm=False)  # Use regex for speed
+    logger.info("[Router] Extracted entities: %s", entities)
     
     ## Step 1. keywords matching
-    prediction, doc_id, matched_name, name_entities = name_matcher(query, language)
+    with span('name_matching'):
+        prediction, doc_id, matched_name, name_entities = name_matcher(query, language)
     # Merge entities from name_matcher
     for key in entities:
         if name_entities.get(key):
             entities[key] = list(set(entities[key] + name_entities[key]))
     
-    print("[Router] matching result: ", prediction, doc_id, matched_name)
+    logger.info("[Router] matching result: %s %s %s", prediction, doc_id, matched_name)
 
     ## Step 2. summary chain
     if (is_summary_router(query, language)):
-        print("[Router][2] summary chain")
-        return summary_router_chain(query, language, doc_id)
+        logger.info("[Router][2] summary chain")
+        return get_chain('summary_router_chain')(query, language, doc_id)
     
     ## Step 3. name_router chain
     if (prediction):
-        print("[Router][3] name_router chain")
-        return name_router_chain(query, language, prediction, doc_id, matched_name)
+        logger.info("[Router][3] name_router chain")
+        return get_chain('name_router_chain')(query, language, prediction, doc_id, matched_name)
 
     ## Step 4. time_router chain (if temporal entities found)
     if (entities['years'] or entities['months'] or entities['dates']):
-        print("[Router][4] time_router chain")
-        print(f"[Router] Using temporal filter: years={entities['years']}, months={entities['months']}")
-        return time_router_chain(query, language, doc_id)
+        logger.info("[Router][4] time_router chain")
+        logger.info("[Router] Using temporal filter: years=%s, months=%s", entities['years'], entities['months'])
+        return get_chain('time_router_chain')(query, language, doc_id)
     
     ## Step 5. LLM chain
-    print("[Router][5] LLM chain")
-    return llm_router_chain(query, language)
+    logger.info("[Router][5] LLM chain")
+    return get_chain('llm_router_chain')(query, language)
 
     ## Step 6. fallback to old default chain
     # print("[Router][4] fallback to old default chain")
-    # return default_chain(query, language)
+    # return get_chain('default_chain')(query, language)
 
 def name_matcher(query, language="en"):
     """
@@ -78,46 +90,30 @@ def name_matcher(query, language="en"):
     # Extract temporal entities from query
     entities = extract_entities(content, language, use_llm=False)
 
-    # string matching logic
-    conn = Connection(DB_PATH)
-    rows = conn.execute("SELECT domain, name, doc_id FROM documents WHERE language = ?", (language,))
+    # string matching logic: one pass of the name automaton over the query,
+    # then only the names containing a found part are checked (in name order)
+    automaton, names, pattern_names = get_name_matcher(language)
+    found = automaton.find(content)
     name_docs = {}
-    for row in rows:
-        domain = row[0]
-        name = row[1]
-        if name not in name_docs:
-            name_docs[name] = {
-                'doc_id': [],
-                'domain': domain
-            }
-        name_docs[name]['doc_id'].append(row[2])
-
-    for name in name_docs:
-        if (name_docs[name]['domain'] == 'Law'):
-            match = False
-            if (language == 'en'):
-                split_name = name.split(',')
-                match = True
-                for i in range(0, len(split_name)):
-                    if split_name[i] not in content:
-                        match = False
-                        break
-            else:
-                match = name in content
-            if (match):
+    for position in sorted({position for part in found for position in pattern_names[part]}):
+        name, info, parts = names[position]
+        name_docs[name] = (info, parts)
+        if (info['domain'] == 'Law'):
+            # English names match when every comma-separated part occurs
+            if all(part in found for part in parts):
                 prediction = 'Law'
-                doc_id.extend(name_docs[name]['doc_id'])
+                doc_id.extend(info['doc_ids'])
                 matched_name.append(name)
-        elif (name_docs[name]['domain'] == 'Medical'):
-            hospital_name = name.split("_")[0]
-            if (hospital_name in content):
+        elif (info['domain'] == 'Medical'):
+            # hospital name
+            if (parts[0] in found):
                 prediction = 'Medical'
-                doc_id.extend(name_docs[name]['doc_id'])
+                doc_id.extend(info['doc_ids'])
                 matched_name.append(name)
-        elif (name_docs[name]['domain'] == 'Finance'):
-            if (name in content):
+        elif (info['domain'] == 'Finance'):
+            if (parts[0] in found):
                 prediction = 'Finance'
-                doc_id.extend(name_docs[name]['doc_id']) 
+                doc_id.extend(info['doc_ids'])
                 matched_name.append(name)
     if (prediction):
         doc_id = list(set(doc_id)) # Ensure unique doc_ids
@@ -127,9 +123,10 @@ def name_matcher(query, language="en"):
                 new_matched_name = []
                 for name in matched_name:
                     hospital_name = name.split("_")[0]
-                    user_name = name.split("_")[1]
-                    if (user_name in content):
-                        new_doc_id.extend(name_docs[name]['doc_id'])
+                    info, parts = name_docs[name]
+                    # patient name
+                    if (len(parts) > 1 and parts[1] in found):
+                        new_doc_id.extend(info['doc_ids'])
                         new_matched_name.append(hospital_name)
                 if (new_doc_id):
                     doc_id = new_doc_id
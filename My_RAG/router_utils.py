@@ -1,17 +1,25 @@
 import re
 import os
 import sys
-from ollama import Client
 from typing import Dict
+from aho_corasick import AhoCorasick
+from data_access import get_connection
+from sentence_search import has_document_sentences, search_document_sentences, simple_stem
 # Add parent directory to path to import Connection
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../db')))
 from Connection import Connection
-from utils import load_ollama_config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_gateway import generate
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
 
 DB_PATH = "db/dataset.db"
 
 # Global cache for document names (shared across routing modules)
 _DOCUMENT_CACHE = None
+# Compiled name automaton per language (see get_name_matcher)
+_NAME_MATCHERS = {}
 
 
 def cache_document_names(language: str = None) -> Dict[str, Dict]:
@@ -40,12 +48,10 @@ def cache_document_names(language: str = None) -> Dict[str, Dict]:
             return {k: v for k, v in _DOCUMENT_CACHE.items() if v['language'] == language}
         return _DOCUMENT_CACHE
     
-    conn = Connection(DB_PATH)
+    conn = get_connection()
     
-    if language:
-        cursor = conn.execute("SELECT doc_id, domain, language, name FROM documents WHERE language = ?", (language,))
-    else:
-        cursor = conn.execute("SELECT doc_id, domain, language, name FROM documents")
+    # Always cache every language, so a later call for another language is not served an empty cache
+    cursor = conn.execute("SELECT doc_id, domain, language, name FROM documents ORDER BY id")
     
     rows = cursor.fetchall()
     
@@ -65,12 +71,46 @@ def cache_document_names(language: str = None) -> Dict[str, Dict]:
         document_cache[name]['doc_ids'].append(doc_id)
     
     _DOCUMENT_CACHE = document_cache
-    print(f"Cached {len(document_cache)} unique document names from database")
+    logger.info("Cached %s unique document names from database", len(document_cache))
     
     if language:
         return {k: v for k, v in document_cache.items() if v['language'] == language}
     return document_cache
 
+def get_name_matcher(language: str):
+    """
+    Aho–Corasick automaton over the document names of a language, built once from cache_document_names.
+
+    The patterns are the parts router.name_matcher looks for in a query: the
+    comma-separated parts of English Law names, the whole name of Chinese Law
+    and Finance documents, and the hospital / patient halves of Medical names.
+
+    Returns:
+        (automaton, names, pattern_names): names lists (name, metadata, pattern indexes
+        of its parts) in the order of cache_document_names, and pattern_names[pattern]
+        the positions in names of the names containing that pattern
+    """
+    if language not in _NAME_MATCHERS:
+        patterns = {}
+        names = []
+        for name, info in cache_document_names(language).items():
+            if info['domain'] == 'Law':
+                parts = name.split(',') if language == 'en' else [name]
+            elif info['domain'] == 'Medical':
+                parts = name.split('_')[:2]
+            elif info['domain'] == 'Finance':
+                parts = [name]
+            else:
+                continue
+            names.append((name, info, [patterns.setdefault(part, len(patterns)) for part in parts]))
+        pattern_names = [[] for _ in patterns]
+        for position, (_, _, parts) in enumerate(names):
+            for part in set(parts):
+                pattern_names[part].append(position)
+        _NAME_MATCHERS[language] = (AhoCorasick(list(patterns)), names, pattern_names)
+        logger.info("Compiled name matcher for %s: %s names, %s patterns", language, len(names), len(patterns))
+    return _NAME_MATCHERS[language]
+
 def specific_router(query):
     content = query['query']['content']
     
@@ -225,7 +265,7 @@ def specific_router(query):
     # We only try this if the query seems specific (contains dates or specific roles)
     if any(x in content.lower() for x in ["appointed", "acquisition", "hospitalization", "record"]):
         terms_str = extract_search_terms(content)
-        print(f"[terms_str] query: {query['query']['query_id']}, with terms_str: {terms_str}, with content: {query['query']['content']}")
+        logger.debug("[terms_str] query: %s, with terms_str: %s, with content: %s", query['query']['query_id'], terms_str, query['query']['content'])
         if terms_str:
             terms = [t.strip() for t in terms_str.split(',') if t.strip()]
             if terms:
@@ -237,8 +277,6 @@ def specific_router(query):
     return None, []
 
 def extract_search_terms(query):
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
     prompt = f"""Identify the most specific search terms in the following query. 
     Extract names, roles, companies, dates, key events, specific actions, and significant noun phrases.
     Return ONLY a comma-separated list of terms. 
@@ -248,14 +286,12 @@ def extract_search_terms(query):
     Query: {query}
     
     Search Terms:"""
-    response = client.generate(model=ollama_config["model"], prompt=prompt, stream=False)
+    response = generate(prompt=prompt, stream=False)
     content = response.get("response", "").strip()
     return content
     
 
 def search_db_by_content(keywords, domain=None):
-    conn = Connection(DB_PATH)
-    
     if isinstance(keywords, str):
         keywords = [keywords]
     
@@ -264,6 +300,34 @@ def search_db_by_content(keywords, domain=None):
     if not keywords:
         return None, []
 
+    conn = get_connection()
+    if has_document_sentences(conn):
+        # FTS5 index of the document sentences, scored in SQL (already sorted)
+        scored_docs = search_document_sentences(conn, keywords, domain)
+    else:
+        # Databases built before the sentence index: scan the documents with LIKE
+        scored_docs = score_documents_like(conn, keywords, domain)
+    
+    # Filter to get top scores
+    if not scored_docs:
+        return None, []
+        
+    max_score = scored_docs[0][0]
+    
+    # If max_score is 0 (shouldn't happen if SQL returned rows, but possible if stemming logic differs), return empty
+    if max_score == 0:
+        return None, []
+
+    # Return all docs with max_score
+    best_docs = [d for d in scored_docs if d[0] == max_score]
+    
+    found_domain = domain if domain else best_docs[0][1]
+    doc_ids = [d[2] for d in best_docs]
+    
+    return found_domain, doc_ids
+
+
+def score_documents_like(conn, keywords, domain=None):
     # Stem keywords for matching
     stemmed_keywords = [simple_stem(k) for k in keywords]
 
@@ -285,9 +349,6 @@ def search_db_by_content(keywords, domain=None):
     cursor = conn.execute(query_sql, tuple(params))
     rows = cursor.fetchall()
     
-    if not rows:
-        return None, []
-        
     # Rank results
     scored_docs = []
     for row in rows:
@@ -332,39 +393,4 @@ def search_db_by_content(keywords, domain=None):
         
     # Sort by score descending
     scored_docs.sort(key=lambda x: x[0], reverse=True)
-    
-    # Filter to get top scores
-    if not scored_docs:
-        return None, []
-        
-    max_score = scored_docs[0][0]
-    
-    # If max_score is 0 (shouldn't happen if SQL returned rows, but possible if stemming logic differs), return empty
-    if max_score == 0:
-        return None, []
-
-    # Return all docs with max_score
-    best_docs = [d for d in scored_docs if d[0] == max_score]
-    
-    found_domain = domain if domain else best_docs[0][1]
-    doc_ids = [d[2] for d in best_docs]
-    
-    return found_domain, doc_ids
-
-
-def simple_stem(word):
-    """Simple stemming to handle common suffixes."""
-    word = word.lower()
-    if word.endswith('s') and not word.endswith('ss'):
-        word = word[:-1]
-    elif word.endswith('ed'):
-        word = word[:-2]
-    elif word.endswith('ing'):
-        word = word[:-3]
-    elif word.endswith('ment'):
-        word = word[:-4]
-    elif word.endswith('ion'):
-        word = word[:-3]
-    elif word.endswith('ly'):
-        word = word[:-2]
-    return word
+    return scored_docs
@@ -1,19 +1,24 @@
-from nltk.tokenize import sent_tokenize, word_tokenize
 import re
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.tracing import traced
+from tokenizer import load_nltk
 
 def split_sentences(text, language):
     if language == 'zh':
         # Simple regex for Chinese sentence splitting
         return re.split(r'(?<=[。！？])', text)
     else:
-        # Use NLTK for English
+        # Use NLTK for English (imported on first use, it is slow to import)
         # no need to remove these Ltd. Inc. etc.
         try:
-            return sent_tokenize(text)
+            return load_nltk().tokenize.sent_tokenize(text)
         except LookupError:
             # Split on . ! ? followed by whitespace or end of string
             return re.split(r'(?<=[.!?])\s+', text)
 
+@traced('re_chunk')
 def chunk_row_chunks(docs, language):
     chunks = []
     for doc_index, doc in enumerate(docs):
@@ -0,0 +1,205 @@
+"""
+Serving-mode cache of answered queries, matched by embedding similarity.
+
+Every answered query is stored with its embedding, answer and references in
+`db/semantic_cache.db`. A new query whose embedding is within `max_distance`
+(cosine distance) of an answered query of the same language reuses it:
+- mode 'answer': the cached answer and references are returned as is
+- mode 'retrieval': only the cached references (the routing / retrieval result)
+  are reused and the answer is generated again
+
+Queries are embedded with the same model as the queries FAISS index
+(embedding_service.embed_query), and embeddings are served from the persistent
+LLM cache, so the router pays for at most one embed request per query.
+
+Every entry is stored with the fingerprint of what its answer was built from
+(corpus_fingerprint: the token store and BM25 index of its language, the
+prompts and the generation model). Entries of another fingerprint are dropped
+when the language is first looked up, and the least recently used entries are
+evicted when the cache grows past `max_mb`.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.embedding_service import embed_query
+from My_RAG.utils import load_ollama_config
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
+
+CACHE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/semantic_cache.db'))
+# meta.json of these is rewritten by every rebuild (gen_dataset_db, ingest_dataset)
+TOKEN_STORE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/tokens'))
+BM25_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/bm25'))
+PROMPTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts.yaml')
+MODES = ('off', 'answer', 'retrieval')
+MAX_DISTANCE = 0.05
+DEFAULT_MAX_MB = 64
+# Evict down to this fraction of the bound, so eviction does not run on every insert
+EVICT_TO = 0.9
+
+_caches = {}
+_lock = threading.Lock()
+
+
+def new_index(dim):
+    # faiss is imported when the cache is used, not with main.py
+    import faiss
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+
+def corpus_fingerprint(language):
+    """
+    Version of what the answers of a language depend on: the meta.json (and its
+    mtime) of the token store and BM25 index, the prompts and the generation model.
+    """
+    digest = hashlib.sha1(json.dumps(load_ollama_config().get('model')).encode('utf-8'))
+    for path in (os.path.join(TOKEN_STORE_DIR, language, 'meta.json'),
+                 os.path.join(BM25_DIR, language, 'meta.json'), PROMPTS_PATH):
+        if not os.path.exists(path):
+            digest.update(b'missing')
+            continue
+        if path != PROMPTS_PATH:
+            # An ingest that keeps the counts still rewrites the file
+            digest.update(str(os.stat(path).st_mtime_ns).encode('ascii'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class SemanticCache:
+    def __init__(self, path=CACHE_PATH, max_distance=MAX_DISTANCE, max_mb=DEFAULT_MAX_MB):
+        self.max_distance = max_distance
+        self.max_bytes = max_mb * 2**20
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(answers)")]
+        if columns and 'fingerprint' not in columns:
+            # Written before entries had a fingerprint: none of them can be trusted
+            self.conn.execute("DROP TABLE answers")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                language TEXT NOT NULL,
+                query TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                refs TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                fingerprint TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+        self.fingerprints = {}
+        self.indexes = {}
+
+    def get_index(self, language):
+        # Inner product of normalized vectors = cosine similarity
+        if language not in self.indexes:
+            fingerprint = self.fingerprints[language] = corpus_fingerprint(language)
+            # Answered from another corpus, prompts or model: never served again
+            stale = self.conn.execute("DELETE FROM answers WHERE language = ? AND fingerprint != ?",
+                                      (language, fingerprint)).rowcount
+            if stale:
+                self.conn.commit()
+                self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+                logger.info("[SemanticCache] Dropped %s stale %s entries", stale, language)
+            rows = self.conn.execute("SELECT id, embedding FROM answers WHERE language = ?", (language,)).fetchall()
+            index = None
+            if rows:
+                vectors = np.stack([np.frombuffer(row[1], dtype='float32') for row in rows])
+                index = new_index(vectors.shape[1])
+                index.add_with_ids(vectors, np.array([row[0] for row in rows], dtype=np.int64))
+            self.indexes[language] = index
+        return self.indexes[language]
+
+    def lookup(self, query, language, embedding=None):
+        """
+        Closest answered query within max_distance.
+
+        Returns:
+            (embedding, hit) where hit is a dict with query, answer, references
+            and distance, or None
+        """
+        if embedding is None:
+            embedding = normalize(embed_query(query))
+        with self._lock:
+            index = self.get_index(language)
+            if index is not None and index.ntotal:
+                D, I = index.search(embedding, 1)
+                distance = 1.0 - float(D[0][0])
+                if I[0][0] >= 0 and distance <= self.max_distance:
+                    row = self.conn.execute("SELECT query, answer, refs FROM answers WHERE id = ? AND fingerprint = ?",
+                                            (int(I[0][0]), self.fingerprints[language])).fetchone()
+                    if row is not None:
+                        self.conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), int(I[0][0])))
+                        self.conn.commit()
+                        self.hits += 1
+                        return embedding, {'query': row[0], 'answer': row[1], 'references': json.loads(row[2]), 'distance': distance}
+            self.misses += 1
+        return embedding, None
+
+    def store(self, query, language, answer, references, embedding=None):
+        if embedding is None:
+            embedding = normalize(embed_query(query))
+        refs = json.dumps(references, ensure_ascii=False)
+        vector = embedding.astype('float32').tobytes()
+        size = len(query.encode('utf-8')) + len(answer.encode('utf-8')) + len(refs.encode('utf-8')) + len(vector)
+        with self._lock:
+            index = self.get_index(language)
+            cursor = self.conn.execute(
+                "INSERT INTO answers (language, query, answer, refs, embedding, fingerprint, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (language, query, answer, refs, vector, self.fingerprints[language], size, time.time())
+            )
+            self.conn.commit()
+            if index is None:
+                index = self.indexes[language] = new_index(embedding.shape[1])
+            index.add_with_ids(embedding, np.array([cursor.lastrowid], dtype=np.int64))
+            self.size += size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TO
+        freed = 0
+        ids = []
+        for row_id, size in self.conn.execute("SELECT id, size FROM answers ORDER BY last_used"):
+            if self.size - freed <= target:
+                break
+            ids.append(row_id)
+            freed += size
+        self.conn.executemany("DELETE FROM answers WHERE id = ?", [(row_id,) for row_id in ids])
+        self.conn.commit()
+        for index in self.indexes.values():
+            if index is not None:
+                index.remove_ids(np.array(ids, dtype=np.int64))
+        self.size -= freed
+        logger.info("[SemanticCache] Evicted %s entries (%.1f MB)", len(ids), freed / 2**20)
+
+
+def normalize(embedding):
+    embedding = np.asarray(embedding, dtype='float32').reshape(1, -1)
+    return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+
+def get_semantic_cache(path=CACHE_PATH, max_distance=MAX_DISTANCE, max_mb=DEFAULT_MAX_MB):
+    with _lock:
+        if path not in _caches:
+            _caches[path] = SemanticCache(path, max_distance, max_mb)
+        _caches[path].max_distance = max_distance
+        _caches[path].max_bytes = max_mb * 2**20
+        return _caches[path]
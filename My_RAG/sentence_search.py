@@ -0,0 +1,173 @@
+"""
+Full-text search over the sentences of the "documents" table.
+
+`db/gen_dataset_db.py` stores every document split into sentences (on '.', as
+router_utils.search_db_by_content always did) in `document_sentences`, with the
+lowercased sentence and its stemmed words, plus an FTS5 index over it using the
+trigram tokenizer, which works for English and Chinese alike. Candidate
+documents are found through the FTS index (keywords shorter than a trigram fall
+back to LIKE), and the sentence scores are computed in SQL.
+"""
+import re
+
+# Shortest keyword the trigram index can match
+TRIGRAM = 3
+
+
+def simple_stem(word):
+    """Simple stemming to handle common suffixes."""
+    word = word.lower()
+    if word.endswith('s') and not word.endswith('ss'):
+        word = word[:-1]
+    elif word.endswith('ed'):
+        word = word[:-2]
+    elif word.endswith('ing'):
+        word = word[:-3]
+    elif word.endswith('ment'):
+        word = word[:-4]
+    elif word.endswith('ion'):
+        word = word[:-3]
+    elif word.endswith('ly'):
+        word = word[:-2]
+    return word
+
+
+def split_document_sentences(content):
+    """(lowercased sentence, ' stem stem ... ') of every sentence of a document."""
+    sentences = []
+    for sentence in content.split('.'):
+        sentence = sentence.lower()
+        stems = [simple_stem(w) for w in re.findall(r'\w+', sentence)]
+        # Padded with spaces so a whole stem can be found with instr(stems, ' stem ')
+        sentences.append((sentence, ' ' + ' '.join(stems) + ' '))
+    return sentences
+
+
+def create_document_sentences(conn, indexes=True):
+    """
+    Create the sentence table, its FTS5 index and the triggers keeping them in sync.
+    With indexes=False only the table is created (bulk builds index it afterwards,
+    see rebuild_document_sentences_fts).
+    """
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS document_sentences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL,
+            domain TEXT NOT NULL,
+            content TEXT NOT NULL,
+            stems TEXT NOT NULL
+        );
+    """)
+    if not indexes:
+        return
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS document_sentences_document_id ON document_sentences(document_id);
+        CREATE VIRTUAL TABLE IF NOT EXISTS document_sentences_fts USING fts5(
+            content, stems, content='document_sentences', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS document_sentences_ai AFTER INSERT ON document_sentences BEGIN
+            INSERT INTO document_sentences_fts(rowid, content, stems) VALUES (new.id, new.content, new.stems);
+        END;
+        CREATE TRIGGER IF NOT EXISTS document_sentences_ad AFTER DELETE ON document_sentences BEGIN
+            INSERT INTO document_sentences_fts(document_sentences_fts, rowid, content, stems)
+            VALUES ('delete', old.id, old.content, old.stems);
+        END;
+    """)
+
+
+def rebuild_document_sentences_fts(conn):
+    """Create the indexes of a table loaded with indexes=False and fill the FTS index in one pass."""
+    create_document_sentences(conn)
+    conn.execute("INSERT INTO document_sentences_fts(document_sentences_fts) VALUES ('rebuild')")
+
+
+def drop_document_sentences(conn):
+    conn.executescript("""
+        DROP TABLE IF EXISTS document_sentences_fts;
+        DROP TABLE IF EXISTS document_sentences;
+    """)
+
+
+def index_document_sentences(conn, documents):
+    """Insert the sentences of `(id, doc_id, domain, content)` documents rows (the caller commits)."""
+    conn.executemany(
+        "INSERT INTO document_sentences (document_id, doc_id, domain, content, stems) VALUES (?, ?, ?, ?, ?)",
+        [(id, doc_id, domain, sentence, stems)
+         for id, doc_id, domain, content in documents
+         for sentence, stems in split_document_sentences(content)]
+    )
+
+
+def delete_document_sentences(conn, document_ids):
+    for start in range(0, len(document_ids), 500):
+        batch = list(document_ids[start:start + 500])
+        conn.execute(f"DELETE FROM document_sentences WHERE document_id IN ({','.join('?' for _ in batch)})", batch)
+
+
+def has_document_sentences(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'document_sentences_fts'"
+    ).fetchone() is not None
+
+
+def fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def fts_hits(column, patterns):
+    """SQL selecting the ids of the sentences whose column contains any of the patterns, and its params."""
+    selects = []
+    params = []
+    indexed = [pattern for pattern in patterns if len(pattern) >= TRIGRAM]
+    if indexed:
+        selects.append("SELECT rowid FROM document_sentences_fts WHERE document_sentences_fts MATCH ?")
+        params.append(f"{column} : ({' OR '.join(fts_phrase(pattern) for pattern in indexed)})")
+    for pattern in patterns:
+        if len(pattern) < TRIGRAM:
+            selects.append(f"SELECT id FROM document_sentences WHERE {column} LIKE ?")
+            params.append(f'%{pattern}%')
+    return ' UNION '.join(selects), params
+
+
+def search_document_sentences(conn, keywords, domain=None):
+    """
+    Rank documents by their best sentence: a sentence scores matches^2, where a
+    keyword matches if it occurs in the sentence or, for single words, if its stem
+    is one of the sentence's stemmed words.
+
+    Only documents containing a keyword are candidates, and only their sentences
+    that the FTS index finds for a keyword or a stem are scored.
+
+    Returns:
+        [(document score, domain, doc_id)] of the candidate documents with a matching
+        sentence, best first, ties in documents table order
+    """
+    lowered = [k.lower() for k in keywords]
+    stems = [' ' + simple_stem(k) + ' ' for k in lowered if ' ' not in k]
+    terms = []
+    term_params = []
+    for keyword in lowered:
+        if ' ' in keyword:
+            terms.append("(instr(content, ?) > 0)")
+            term_params.append(keyword)
+        else:
+            terms.append("(instr(content, ?) > 0 OR instr(stems, ?) > 0)")
+            term_params.extend([keyword, ' ' + simple_stem(keyword) + ' '])
+
+    candidates, candidate_params = fts_hits('content', lowered)
+    stem_hits, stem_params = fts_hits('stems', stems)
+    sentences = candidates + (' UNION ' + stem_hits if stem_hits else '')
+    sql = f"""
+        SELECT MAX(matches * matches) AS score, domain, doc_id FROM (
+            SELECT document_id, domain, doc_id, {' + '.join(terms)} AS matches
+            FROM document_sentences
+            WHERE id IN ({sentences})
+            AND document_id IN (SELECT document_id FROM document_sentences WHERE id IN ({candidates}))
+            {'AND domain = ?' if domain else ''}
+        )
+        GROUP BY document_id
+        ORDER BY score DESC, document_id
+    """
+    params = term_params + candidate_params + stem_params + candidate_params + ([domain] if domain else [])
+    return conn.execute(sql, params).fetchall()
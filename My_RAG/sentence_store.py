@@ -0,0 +1,153 @@
+"""
+Precomputed sentences of the "chunks" table.
+
+`db/gen_dataset_db.py` splits every chunk into sentences once (exactly as
+runtime_chunker.chunk_row_chunks does) and stores them in the `sentences` table
+with their chunk id, doc id, character offsets in the chunk and BM25 tokens.
+The name and time chains fetch the sentence rows of their retrieved chunk ids
+with one query instead of running sent_tokenize / the Chinese regex and copying
+the chunk metadata per sentence on every query.
+
+Retrieved chunks whose text differs from the stored chunk (short chunks merged
+with the next one) are matched by a crc32 of the chunk text and split at query
+time instead.
+"""
+import json
+import os
+import sqlite3
+import sys
+from runtime_chunker import split_sentences
+from tokenizer import tokenize, tokenizer_version
+from token_store import text_crc
+from data_access import get_connection
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.tracing import traced
+
+
+def create_sentences_table(conn, indexes=True):
+    """With indexes=False the chunk_id index is left for a bulk build to create once loaded."""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS sentences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chunk_id INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL,
+            sentence_index INTEGER NOT NULL,
+            start_offset INTEGER NOT NULL,
+            end_offset INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            tokens TEXT NOT NULL,
+            chunk_crc INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sentence_tokenizers (
+            language TEXT PRIMARY KEY,
+            tokenizer_version TEXT NOT NULL
+        );
+    """)
+    if indexes:
+        conn.execute("CREATE INDEX IF NOT EXISTS sentences_chunk_id ON sentences(chunk_id, sentence_index)")
+
+
+def drop_sentences_table(conn):
+    conn.executescript("""
+        DROP TABLE IF EXISTS sentences;
+        DROP TABLE IF EXISTS sentence_tokenizers;
+    """)
+
+
+def chunk_sentences(content, language):
+    """(sentence index, start, end, sentence) of the non-blank sentences of a chunk."""
+    sentences = []
+    position = 0
+    for sentence in split_sentences(content, language):
+        if not sentence.strip():
+            continue
+        start = content.find(sentence, position)
+        if start < 0:
+            start = end = -1
+        else:
+            end = position = start + len(sentence)
+        sentences.append((len(sentences), start, end, sentence))
+    return sentences
+
+
+def index_chunk_sentences(conn, rows, language):
+    """Insert the sentences of `(chunk id, doc_id, content)` chunk rows (the caller commits)."""
+    conn.execute(
+        "INSERT OR REPLACE INTO sentence_tokenizers (language, tokenizer_version) VALUES (?, ?)",
+        (language, tokenizer_version(language))
+    )
+    conn.executemany(
+        "INSERT INTO sentences (chunk_id, doc_id, sentence_index, start_offset, end_offset, content, tokens, chunk_crc) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(chunk_id, doc_id, index, start, end, sentence,
+          json.dumps(tokenize(sentence, language), ensure_ascii=False), text_crc(content))
+         for chunk_id, doc_id, content in rows
+         for index, start, end, sentence in chunk_sentences(content, language)]
+    )
+
+
+def delete_chunk_sentences(conn, chunk_ids):
+    for start in range(0, len(chunk_ids), 500):
+        batch = list(chunk_ids[start:start + 500])
+        conn.execute(f"DELETE FROM sentences WHERE chunk_id IN ({','.join('?' for _ in batch)})", batch)
+
+
+def fetch_sentences(chunk_ids, language):
+    """
+    Stored sentences of chunk ids.
+
+    Returns:
+        {chunk id: (chunk crc, [(sentence, tokens or None)])}, empty if the table does not exist;
+        tokens are None when they were computed with another tokenizer version
+    """
+    sentences = {}
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT tokenizer_version FROM sentence_tokenizers WHERE language = ?", (language,)).fetchone()
+        current = row is not None and row[0] == tokenizer_version(language)
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            cursor = conn.execute(
+                f"SELECT chunk_id, chunk_crc, content, tokens FROM sentences "
+                f"WHERE chunk_id IN ({','.join('?' for _ in batch)}) ORDER BY chunk_id, sentence_index",
+                batch
+            )
+            for chunk_id, chunk_crc, content, tokens in cursor:
+                entry = sentences.setdefault(chunk_id, (chunk_crc, []))
+                entry[1].append((content, json.loads(tokens) if current else None))
+    except sqlite3.OperationalError:
+        # Databases built before the sentences table
+        return {}
+    return sentences
+
+
+@traced('re_chunk')
+def sentence_chunks(chunks, language):
+    """
+    Split retrieved chunks into sentence dicts, in the order chunk_row_chunks produces them.
+
+    Each sentence is `{'page_content', 'metadata', 'token_key'}` (metadata: the other
+    keys of its chunk and its 'chunk_index'), plus its stored 'tokens' when it comes
+    from the sentences table.
+    """
+    stored = fetch_sentences([chunk['id'] for chunk in chunks if 'id' in chunk], language)
+    small_chunks = []
+    for chunk in chunks:
+        chunk_id = chunk.get('id')
+        chunk_metadata = {key: value for key, value in chunk.items() if key != 'page_content'}
+        entry = stored.get(chunk_id)
+        if entry is not None and entry[0] == text_crc(chunk['page_content']):
+            for index, (sentence, tokens) in enumerate(entry[1]):
+                small_chunk = {'page_content': sentence, 'metadata': {**chunk_metadata, 'chunk_index': index},
+                               'token_key': (chunk_id, index)}
+                if tokens is not None:
+                    small_chunk['tokens'] = tokens
+                small_chunks.append(small_chunk)
+            continue
+        for index, _, _, sentence in chunk_sentences(chunk['page_content'], language):
+            small_chunks.append({
+                'page_content': sentence,
+                'metadata': {**chunk_metadata, 'chunk_index': index},
+                'token_key': (chunk_id, index) if chunk_id is not None else None
+            })
+    return small_chunks
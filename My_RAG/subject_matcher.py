@@ -1,6 +1,5 @@
 import os
 import sys
-from ollama import Client
 from pathlib import Path
 import yaml
 import json
@@ -8,7 +7,11 @@ from typing import List, Dict, Tuple, Optional
 
 # Import shared cache from router_utils
 from router_utils import _DOCUMENT_CACHE, cache_document_names
-from utils import load_ollama_config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_gateway import generate
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
 
 def find_doc_names(query_text: str, language: str = "en", top_k: int = 3) -> Tuple[Optional[str], List[int]]:
     """
@@ -27,7 +30,7 @@ def find_doc_names(query_text: str, language: str = "en", top_k: int = 3) -> Tup
     if not _DOCUMENT_CACHE:
         _DOCUMENT_CACHE = cache_document_names(language)
         if (not _DOCUMENT_CACHE):
-            print("No documents found in cache")
+            logger.warning("No documents found in cache")
             return None
     
     # Prepare the list of document names
@@ -68,16 +71,14 @@ Instructions:
 Your answer (numbers only):"""
 
     # Call LLM
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    response = client.generate(model=ollama_config["model"], prompt=prompt)
+    response = generate(prompt=prompt)
     
     # Parse response
     answer_idxes = response["response"].strip()
-    print(f"LLM subject matching response: {answer_idxes}")
+    logger.debug("LLM subject matching response: %s", answer_idxes)
     
     if answer_idxes.upper() == "NONE" or not answer_idxes:
-        print("No relevant documents found")
+        logger.debug("No relevant documents found")
         return None
     
     # Parse indices with error handling
@@ -88,15 +89,15 @@ Your answer (numbers only):"""
             if 0 <= idx_int < len(doc_names):
                 match_doc_names.append(doc_names[idx_int])
             else:
-                print(f"Warning: Index {idx_int + 1} out of range (max: {len(doc_names)})")
+                logger.warning("Warning: Index %s out of range (max: %s)", idx_int + 1, len(doc_names))
         
         if not match_doc_names:
-            print("No valid document indices found")
+            logger.debug("No valid document indices found")
             return None
             
         return match_doc_names
     except (ValueError, IndexError) as e:
-        print(f"Error parsing LLM response indices: {e}")
+        logger.warning("Error parsing LLM response indices: %s", e)
         return None
 
 if __name__ == "__main__":
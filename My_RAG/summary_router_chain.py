@@ -1,21 +1,29 @@
 import os
 import json
-from ollama import Client
-from generator import load_ollama_config, load_prompts
+from generator import load_prompts
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.llm_gateway import generate
+from My_RAG.tracing import traced
+from My_RAG.log_config import get_logger
+from data_access import get_connection
 import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../db')))
 from Connection import Connection
-DB_PATH = "db/dataset.db"
 
-conn = Connection(DB_PATH)
+logger = get_logger(__name__)
+DB_PATH = "db/dataset.db"
 
+@traced('db_fetch')
 def get_contents_from_db(target_doc_ids):
+    # Pooled per thread: sqlite connections cannot be shared across the main.py worker threads
+    conn = get_connection()
     target_docs = []
     target_set = set(target_doc_ids)
 
     for id in target_set:
-        row = conn.execute("SELECT content FROM documents WHERE doc_id = ?", (id,))
+        row = conn.execute("SELECT content FROM documents WHERE doc_id = ? ORDER BY id", (id,))
         doc_content = row.fetchone()
         if doc_content:
             content_string = doc_content[0]
@@ -26,16 +34,13 @@ def generate_answer(query, context_chunks, language="en", prompt_type="summary_c
     context = "\n\n".join([chunk['page_content'] for chunk in context_chunks])
     prompts = load_prompts(type=prompt_type)
     if language not in prompts:
-        print(f"Warning: Language '{language}' not found in prompts. Falling back to 'en'.")
+        logger.warning("Warning: Language '%s' not found in prompts. Falling back to 'en'.", language)
         language = "en"
 
     prompt_template = prompts[language]
     prompt = prompt_template.format(query=query, context=context)
     
-    ollama_config = load_ollama_config()
-    client = Client(host=ollama_config["host"])
-    
-    response = client.generate(model=ollama_config["model"], options={
+    response = generate(options={
         "num_ctx": 32768,
         # "temperature": 0.3,
         # "max_tokens": 1024,
@@ -66,11 +71,11 @@ def summary_router_chain(query, language, doc_ids):
             if isinstance(text, str):
                 formatted_retrieve.append({"page_content": text})
 
-        print("Generated Answer:", result_json)
+        logger.debug("Generated Answer: %s", result_json)
         return result_json.get("answer", ""), formatted_retrieve
     
     except json.JSONDecodeError:
-        print("JSON Parse Error. Retry with fallback prompt")
+        logger.warning("JSON Parse Error. Retry with fallback prompt")
         answer = generate_answer(query_text, context, language, prompt_type="summary_chain_json_fallback")
         if (language == "en" and answer == "Unable to answer") or (language == "zh" and answer == "无法回答"):
             context = [{"page_content": ""}]
@@ -0,0 +1,149 @@
+"""
+Normalized temporal entities of the "chunks" table.
+
+The years, months and dates found in every chunk (entity_extractor's regex
+extraction, as db/migrate_add_entities.py does) are stored one per row in
+`chunk_years(chunk_id, year)`, `chunk_months(chunk_id, month)` and
+`chunk_dates(chunk_id, date)`, keyed on the value so the time router finds the
+chunks of a year or month with an index lookup instead of `LIKE '%2019%'` over
+comma-separated columns.
+
+Values are canonical: years and months are integers ("Mar", "March", "3月" and
+"三月" are all month 3) and dates are ISO `YYYY-MM-DD` strings.
+"""
+import re
+from entity_extractor import extract_entities_with_regex
+
+MONTH_NAMES = ['january', 'february', 'march', 'april', 'may', 'june',
+               'july', 'august', 'september', 'october', 'november', 'december']
+ZH_DIGITS = {'一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
+
+
+def zh_number(text):
+    """Value of a Chinese numeral up to 99 (十一, 二十三), None if it is not one."""
+    if not text or any(char not in ZH_DIGITS for char in text):
+        return None
+    if '十' not in text:
+        return ZH_DIGITS[text] if len(text) == 1 else None
+    tens, _, units = text.partition('十')
+    if len(tens) > 1 or len(units) > 1:
+        return None
+    return (ZH_DIGITS[tens] if tens else 1) * 10 + (ZH_DIGITS[units] if units else 0)
+
+
+def canonical_month(month):
+    """Month number (1-12) of "Mar", "March", "3", "03", "3月" or "三月", None if unknown."""
+    text = month.strip().lower().removesuffix('月')
+    if text.isdigit():
+        number = int(text)
+    elif text[:1] in ZH_DIGITS:
+        number = zh_number(text)
+    else:
+        number = next((index + 1 for index, name in enumerate(MONTH_NAMES)
+                       if len(text) >= 3 and name.startswith(text)), None)
+    return number if number is not None and 1 <= number <= 12 else None
+
+
+def canonical_date(date):
+    """ISO date of "2019-03-15", "2019年3月15日", "March 15, 2019" or "15 March 2019", None if unknown."""
+    text = date.strip()
+    match = (re.fullmatch(r'(\d{4})-(\d{1,2})-(\d{1,2})', text)
+             or re.fullmatch(r'(\d{4})年(\d{1,2})月(\d{1,2})日', text))
+    if match:
+        year, month, day = int(match[1]), int(match[2]), int(match[3])
+    else:
+        match = (re.fullmatch(r'([A-Za-z]+)\s+(\d{1,2}),?\s+(\d{4})', text)
+                 or re.fullmatch(r'(\d{1,2})\s+([A-Za-z]+)\s+(\d{4})', text))
+        if not match:
+            return None
+        month_name, day = (match[1], match[2]) if match[1].isalpha() else (match[2], match[1])
+        year, month, day = int(match[3]), canonical_month(month_name), int(day)
+    if month is None or not 1 <= month <= 12 or not 1 <= day <= 31:
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def canonical_entities(entities):
+    """(years, months, dates) sets of canonical values of extracted entities."""
+    years = {int(year) for year in entities.get('years', []) if str(year).isdigit()}
+    months = {canonical_month(month) for month in entities.get('months', [])} - {None}
+    dates = {canonical_date(date) for date in entities.get('dates', [])} - {None}
+    return years, months, dates
+
+
+def create_temporal_tables(conn, indexes=True):
+    """With indexes=False the chunk_id indexes are left for a bulk build to create once loaded."""
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS chunk_years (
+            year INTEGER NOT NULL,
+            chunk_id INTEGER NOT NULL,
+            PRIMARY KEY (year, chunk_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS chunk_months (
+            month INTEGER NOT NULL,
+            chunk_id INTEGER NOT NULL,
+            PRIMARY KEY (month, chunk_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS chunk_dates (
+            date TEXT NOT NULL,
+            chunk_id INTEGER NOT NULL,
+            PRIMARY KEY (date, chunk_id)
+        ) WITHOUT ROWID;
+    """)
+    if indexes:
+        # Deleting the entities of replaced chunks
+        conn.executescript("""
+            CREATE INDEX IF NOT EXISTS chunk_years_chunk_id ON chunk_years(chunk_id);
+            CREATE INDEX IF NOT EXISTS chunk_months_chunk_id ON chunk_months(chunk_id);
+            CREATE INDEX IF NOT EXISTS chunk_dates_chunk_id ON chunk_dates(chunk_id);
+        """)
+
+
+def drop_temporal_tables(conn):
+    conn.executescript("""
+        DROP TABLE IF EXISTS chunk_years;
+        DROP TABLE IF EXISTS chunk_months;
+        DROP TABLE IF EXISTS chunk_dates;
+    """)
+
+
+def has_temporal_tables(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_years'").fetchone() is not None
+
+
+def index_chunk_entities(conn, rows, language):
+    """Insert the temporal entities of `(chunk id, content)` chunk rows (the caller commits)."""
+    years, months, dates = [], [], []
+    for chunk_id, content in rows:
+        chunk_years, chunk_months, chunk_dates = canonical_entities(extract_entities_with_regex(content, language))
+        years.extend((year, chunk_id) for year in chunk_years)
+        months.extend((month, chunk_id) for month in chunk_months)
+        dates.extend((date, chunk_id) for date in chunk_dates)
+    conn.executemany("INSERT OR IGNORE INTO chunk_years (year, chunk_id) VALUES (?, ?)", years)
+    conn.executemany("INSERT OR IGNORE INTO chunk_months (month, chunk_id) VALUES (?, ?)", months)
+    conn.executemany("INSERT OR IGNORE INTO chunk_dates (date, chunk_id) VALUES (?, ?)", dates)
+
+
+def delete_chunk_entities(conn, chunk_ids):
+    for start in range(0, len(chunk_ids), 500):
+        batch = list(chunk_ids[start:start + 500])
+        placeholders = ','.join('?' for _ in batch)
+        for table in ('chunk_years', 'chunk_months', 'chunk_dates'):
+            conn.execute(f"DELETE FROM {table} WHERE chunk_id IN ({placeholders})", batch)
+
+
+def temporal_conditions(entities, chunk_id_column='chunks.id'):
+    """
+    WHERE conditions restricting chunks to the years and to the months of query
+    entities (any of the years and any of the months), and their params.
+    """
+    years, months, _ = canonical_entities(entities)
+    conditions = []
+    params = []
+    for table, column, values in (('chunk_years', 'year', years), ('chunk_months', 'month', months)):
+        if values:
+            conditions.append(
+                f"{chunk_id_column} IN (SELECT chunk_id FROM {table} WHERE {column} IN ({','.join('?' for _ in values)}))"
+            )
+            params.extend(sorted(values))
+    return conditions, params
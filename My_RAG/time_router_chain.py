@@ -1,8 +1,17 @@
 import sqlite3
+import os
+import sys
 from generator import generate_answer
 from retriever import get_chunks_from_db, create_retriever
 from entity_extractor import extract_entities
-from runtime_chunker import chunk_row_chunks
+from sentence_store import sentence_chunks
+from data_access import get_connection
+from temporal_store import temporal_conditions
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.tracing import traced
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
 
 DB_PATH = "db/dataset.db"
 
@@ -24,28 +33,28 @@ def time_router_chain(query, language, doc_ids=[]):
     # Extract temporal entities from query
     entities = extract_entities(query_text, language, use_llm=False)
     
-    print(f"[TimeRouter] Extracted entities: years={entities['years']}, months={entities['months']}")
+    logger.info("[TimeRouter] Extracted entities: years=%s, months=%s", entities['years'], entities['months'])
     
     # Step 1: Get chunks filtered by time entities (excluding Finance domain first)
-    print("[TimeRouter][1] Retrieve with time filter (excluding Finance):")
+    logger.debug("[TimeRouter][1] Retrieve with time filter (excluding Finance):")
     retrieved_chunks = get_chunks_with_time_filter(doc_ids, language, entities, exclude_finance=True)
     
     if not retrieved_chunks:
-        print("[TimeRouter] No non-Finance chunks found, trying with all domains...")
+        logger.debug("[TimeRouter] No non-Finance chunks found, trying with all domains...")
         retrieved_chunks = get_chunks_with_time_filter(doc_ids, language, entities, exclude_finance=False)
         
         if not retrieved_chunks:
-            print("[TimeRouter] No chunks found with time filter, falling back to all chunks")
+            logger.info("[TimeRouter] No chunks found with time filter, falling back to all chunks")
             retrieved_chunks = get_chunks_from_db(None, doc_ids, language)
     
-    print(f"[TimeRouter] Retrieved {len(retrieved_chunks)} bigger chunks")
+    logger.debug("[TimeRouter] Retrieved %s bigger chunks", len(retrieved_chunks))
     
     # Step 2: Create smaller chunks for more precise retrieval
-    print("[TimeRouter][2] Create smaller chunks:")
+    logger.debug("[TimeRouter][2] Create smaller chunks:")
     small_retrieved_chunks, small_chunks = create_smaller_chunks(language, retrieved_chunks)
     
     # Step 3: Retrieve smaller chunks using BM25
-    print("[TimeRouter][3] Retrieve smaller chunks with BM25:")
+    logger.debug("[TimeRouter][3] Retrieve smaller chunks with BM25:")
     retriever = create_retriever(small_retrieved_chunks, language)
     retrieved_small_chunks = retriever.retrieve(query_text, top1_check=True)
     
@@ -53,15 +62,15 @@ def time_router_chain(query, language, doc_ids=[]):
     for chunk in retrieved_small_chunks:
         return_chunks.append(small_chunks[chunk['chunk_index']])
     
-    print(f"[TimeRouter] Retrieved {len(return_chunks)} smaller chunks")
+    logger.debug("[TimeRouter] Retrieved %s smaller chunks", len(return_chunks))
     
     # Step 4: Generate answer
-    print("[TimeRouter][4] Generate answer:")
+    logger.debug("[TimeRouter][4] Generate answer:")
     answer = generate_answer(query_text, return_chunks, language, type="llm_chain")
     
     # Step 5: Fine-tune retrieval based on answer (if answer is valid)
     if "无法回答" not in answer and "Unable to answer" not in answer:
-        print("[TimeRouter][5] Fine-tune retrieval based on answer:")
+        logger.debug("[TimeRouter][5] Fine-tune retrieval based on answer:")
         final_retrieve = query_text + " " + answer
         if language == 'zh':
             final_retrieve = answer
@@ -71,7 +80,7 @@ def time_router_chain(query, language, doc_ids=[]):
         for chunk in retrieved_small_chunks:
             return_chunks.append(small_chunks[chunk['chunk_index']])
         
-        print(f"[TimeRouter] Final chunks: {len(return_chunks)}")
+        logger.debug("[TimeRouter] Final chunks: %s", len(return_chunks))
     
     return answer, return_chunks
 
@@ -90,12 +99,14 @@ def create_smaller_chunks(language="en", retrieved_chunks=[]):
     Returns:
         Tuple of (small_retrieved_chunks, small_chunks)
     """
-    small_chunks = chunk_row_chunks(retrieved_chunks, language)
+    small_chunks = sentence_chunks(retrieved_chunks, language)
     small_retrieved_chunks = []
     for index, chunk in enumerate(small_chunks):
         small_retrieved_chunks.append({
             "page_content": chunk['page_content'],
-            "chunk_index": index
+            "chunk_index": index,
+            "token_key": chunk['token_key'],
+            **({"tokens": chunk['tokens']} if 'tokens' in chunk else {})
         })
     return small_retrieved_chunks, small_chunks
 
@@ -120,7 +131,7 @@ def filter_out_company_chunks(chunks, query_text, language):
     if not company_names:
         return chunks  # No company names to filter
     
-    print(f"[TimeRouter] Filtering out chunks with companies: {company_names}")
+    logger.debug("[TimeRouter] Filtering out chunks with companies: %s", company_names)
     
     # Filter out chunks that contain any of the company names
     filtered_chunks = []
@@ -136,14 +147,17 @@ def filter_out_company_chunks(chunks, query_text, language):
         if not has_company:
             filtered_chunks.append(chunk)
     
-    print(f"[TimeRouter] Filtered {len(chunks)} → {len(filtered_chunks)} chunks (removed {len(chunks) - len(filtered_chunks)} with company names)")
+    logger.debug("[TimeRouter] Filtered %s → %s chunks (removed %s with company names)", len(chunks), len(filtered_chunks), len(chunks) - len(filtered_chunks))
     
     return filtered_chunks
 
 
+@traced('db_fetch')
 def get_chunks_with_time_filter(doc_ids, language, entities, exclude_finance=True):
     """
     Get chunks filtered by temporal entities, optionally excluding Finance domain chunks.
+    The years and months are looked up in the chunk_years / chunk_months tables
+    (see temporal_store.py).
     
     Args:
         doc_ids: List of document IDs
@@ -154,8 +168,7 @@ def get_chunks_with_time_filter(doc_ids, language, entities, exclude_finance=Tru
     Returns:
         List of chunks matching the time filters
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     
     # Build WHERE clause
     where_clauses = []
@@ -171,24 +184,11 @@ def get_chunks_with_time_filter(doc_ids, language, entities, exclude_finance=Tru
         where_clauses.append(f"chunks.doc_id IN ({placeholders})")
         params.extend(doc_ids)
     
-    # Time filters (AND condition - must match ALL specified time entities)
-    if entities['years']:
-        year_conditions = []
-        for year in entities['years']:
-            year_conditions.append("chunks.years LIKE ?")
-            params.append(f"%{year}%")
-        # If multiple years, use OR for years
-        if year_conditions:
-            where_clauses.append(f"({' OR '.join(year_conditions)})")
-    
-    if entities['months']:
-        month_conditions = []
-        for month in entities['months']:
-            month_conditions.append("chunks.months LIKE ?")
-            params.append(f"%{month}%")
-        # If multiple months, use OR for months
-        if month_conditions:
-            where_clauses.append(f"({' OR '.join(month_conditions)})")
+    # Time filters (AND condition - must match ALL specified time entities,
+    # any of the years and any of the months)
+    time_clauses, time_params = temporal_conditions(entities)
+    where_clauses.extend(time_clauses)
+    params.extend(time_params)
     
     # Optionally exclude chunks from documents with company names (Finance domain)
     # These should be handled by name_router
@@ -202,14 +202,19 @@ def get_chunks_with_time_filter(doc_ids, language, entities, exclude_finance=Tru
         FROM chunks 
         JOIN documents ON chunks.doc_id = documents.doc_id AND chunks.language = documents.language
         WHERE {where_clause}
+        ORDER BY chunks.id
     """
     
-    print(f"[TimeRouter] SQL: {query}")
-    print(f"[TimeRouter] Params: {params}")
+    logger.debug("[TimeRouter] SQL: %s", query)
+    logger.debug("[TimeRouter] Params: %s", params)
     
-    cursor.execute(query, params)
+    try:
+        cursor.execute(query, params)
+    except sqlite3.OperationalError as e:
+        # Databases built before the temporal entity tables
+        logger.warning("[TimeRouter] Time filter unavailable: %s", e)
+        return []
     rows = cursor.fetchall()
-    conn.close()
     
     # Convert to chunk format
     chunks = []
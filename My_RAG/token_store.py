@@ -0,0 +1,180 @@
+"""
+Persistent tokenization cache for chunks and their sentences.
+
+Tokens are computed once when the dataset db is built (db/gen_dataset_db.py)
+and stored per language under `db/tokens/{language}/` as a compact token-id
+array keyed by (chunk id, sentence index), so BM25 retrieval does not have to
+run jieba / the Porter stemmer over corpus text at query time.
+
+Entries are validated with a crc32 of the text they were computed from, and the
+whole store is ignored when the tokenizer version (stopwords, stemmer, jieba)
+no longer matches. Texts that are not in the store (e.g. sentences with the
+document names removed) go through the in-process tokenize() memo instead.
+"""
+import json
+import os
+import threading
+import zlib
+import numpy as np
+from tokenizer import tokenize, cached_tokenize, tokenizer_version
+from runtime_chunker import split_sentences
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG.log_config import get_logger
+
+logger = get_logger(__name__)
+
+TOKEN_STORE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/tokens'))
+TOKEN_STORE_FORMAT = 1
+
+# Sentence index used for the whole chunk
+CHUNK_KEY = -1
+SENTENCE_BITS = 20
+
+_STORES = {}
+_LOCK = threading.Lock()
+
+
+def make_key(chunk_id, sentence_index=CHUNK_KEY):
+    return (int(chunk_id) << SENTENCE_BITS) + sentence_index + 1
+
+
+def text_crc(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def save_array(path, array):
+    """np.save to a temp file moved into place, so processes that memory-mapped the old file keep a valid mapping."""
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def build_token_store(rows, language, output_dir, previous=None):
+    """
+    Tokenize `(id, content)` chunk rows and their sentences and save the store.
+
+    Sentences are split exactly as runtime_chunker.chunk_row_chunks does, so the
+    sentence index matches the 'chunk_index' it puts in the sentence metadata.
+    Entries whose text is unchanged in the `previous` TokenStore are copied from
+    it instead of being tokenized again (incremental ingest).
+    """
+    vocab = {}
+    entries = []
+    for chunk_id, content in rows:
+        entries.append((make_key(chunk_id), chunk_id, CHUNK_KEY, content))
+        sentences = [s for s in split_sentences(content, language) if s.strip()]
+        for sentence_index, sentence in enumerate(sentences):
+            entries.append((make_key(chunk_id, sentence_index), chunk_id, sentence_index, sentence))
+    entries.sort(key=lambda entry: entry[0])
+
+    keys, crcs, offsets, token_ids = [], [], [0], []
+    reused = 0
+    for key, chunk_id, sentence_index, text in entries:
+        keys.append(key)
+        crcs.append(text_crc(text))
+        tokens = previous.get(chunk_id, text, sentence_index) if previous is not None else None
+        if tokens is None:
+            tokens = tokenize(text, language)
+        else:
+            reused += 1
+        token_ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+        offsets.append(len(token_ids))
+
+    os.makedirs(output_dir, exist_ok=True)
+    save_array(os.path.join(output_dir, 'keys.npy'), np.array(keys, dtype=np.int64))
+    save_array(os.path.join(output_dir, 'crcs.npy'), np.array(crcs, dtype=np.uint32))
+    save_array(os.path.join(output_dir, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+    save_array(os.path.join(output_dir, 'token_ids.npy'), np.array(token_ids, dtype=np.int32))
+    with open(os.path.join(output_dir, 'vocab.json'), 'w') as f:
+        json.dump(list(vocab), f, ensure_ascii=False)
+    meta = {
+        'format': TOKEN_STORE_FORMAT,
+        'language': language,
+        'tokenizer_version': tokenizer_version(language),
+        'num_chunks': len(rows),
+        'num_entries': len(keys),
+    }
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    print(f"Saved token store ({len(rows)} chunks, {len(keys)} entries, {reused} reused, {len(vocab)} tokens) to {output_dir}")
+
+
+def load_token_store(language):
+    """
+    Load the token store for a language once per process.
+
+    Returns:
+        TokenStore, or None if it is missing or was built with another tokenizer version
+    """
+    with _LOCK:
+        if language not in _STORES:
+            _STORES[language] = TokenStore.load(os.path.join(TOKEN_STORE_DIR, language), language)
+        return _STORES[language]
+
+
+class TokenStore:
+    def __init__(self, meta, vocab, keys, crcs, offsets, token_ids):
+        self.meta = meta
+        self.vocab = np.array(vocab, dtype=object)
+        self.keys = keys
+        self.crcs = crcs
+        self.offsets = offsets
+        self.token_ids = token_ids
+
+    @classmethod
+    def load(cls, store_dir, language):
+        meta_path = os.path.join(store_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('format') != TOKEN_STORE_FORMAT or meta.get('tokenizer_version') != tokenizer_version(language):
+            logger.warning("[TokenStore] %s was built with another tokenizer, ignoring it (rebuild the dataset db)", store_dir)
+            return None
+        with open(os.path.join(store_dir, 'vocab.json'), 'r') as f:
+            vocab = json.load(f)
+        arrays = [np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode='r')
+                  for name in ('keys', 'crcs', 'offsets', 'token_ids')]
+        return cls(meta, vocab, *arrays)
+
+    def get(self, chunk_id, text, sentence_index=CHUNK_KEY):
+        """Stored tokens of a chunk (or one of its sentences), or None if absent or stale."""
+        key = make_key(chunk_id, sentence_index)
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key or self.crcs[i] != text_crc(text):
+            return None
+        return self.vocab[self.token_ids[self.offsets[i]:self.offsets[i + 1]]].tolist()
+
+
+def get_token_key(chunk):
+    """(chunk id, sentence index) a chunk dict was cut from, if known."""
+    if 'token_key' in chunk:
+        return chunk['token_key']
+    if 'id' in chunk:
+        return (chunk['id'], CHUNK_KEY)
+    return None
+
+
+def sentence_token_key(sentence_chunk):
+    """token_key of a sentence produced by runtime_chunker.chunk_row_chunks."""
+    metadata = sentence_chunk.get('metadata', {})
+    if 'id' not in metadata:
+        return None
+    return (metadata['id'], metadata['chunk_index'])
+
+
+def tokenize_corpus(chunks, language="en"):
+    """Tokens for every chunk dict, from the token store when possible."""
+    store = load_token_store(language)
+    corpus = []
+    for chunk in chunks:
+        # Tokens attached by sentence_store.sentence_chunks
+        tokens = chunk.get('tokens')
+        key = get_token_key(chunk)
+        if tokens is None and store is not None and key is not None:
+            tokens = store.get(key[0], chunk['page_content'], key[1])
+        if tokens is None:
+            tokens = cached_tokenize(chunk['page_content'], language)
+        corpus.append(tokens)
+    return corpus
@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+
+STOPWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'english.stop')
+# jieba's prefix dictionary, pickled on first load (instead of the temp dir, which may not survive)
+JIEBA_CACHE = os.path.abspath(os.path.join(os.path.dirname(__file__), '../db/jieba.cache'))
+
+# Bump when tokenize() changes in a way the inputs below do not capture
+TOKENIZER_REVISION = 1
+
+# jieba and nltk take most of the import time of the pipeline: they are loaded
+# by the first tokenize() of their language (or main.py --warmup)
+_jieba = None
+_nltk = None
+_stemmer = None
+_jieba_lock = threading.Lock()
+# Every nltk import goes through load_nltk(): importing nltk from two threads at
+# once hands one of them a partially initialized module
+_nltk_lock = threading.Lock()
+_stemmer_lock = threading.Lock()
+_stopwords = None
+_versions = {}
+
+def load_jieba():
+    """jieba with its dictionary loaded, from JIEBA_CACHE once it has been built."""
+    global _jieba
+    with _jieba_lock:
+        if _jieba is None:
+            import jieba
+            jieba.setLogLevel(logging.WARNING)
+            jieba.dt.tmp_dir = os.path.dirname(JIEBA_CACHE)
+            jieba.dt.cache_file = os.path.basename(JIEBA_CACHE)
+            jieba.initialize()
+            _jieba = jieba
+    return _jieba
+
+def load_nltk():
+    """nltk with the stemmer and sentence tokenizer modules imported (by one thread)."""
+    global _nltk
+    with _nltk_lock:
+        if _nltk is None:
+            import nltk
+            import nltk.stem
+            import nltk.tokenize
+            _nltk = nltk
+    return _nltk
+
+def load_stemmer():
+    global _stemmer
+    with _stemmer_lock:
+        if _stemmer is None:
+            _stemmer = load_nltk().stem.PorterStemmer()
+    return _stemmer
+
+def load_stopwords():
+    global _stopwords
+    if _stopwords is None:
+        with open(STOPWORDS_PATH, 'r') as f:
+            _stopwords = frozenset(f.read().split())
+    return _stopwords
+
+def clean(string):
+    string = string.lower()
+    # Remove punctuation
+    string = re.sub(r"[.,!?;:'\"()]", " ", string)
+    # Normalize whitespace
+    string = re.sub(r"\s+", " ", string)
+    return string.strip()
+
+def tokenize(text, language="en"):
+    """
+    Tokenize text the way BM25 retrieval expects it.
+    Chinese is segmented with jieba; English is cleaned, stopword-filtered and Porter-stemmed.
+    """
+    if language == "zh":
+        return list((_jieba or load_jieba()).cut(text))
+    stopwords = load_stopwords()
+    stemmer = _stemmer or load_stemmer()
+    tokens = clean(text).split()
+    return [stemmer.stem(token) for token in tokens if token not in stopwords]
+
+@lru_cache(maxsize=65536)
+def cached_tokenize(text, language="en"):
+    """tokenize() memoized per process, for texts that are not in the token store."""
+    return tuple(tokenize(text, language))
+
+def tokenizer_version(language="en"):
+    """
+    Fingerprint of everything tokenize() depends on for a language.
+    Persisted tokens (token store, BM25 index) are stale when this changes.
+    """
+    if language not in _versions:
+        digest = hashlib.sha1(f"revision={TOKENIZER_REVISION}".encode())
+        if language == "zh":
+            digest.update(f"jieba={load_jieba().__version__}".encode())
+        else:
+            nltk = load_nltk()
+            stemmer = load_stemmer()
+            with open(STOPWORDS_PATH, 'rb') as f:
+                digest.update(f.read())
+            digest.update(f"{type(stemmer).__name__}={stemmer.mode},nltk={nltk.__version__}".encode())
+        _versions[language] = digest.hexdigest()[:16]
+    return _versions[language]
@@ -0,0 +1,165 @@
+"""
+Per-query latency tracing of the router pipeline.
+
+`main.py` runs every query inside `trace_query(query_id)`; the stages of the
+pipeline record a span with `span(stage)` / `@traced(stage)` while a trace is
+active (outside of one they cost a context variable lookup):
+
+- entity_extraction, name_matching: router.router
+- db_fetch: chunk / document reads of the retrievers and chains
+- bm25_build, bm25_score: building a BM25 retriever and scoring a query with it
+- re_chunk: splitting retrieved chunks into sentences
+- embedding, dense_retrieve: embedding requests and DenseRetriever.retrieve
+- llm: every generate request, with its model and prompt / completion token counts
+
+Spans carry their parent span, so nested stages (e.g. the db_fetch of an
+IndexedBM25Retriever.retrieve) can be told apart. The context variable follows
+the query into the name chain's sub-query threads and onto the llm_gateway loop.
+
+`write_traces` writes one JSON line per query and `format_summary` the
+p50/p95/p99 of the per-query time spent in each stage.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+_trace = contextvars.ContextVar('trace', default=None)
+_parent = contextvars.ContextVar('span', default=None)
+
+
+class Trace:
+    def __init__(self, query_id):
+        self.query_id = query_id
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def stage_totals(self):
+        """{stage: seconds spent in it by this query}"""
+        totals = {}
+        for span in self.spans:
+            totals[span['stage']] = totals.get(span['stage'], 0.0) + span['duration']
+        return totals
+
+    def to_dict(self):
+        return {
+            'query_id': self.query_id,
+            'duration': self.duration,
+            'stages': self.stage_totals(),
+            'spans': sorted(self.spans, key=lambda span: span['start'])
+        }
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def trace_query(query_id):
+    """Trace the spans recorded by the calling context until the block exits."""
+    trace = Trace(query_id)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - trace.start
+        _trace.reset(token)
+
+
+@contextmanager
+def span(stage, **attributes):
+    """
+    Record the duration of the block as a span of the current trace. The yielded
+    dict holds the span attributes; the block can add to it (e.g. token counts).
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield attributes
+        return
+    span_id = trace.new_id()
+    token = _parent.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes['error'] = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        _parent.reset(token)
+        trace.add({'id': span_id, 'parent': _parent.get(), 'stage': stage,
+                   'start': start - trace.start, 'duration': end - start, **attributes})
+
+
+def traced(stage):
+    """Decorator recording every call of a function as a span."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_path(output_path):
+    """Trace file written next to a predictions file: predictions.jsonl -> predictions.trace.jsonl"""
+    return os.path.splitext(output_path)[0] + '.trace.jsonl'
+
+
+def write_traces(path, traces):
+    with open(path, 'w', encoding='utf-8') as file:
+        for trace in traces:
+            file.write(json.dumps(trace.to_dict(), ensure_ascii=False) + '\n')
+
+
+def summarize(traces):
+    """
+    {stage: {'queries', 'calls', 'p50', 'p95', 'p99'}} of the seconds each query
+    spent in a stage (over the queries that reached it), plus 'query' for the whole query.
+    """
+    totals = {}
+    calls = {}
+    for trace in traces:
+        for stage, seconds in trace.stage_totals().items():
+            totals.setdefault(stage, []).append(seconds)
+        for span in trace.spans:
+            calls[span['stage']] = calls.get(span['stage'], 0) + 1
+    totals['query'] = [trace.duration for trace in traces if trace.duration is not None]
+    calls['query'] = len(totals['query'])
+    summary = {}
+    for stage, values in totals.items():
+        if not values:
+            continue
+        p = np.percentile(values, PERCENTILES)
+        summary[stage] = {'queries': len(values), 'calls': calls[stage],
+                          **{f'p{q}': float(v) for q, v in zip(PERCENTILES, p)}}
+    return summary
+
+
+def format_summary(summary):
+    """Table of summarize(), slowest stages (by p95) first."""
+    header = f"{'stage':<18}{'queries':>8}{'calls':>8}" + ''.join(f"{f'p{q} (s)':>10}" for q in PERCENTILES)
+    lines = [header, '-' * len(header)]
+    for stage, stats in sorted(summary.items(), key=lambda item: -item[1]['p95']):
+        lines.append(f"{stage:<18}{stats['queries']:>8}{stats['calls']:>8}"
+                     + ''.join(f"{stats[f'p{q}']:>10.3f}" for q in PERCENTILES))
+    return '\n'.join(lines)
@@ -1,4 +1,5 @@
 import jsonlines
+import os
 from pathlib import Path
 import yaml
 
@@ -15,7 +16,24 @@ def save_jsonl(file_path, data):
         for item in data:
             writer.write(item)
 
+_config = None
+_ollama_config = None
+
+def load_config() -> dict:
+    """Whole config file, read once per process."""
+    global _config
+    if _config is None:
+        _config = read_config()
+    return _config
+
 def load_ollama_config() -> dict:
+    """Ollama section of the config file, read once per process."""
+    global _ollama_config
+    if _ollama_config is None:
+        _ollama_config = read_ollama_config()
+    return dict(_ollama_config)
+
+def read_config() -> dict:
     configs_folder = Path(__file__).parent.parent / "configs"
     config_paths = [
         configs_folder / "config_local.yaml",
@@ -31,9 +49,15 @@ def load_ollama_config() -> dict:
         raise FileNotFoundError("No configuration file found.")
 
     with open(config_path, "r") as file:
-        config = yaml.safe_load(file)
+        return yaml.safe_load(file) or {}
 
+def read_ollama_config() -> dict:
+    config = load_config()
     assert "ollama" in config, "Ollama configuration not found in config file."
     assert "host" in config["ollama"], "Ollama host not specified in config file."
     assert "model" in config["ollama"], "Ollama model not specified in config file."
-    return config["ollama"]
\ No newline at end of file
+    ollama = dict(config["ollama"])
+    # Points every chain at another server, e.g. benchmarks/mock_ollama.py
+    if os.environ.get("RAG_OLLAMA_HOST"):
+        ollama["host"] = os.environ["RAG_OLLAMA_HOST"]
+    return ollama
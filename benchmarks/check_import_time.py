@@ -0,0 +1,69 @@
+"""
+Import-time budget of the entry points.
+
+Runs `python -X importtime -c "import <module>"` in My_RAG a few times per
+module and checks the fastest run against its budget (cumulative ms), and that
+none of the slow optional libraries (loaded on first use) is imported at start:
+
+```bash
+python benchmarks/check_import_time.py
+python benchmarks/check_import_time.py --runs 10 --top 15
+```
+
+Exits 1 when a budget is exceeded or a forbidden module is imported.
+"""
+import os
+import subprocess
+import sys
+
+MY_RAG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../My_RAG'))
+# Cumulative import time (ms) allowed per module
+BUDGETS = {'main': 400, 'router': 350}
+# Loaded on first use (tokenizer, runtime_chunker, llm_gateway, semantic_cache)
+FORBIDDEN = ['nltk', 'jieba', 'ollama', 'faiss', 'httpx']
+
+
+def import_times(module):
+    """{imported module: cumulative microseconds} of one `import module` in a fresh interpreter."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=MY_RAG_DIR, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def check(module, budget, runs):
+    """Problems found for a module, and its fastest run."""
+    fastest = min((import_times(module) for _ in range(runs)), key=lambda times: times[module])
+    problems = []
+    total_ms = fastest[module] / 1000
+    if total_ms > budget:
+        problems.append(f"{module}: {total_ms:.0f} ms > budget {budget} ms")
+    for name in FORBIDDEN:
+        if name in fastest:
+            problems.append(f"{module}: imports {name} at start")
+    return problems, fastest
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='Runs per module, the fastest is checked [default: 5]')
+    parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports shown per module [default: 10]')
+    args = parser.parse_args()
+
+    problems = []
+    for module, budget in BUDGETS.items():
+        module_problems, times = check(module, budget, args.runs)
+        problems += module_problems
+        print(f"{module}: {times[module] / 1000:.0f} ms (budget {budget} ms)")
+        top_level = {name: us for name, us in times.items() if '.' not in name and name != module}
+        for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {name:<30}{us / 1000:>8.1f} ms")
+    for problem in problems:
+        print(f"FAIL {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,250 @@
+"""
+Mock Ollama server for load and regression tests.
+
+Serves `/api/generate`, `/api/embed` and `/api/embeddings` over HTTP with the
+deterministic responses of stub_llm, so the pipeline runs end to end without a
+model and the llm_gateway concurrency (in-flight limits, timeouts, retries) can
+be exercised against a server that behaves like a loaded Ollama:
+
+- latency: seconds slept per request, drawn from a distribution
+  (`0.5`, `uniform:0.2,1.5`, `normal:0.8,0.2`, `exponential:0.5`)
+- max_concurrent: requests processed at the same time (OLLAMA_NUM_PARALLEL);
+  the others wait for a slot
+- max_queue: requests allowed to wait; above it the server answers 503 like
+  Ollama's "server busy" (OLLAMA_MAX_QUEUE)
+- error_rate: share of requests answered 500
+- script: a JSON list of rules checked before the stub_llm ones, e.g.
+  `{"match": ["SIMPLE", "COMPLEX"], "response": "COMPLEX"}` or
+  `{"match": ["doc_names:"], "status": 503}`; a non-string response is sent as JSON text
+
+```bash
+python benchmarks/mock_ollama.py --port 11500 --latency uniform:0.2,1.0 --max_concurrent 4 --max_queue 16
+RAG_OLLAMA_HOST=http://127.0.0.1:11500 python My_RAG/main.py --workers 8 --no_cache ...
+```
+
+(--no_cache keeps the mock responses out of the persistent LLM cache.)
+In-process, `with MockOllama(latency='0.1') as server:` serves on a free port
+at `server.url` until the block exits.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from stub_llm import DEFAULT_RULES, EMBEDDING_DIM, stub_answer, stub_embedding, embed_response
+
+BUSY_ERROR = "server busy, please try again.  maximum pending requests exceeded"
+
+
+def parse_latency(spec):
+    """Function of a random.Random returning the seconds of one request."""
+    spec = str(spec)
+    kind, _, args = spec.partition(':') if ':' in spec else ('fixed', ':', spec)
+    values = [float(value) for value in args.split(',')] if args else []
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(*values)
+    if kind == 'normal' and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(*values))
+    if kind == 'exponential' and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def load_script(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+class MockOllama:
+    def __init__(self, host='127.0.0.1', port=0, latency='0', embed_latency=None, max_concurrent=None,
+                 max_queue=None, error_rate=0.0, script=None, seed=0, dim=EMBEDDING_DIM):
+        self.latency = parse_latency(latency)
+        self.embed_latency = parse_latency(embed_latency) if embed_latency is not None else self.latency
+        self.max_queue = max_queue
+        self.error_rate = error_rate
+        self.script = script or []
+        self.dim = dim
+        self._slots = threading.Semaphore(max_concurrent) if max_concurrent else None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+        self.counts = {'requests': 0, 'busy': 0, 'errors': 0, 'max_running': 0}
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def close(self):
+        self._server.server_close()
+
+    def start(self):
+        """Serve in a daemon thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-ollama', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def draw(self, distribution):
+        with self._lock:
+            return distribution(self._rng), self._rng.random() < self.error_rate
+
+    def acquire(self):
+        """Take a processing slot, waiting for one; False when the queue is full."""
+        with self._lock:
+            self.counts['requests'] += 1
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.max_queue is not None and self._waiting >= self.max_queue:
+                    self.counts['busy'] += 1
+                    return False
+                self._waiting += 1
+            self._slots.acquire()
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._running += 1
+            self.counts['max_running'] = max(self.counts['max_running'], self._running)
+        return True
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def scripted(self, text):
+        """First script rule matching the text, None without one."""
+        for rule in self.script:
+            if all(marker in text for marker in rule.get('match', [])):
+                return rule
+        return None
+
+    def generate(self, body):
+        model, prompt = body.get('model', ''), body.get('prompt', '')
+        rule = self.scripted(prompt)
+        if rule is not None and 'status' in rule:
+            return rule['status'], {'error': rule.get('error', 'scripted error')}
+        if rule is not None:
+            answer = rule.get('response', '')
+            answer = answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)
+        else:
+            answer = stub_answer(prompt, DEFAULT_RULES)
+        return 200, {'model': model, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                     'response': answer, 'done': True, 'done_reason': 'stop',
+                     'prompt_eval_count': len(prompt.split()), 'eval_count': len(answer.split())}
+
+    def embed(self, body):
+        rule = self.scripted(json.dumps(body.get('input', ''), ensure_ascii=False))
+        if rule is not None and 'status' in rule:
+            return rule['status'], {'error': rule.get('error', 'scripted error')}
+        return 200, embed_response(body.get('model', ''), body.get('input', ''), self.dim)
+
+    def embeddings(self, body):
+        rule = self.scripted(body.get('prompt', ''))
+        if rule is not None and 'status' in rule:
+            return rule['status'], {'error': rule.get('error', 'scripted error')}
+        return 200, {'embedding': stub_embedding(body.get('prompt', ''), self.dim)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like Ollama, so the pooled httpx clients reuse their connections
+    protocol_version = 'HTTP/1.1'
+    routes = {'/api/generate': 'generate', '/api/embed': 'embed', '/api/embeddings': 'embeddings'}
+
+    def do_GET(self):
+        if self.path == '/':
+            self.send(200, 'Ollama is running', 'text/plain')
+        elif self.path == '/api/version':
+            self.send(200, {'version': 'mock'})
+        elif self.path == '/api/tags':
+            self.send(200, {'models': []})
+        else:
+            self.send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        mock = self.server.mock
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        endpoint = self.routes.get(self.path)
+        if endpoint is None:
+            self.send(404, {'error': 'not found'})
+            return
+        if not mock.acquire():
+            self.send(503, {'error': BUSY_ERROR})
+            return
+        try:
+            seconds, fail = mock.draw(mock.latency if endpoint == 'generate' else mock.embed_latency)
+            time.sleep(seconds)
+            if fail:
+                with mock._lock:
+                    mock.counts['errors'] += 1
+                self.send(500, {'error': 'mock error'})
+                return
+            status, payload = getattr(mock, endpoint)(body)
+        finally:
+            mock.release()
+        if endpoint == 'generate' and status == 200 and body.get('stream', True):
+            # One chunk holding the whole response
+            self.send(200, json.dumps(payload, ensure_ascii=False) + '\n', 'application/x-ndjson')
+        else:
+            self.send(status, payload)
+
+    def send(self, status, payload, content_type='application/json'):
+        data = (payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=str, default='0', help='Seconds per generate request, e.g. 0.5, uniform:0.2,1.5, normal:0.8,0.2, exponential:0.5 [default: 0]')
+    parser.add_argument('--embed_latency', type=str, help='Seconds per embed request [default: --latency]')
+    parser.add_argument('--max_concurrent', type=int, help='Requests processed at the same time [default: unlimited]')
+    parser.add_argument('--max_queue', type=int, help='Requests waiting for a slot before answering 503 [default: unlimited]')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Share of requests answered 500 [default: 0]')
+    parser.add_argument('--script', type=str, help='JSON file of scripted rules')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = MockOllama(args.host, args.port, args.latency, args.embed_latency, args.max_concurrent, args.max_queue,
+                        args.error_rate, load_script(args.script) if args.script else None, args.seed)
+    print(f"Mock Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"Requests: {server.counts}")
@@ -0,0 +1,265 @@
+"""
+Offline benchmarks of the retrieval and routing CPU cost.
+
+Replays the queries of `dragonball_dataset/queries_show/*.jsonl` with the LLM
+and embedding requests answered by stub_llm (no Ollama needed) and measures,
+per suite, the setup time, the per-query latency percentiles, queries/sec and
+the peak RSS. Every suite runs in its own process, so its peak RSS is its own.
+
+- router: router.router end to end, with the p50/p95/p99 of each traced stage
+- name_matching: router.name_matcher
+- bm25: the chunk retriever of the name chain (documents of the matched names)
+  built and scored for the query
+- faiss: a search of the FAISS indexes (chunks, documents) with hash-derived query vectors
+
+The report (JSON) records the commit it was run on; compare two reports with
+--compare. Run from the repository root (the db paths are relative to it):
+
+```bash
+python benchmarks/run_benchmarks.py
+python benchmarks/run_benchmarks.py --suite name_matching --suite bm25 --output /tmp/after.json
+python benchmarks/run_benchmarks.py --compare benchmarks/results/1a2b3c4.json /tmp/after.json
+```
+"""
+import copy
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../My_RAG')))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERY_FILES = 'dragonball_dataset/queries_show/*.jsonl'
+RESULTS_DIR = 'benchmarks/results'
+SUITES = ['router', 'name_matching', 'bm25', 'faiss']
+FAISS_KINDS = ['chunks', 'documents']
+FAISS_TOP_K = 10
+PERCENTILES = (50, 95, 99)
+# Compared by --compare, and whether a higher value is better
+METRICS = {'qps': True, 'p50_ms': False, 'p95_ms': False, 'setup_s': False, 'peak_rss_mb': False}
+
+
+def load_queries(pattern):
+    """(language, query) of every query of the files, once per (language, query_id)."""
+    queries = {}
+    for path in sorted(glob.glob(pattern)):
+        # queries_en.jsonl has no language field, the name tells it
+        file_language = 'zh' if path.endswith('_zh.jsonl') else 'en'
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                query = json.loads(line)
+                language = query.get('language', file_language)
+                queries.setdefault((language, query['query']['query_id']), (language, query))
+    return list(queries.values())
+
+
+def timings(latencies, wall):
+    """Throughput and latency percentiles (ms) of per-query seconds."""
+    stats = {'queries': len(latencies), 'wall_s': wall, 'qps': len(latencies) / wall if wall else None}
+    if latencies:
+        for q, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+            stats[f'p{q}_ms'] = float(value) * 1000
+    return stats
+
+
+def timed(queries, run):
+    """Run `run(language, query)` per query; timings plus the count of queries that raised."""
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for language, query in queries:
+        query_start = time.perf_counter()
+        try:
+            run(language, query)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - query_start)
+    return {**timings(latencies, time.perf_counter() - start), 'errors': errors}
+
+
+def languages(queries):
+    return sorted({language for language, _ in queries})
+
+
+def bench_router(queries):
+    from router import router
+    from router_utils import cache_document_names
+    from My_RAG.tracing import trace_query, summarize
+
+    start = time.perf_counter()
+    for language in languages(queries):
+        cache_document_names(language)
+    setup = time.perf_counter() - start
+
+    traces = []
+
+    def run(language, query):
+        with trace_query(query['query']['query_id']) as trace:
+            try:
+                router(copy.deepcopy(query), language)
+            finally:
+                traces.append(trace)
+
+    return {'setup_s': setup, **timed(queries, run), 'stages': summarize(traces)}
+
+
+def bench_name_matching(queries):
+    from router import name_matcher
+    from router_utils import get_name_matcher
+
+    start = time.perf_counter()
+    for language in languages(queries):
+        get_name_matcher(language)
+    setup = time.perf_counter() - start
+    return {'setup_s': setup, **timed(queries, lambda language, query: name_matcher(query, language))}
+
+
+def bench_bm25(queries):
+    from router import name_matcher
+    from bm25_index import load_bm25_index
+    from retriever import create_chunk_retriever
+
+    start = time.perf_counter()
+    for language in languages(queries):
+        load_bm25_index(language)
+    setup = time.perf_counter() - start
+    # The documents the router would hand to the name chain (not timed)
+    matches = {id(query): name_matcher(query, language)[:2] for language, query in queries}
+
+    def run(language, query):
+        prediction, doc_id = matches[id(query)]
+        create_chunk_retriever(prediction, doc_id, language).retrieve(query['query']['content'], threshold=0)
+
+    return {'setup_s': setup, **timed(queries, run)}
+
+
+def bench_faiss(queries):
+    from faiss_registry import get_faiss_index
+    from stub_llm import stub_embedding
+
+    start = time.perf_counter()
+    entries = {(kind, language): get_faiss_index(kind, language)
+               for kind in FAISS_KINDS for language in languages(queries)}
+    entries = {key: entry for key, entry in entries.items() if entry is not None}
+    setup = time.perf_counter() - start
+    if not entries:
+        return {'skipped': 'no FAISS index found'}
+    # Query embeddings are requests to the embedding model, not FAISS cost (not timed)
+    dims = {entry.index.d for entry in entries.values()}
+    vectors = {(dim, id(query)): np.array([stub_embedding(query['query']['content'], dim)], dtype='float32')
+               for dim in dims for _, query in queries}
+
+    def run(language, query):
+        for (_, index_language), entry in entries.items():
+            if index_language == language:
+                entry.index.search(vectors[(entry.index.d, id(query))], min(FAISS_TOP_K, entry.index.ntotal))
+
+    return {'setup_s': setup, 'indexes': sorted('/'.join(key) for key in entries), **timed(queries, run)}
+
+
+def run_suite(suite, pattern):
+    """Entry point of a suite's process."""
+    import stub_llm
+    from My_RAG.log_config import configure_logging
+    stub_llm.install()
+    configure_logging(quiet=True)
+    queries = load_queries(pattern)
+    result = globals()[f'bench_{suite}'](queries)
+    # ru_maxrss is in KiB on Linux
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run_benchmarks(suites, pattern):
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'query_files': sorted(glob.glob(pattern)),
+        'suites': {}
+    }
+    for suite in suites:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            report['suites'][suite] = executor.submit(run_suite, suite, pattern).result()
+    return report
+
+
+def format_report(report):
+    lines = [f"commit {report['commit']}{' (dirty)' if report['dirty'] else ''}, {report['created']}"]
+    header = f"{'suite':<15}{'queries':>8}{'errors':>8}{'setup (s)':>11}{'qps':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'rss (MB)':>10}"
+    lines += [header, '-' * len(header)]
+    for suite, stats in report['suites'].items():
+        if 'skipped' in stats:
+            lines.append(f"{suite:<15}skipped: {stats['skipped']}")
+            continue
+        lines.append(f"{suite:<15}{stats['queries']:>8}{stats['errors']:>8}{stats['setup_s']:>11.3f}{stats['qps']:>10.1f}"
+                     f"{stats.get('p50_ms', 0):>10.2f}{stats.get('p95_ms', 0):>10.2f}{stats['peak_rss_mb']:>10.1f}")
+    return '\n'.join(lines)
+
+
+def compare_reports(old, new):
+    """Table of the METRICS of the suites in both reports, with the relative change."""
+    header = f"{'suite':<15}{'metric':<13}{old['commit'] or 'old':>12}{new['commit'] or 'new':>12}{'change':>10}"
+    lines = [header, '-' * len(header)]
+    for suite, stats in new['suites'].items():
+        old_stats = old['suites'].get(suite, {})
+        for metric, higher_is_better in METRICS.items():
+            before, after = old_stats.get(metric), stats.get(metric)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            better = change > 0 if higher_is_better else change < 0
+            mark = '' if abs(change) < 5 else (' +' if better else ' -')
+            lines.append(f"{suite:<15}{metric:<13}{before:>12.3f}{after:>12.3f}{change:>9.1f}%{mark}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--suite', action='append', choices=SUITES, help='Suite to run, repeatable [default: all]')
+    parser.add_argument('--queries', type=str, default=QUERY_FILES, help=f'Glob of the query files [default: {QUERY_FILES}]')
+    parser.add_argument('--output', type=str, help=f'Report file [default: {RESULTS_DIR}/<commit>.json]')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two reports instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path, 'r', encoding='utf-8') as file:
+                reports.append(json.load(file))
+        print(compare_reports(*reports))
+        sys.exit(0)
+
+    report = run_benchmarks(args.suite or SUITES, args.queries)
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit'] or 'report'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(format_report(report))
+    print(f"Report saved to {output}")
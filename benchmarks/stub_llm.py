@@ -0,0 +1,130 @@
+"""
+Deterministic stand-in for the Ollama API used by My_RAG.llm_gateway.
+
+`install()` replaces the `Client` / `AsyncClient` of llm_gateway, so every
+generate and embed request of the chains (and of embedding_service) is answered
+in-process without a model:
+
+- generate: the response of the first rule whose markers all appear in the
+  prompt, otherwise an answer derived from the hash of the prompt,
+- embed / embeddings: unit vectors derived from the hash of each text.
+
+The same prompt always gets the same response, so two runs of the pipeline do
+the same work. Rules are `(markers, response)` pairs, the response a string or
+a function of the prompt; the default ones answer the prompts whose response
+the chains parse (the query classifier, the name chain's sub-question breakdown
+and the summary chain's JSON).
+"""
+import ast
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from My_RAG import llm_gateway, llm_cache
+
+# qwen3-embedding:0.6b, the model of embedding_service and of the FAISS indexes
+EMBEDDING_DIM = 1024
+
+
+def breakdown_response(prompt):
+    """One sub-question (the user query itself) per document of a construct_multiple_questions prompt."""
+    names = re.search(r'^doc_names: (.*)$', prompt, re.MULTILINE)
+    query = re.search(r'^User Query: (.*)$', prompt, re.MULTILINE)
+    try:
+        doc_names = ast.literal_eval(names.group(1))
+    except (AttributeError, ValueError, SyntaxError):
+        return '[]'
+    return json.dumps([{'doc_name': name, 'sub_question': query.group(1) if query else ''} for name in doc_names])
+
+
+DEFAULT_RULES = [
+    (['SIMPLE', 'COMPLEX'], 'SIMPLE'),
+    (['"doc_name"', '"sub_question"'], breakdown_response),
+    (['"retrieve": ['], json.dumps({'retrieve': [], 'answer': 'Stub answer.'})),
+]
+
+
+def digest(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def stub_answer(prompt, rules=DEFAULT_RULES):
+    for markers, response in rules:
+        if all(marker in prompt for marker in markers):
+            return response(prompt) if callable(response) else response
+    return f"Stub answer {digest(prompt)[:4].hex()}."
+
+
+def stub_embedding(text, dim=EMBEDDING_DIM):
+    """Unit vector seeded by the hash of text."""
+    rng = np.random.default_rng(int.from_bytes(digest(text)[:8], 'little'))
+    vector = rng.standard_normal(dim).astype('float32')
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def generate_response(model, prompt, rules=DEFAULT_RULES):
+    """Body of an /api/generate response (non-streamed), with whitespace token counts."""
+    answer = stub_answer(prompt, rules)
+    return {'model': model, 'response': answer, 'done': True,
+            'prompt_eval_count': len(prompt.split()), 'eval_count': len(answer.split())}
+
+
+def embed_response(model, input, dim=EMBEDDING_DIM):
+    texts = [input] if isinstance(input, str) else list(input)
+    return {'model': model, 'embeddings': [stub_embedding(text, dim) for text in texts]}
+
+
+class StubClient:
+    """ollama.Client look-alike; `latency` seconds are slept per request."""
+    rules = DEFAULT_RULES
+    latency = 0.0
+    dim = EMBEDDING_DIM
+
+    def __init__(self, host=None, **kwargs):
+        self.host = host
+
+    def generate(self, model='', prompt='', options=None, **kwargs):
+        time.sleep(self.latency)
+        return generate_response(model, prompt, self.rules)
+
+    def embed(self, model='', input='', **kwargs):
+        time.sleep(self.latency)
+        return embed_response(model, input, self.dim)
+
+    def embeddings(self, model='', prompt='', **kwargs):
+        time.sleep(self.latency)
+        return {'embedding': stub_embedding(prompt, self.dim)}
+
+
+class StubAsyncClient(StubClient):
+    async def generate(self, model='', prompt='', options=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return generate_response(model, prompt, self.rules)
+
+    async def embed(self, model='', input='', **kwargs):
+        await asyncio.sleep(self.latency)
+        return embed_response(model, input, self.dim)
+
+    async def embeddings(self, model='', prompt='', **kwargs):
+        await asyncio.sleep(self.latency)
+        return {'embedding': stub_embedding(prompt, self.dim)}
+
+
+def install(rules=None, latency=0.0):
+    """
+    Answer the llm_gateway requests of this process with the stub clients. The
+    persistent LLM cache is turned off so every request reaches the stub.
+    """
+    StubClient.rules = DEFAULT_RULES if rules is None else rules
+    StubClient.latency = latency
+    llm_gateway.Client = StubClient
+    llm_gateway.AsyncClient = StubAsyncClient
+    llm_gateway._clients.clear()
+    llm_gateway._async_clients.clear()
+    llm_cache.set_cache_enabled(False)
@@ -9,7 +9,13 @@ class Connection:
             cursor.execute(sql, params)
         else:
             cursor.execute(sql)
-        self.conn.commit()
+        # Only writes open a transaction; reads have nothing to commit
+        if self.conn.in_transaction:
+            self.conn.commit()
         return cursor
+    def close(self):
+        self.conn.close()
+    def __enter__(self):
+        return self
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.conn.close()
\ No newline at end of file
+        self.conn.close()
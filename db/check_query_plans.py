@@ -0,0 +1,108 @@
+"""
+Check that the hot retrieval queries are served by indexes, in id order.
+
+Runs EXPLAIN QUERY PLAN for the queries of the retrieval paths against a built
+database and fails when one of them scans a whole table instead of searching an
+index (see the `indexes` of dataset_table-schema.yaml). The chunk queries are
+also run: get_chunks_from_db merges each short chunk with the next row and the
+prebuilt BM25 index selects chunks in id order, so their ids must ascend.
+
+```bash
+python db/check_query_plans.py
+python db/check_query_plans.py --db_path /path/to/other.db
+```
+"""
+import re
+import sqlite3
+import sys
+
+DB_PATH = 'db/dataset.db'
+
+# (description, sql, params, tables that must not be scanned)
+HOT_QUERIES = [
+    # doc_id 27 has chunks on both sides of doc_id 28's: an index order would interleave them
+    ("retriever: chunks of doc_ids",
+     "SELECT id, name, content FROM chunks WHERE doc_id IN (?, ?) ORDER BY id", (27, 28), ['chunks']),
+    ("retriever: chunks of a domain",
+     "SELECT id, name, content FROM chunks WHERE domain = ? and language = ? ORDER BY id", ('Finance', 'zh'), ['chunks']),
+    # Half of the chunks, already in id order in the table
+    ("retriever: chunks of a language",
+     "SELECT id, name, content FROM chunks where language = ? ORDER BY id", ('zh',), []),
+    ("retriever: chunks by id",
+     "SELECT id, name, content FROM chunks WHERE id IN (?, ?)", (1, 2), ['chunks']),
+    ("embedding_retriever: chunks of doc_ids",
+     "SELECT id, content FROM chunks WHERE doc_id IN (?, ?) ORDER BY id", (27, 28), ['chunks']),
+    # Domains are a third of the chunks each: reading the table is cheaper than an index
+    ("embedding_retriever: chunks of domains",
+     "SELECT id, content FROM chunks WHERE domain IN (?, ?) ORDER BY id", ('Finance', 'Law'), []),
+    ("name_router_chain: documents of doc_ids",
+     "SELECT content FROM documents WHERE doc_id IN (?, ?) ORDER BY id", (27, 28), ['documents']),
+    ("summary_router_chain: document of a doc_id",
+     "SELECT content FROM documents WHERE doc_id = ? ORDER BY id", (27,), ['documents']),
+    ("default_chain: documents by id",
+     "SELECT domain FROM documents WHERE id in (?)", (1,), ['documents']),
+    ("sentence_store: sentences of chunks",
+     "SELECT chunk_id, chunk_crc, content, tokens FROM sentences WHERE chunk_id IN (?, ?) ORDER BY chunk_id, sentence_index",
+     (1, 2), ['sentences']),
+    ("ingest_dataset: document of a doc_id and name",
+     "SELECT id, domain, language, content_hash FROM documents WHERE doc_id = ? AND name = ?", (1, 'x'), ['documents']),
+    ("ingest_dataset: chunks of a doc_id and name",
+     "SELECT id, language, domain, content_hash FROM chunks WHERE doc_id = ? AND name = ? ORDER BY id", (1, 'x'), ['chunks']),
+    ("time_router_chain: chunks of a year and month joined to their documents",
+     "SELECT chunks.id, chunks.name, chunks.content FROM chunks "
+     "JOIN documents ON chunks.doc_id = documents.doc_id AND chunks.language = documents.language "
+     "WHERE chunks.language = ? "
+     "AND chunks.id IN (SELECT chunk_id FROM chunk_years WHERE year IN (?)) "
+     "AND chunks.id IN (SELECT chunk_id FROM chunk_months WHERE month IN (?)) "
+     "AND documents.domain != 'Finance' ORDER BY chunks.id",
+     ('en', 2019, 3), ['chunks', 'documents', 'chunk_years', 'chunk_months']),
+]
+
+
+def full_scans(conn, sql, params, tables):
+    """
+    Plan lines reading all rows of one of the tables. Scanning a covering index is
+    allowed: it reads the (small) index only, e.g. the outer loop of a join.
+    """
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[3] for row in plan
+            if tables and re.match(rf"SCAN ({'|'.join(tables)})\b", row[3]) and 'COVERING INDEX' not in row[3]]
+
+
+def unordered_ids(conn, sql, params):
+    """Whether the rows of a query selecting chunks.id first come back out of id order."""
+    ids = [row[0] for row in conn.execute(sql, params)]
+    return ids != sorted(ids)
+
+
+def main(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    failures = 0
+    for description, sql, params, tables in HOT_QUERIES:
+        try:
+            scans = full_scans(conn, sql, params, tables)
+        except sqlite3.OperationalError as e:
+            # e.g. tables of a database built before them
+            print(f"[SKIP] {description}: {e}")
+            continue
+        if scans:
+            failures += 1
+            print(f"[FAIL] {description}: {'; '.join(scans)}")
+        elif re.match(r"SELECT (chunks\.)?id\b.* FROM chunks\b", sql) and unordered_ids(conn, sql, params):
+            failures += 1
+            print(f"[FAIL] {description}: chunk ids are not in ascending order")
+        else:
+            print(f"[OK]   {description}")
+    conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db_path', type=str, default=DB_PATH, help='Database to check')
+    args = parser.parse_args()
+    failures = main(args.db_path)
+    if failures:
+        print(f"{failures} queries scan a whole table or return chunks out of id order")
+        sys.exit(1)
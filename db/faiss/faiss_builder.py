@@ -0,0 +1,197 @@
+"""
+Parallel, resumable FAISS index builder shared by the generate_faiss.py scripts.
+
+Rows are split into shards of `shard_rows` rows that are embedded concurrently
+(each shard in batched embed requests). Every finished shard is checkpointed to
+`{output_dir}/.build/shard_XXXXX.npy`, so an interrupted build resumes from the
+shards already on disk. Checkpoints are dropped when the rows or the embedding
+model change. The finished index and mapping are written next to the old ones
+and moved into place with os.replace, so the retriever never sees a missing or
+half-written index. The mapping records the ntotal and the sha1 of its index
+file, and the loaders reject a mapping written for another index (a save
+interrupted between the two renames).
+
+Indexes are IndexIDMap2 keyed by the row id, so update_faiss_index() can remove
+and add the vectors of individual rows when documents are ingested incrementally
+(see db/ingest_dataset.py).
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import faiss
+import numpy as np
+from tqdm import tqdm
+
+# Add project root to path to import My_RAG and db
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from My_RAG.embedding_service import embed_texts, EMBEDDING_MODEL, MAX_BATCH_SIZE
+from My_RAG.faiss_registry import read_mapping, file_sha1
+from db.Connection import Connection
+
+DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../dataset.db'))
+SHARD_ROWS = 1024
+WORKERS = 4
+
+
+def rows_fingerprint(rows):
+    digest = hashlib.sha1(EMBEDDING_MODEL.encode())
+    for id, content in rows:
+        digest.update(f"{id}\0{content}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def prepare_build_dir(build_dir, manifest):
+    """Keep the checkpoints of an earlier build of the same rows, drop anything else."""
+    manifest_path = os.path.join(build_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            if json.load(f) == manifest:
+                return
+        print(f"Rows or model changed since the last checkpoint, restarting {build_dir}")
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+
+def shard_path(build_dir, shard):
+    return os.path.join(build_dir, f"shard_{shard:05d}.npy")
+
+
+def embed_shard(rows, build_dir, shard, batch_size):
+    vectors = [embed_texts([content for _, content in rows[start:start + batch_size]], cache=False)
+               for start in range(0, len(rows), batch_size)]
+    vectors = np.concatenate(vectors).astype('float32')
+    # Write then rename, so a shard file on disk is always complete
+    tmp_path = shard_path(build_dir, shard) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, vectors)
+    os.replace(tmp_path, shard_path(build_dir, shard))
+    return shard
+
+
+def build_faiss_index(table, language, output_dir, workers=WORKERS, shard_rows=SHARD_ROWS, batch_size=MAX_BATCH_SIZE):
+    """
+    Embed the rows of a table for one language and save `{language}.index` and
+    `{language}_mapping.json` (FAISS ID -> row id) in output_dir.
+
+    Args:
+        table: 'chunks', 'documents' or 'queries'
+        language: Language code ('en' or 'zh')
+        output_dir: Directory of the index and mapping
+        workers: Number of shards embedded concurrently
+        shard_rows: Rows per checkpoint shard
+        batch_size: Texts per embed request
+    """
+    conn = Connection(DB_PATH)
+    cursor = conn.execute(f"SELECT id, content FROM {table} WHERE language = ? ORDER BY id", (language,))
+    docs = cursor.fetchall()
+    if not docs:
+        print(f"No documents found for language: {language}")
+        return
+
+    build_dir = os.path.join(output_dir, '.build')
+    prepare_build_dir(build_dir, {
+        'table': table,
+        'language': language,
+        'model': EMBEDDING_MODEL,
+        'shard_rows': shard_rows,
+        'rows': rows_fingerprint(docs),
+    })
+    shards = range((len(docs) + shard_rows - 1) // shard_rows)
+    todo = [shard for shard in shards if not os.path.exists(shard_path(build_dir, shard))]
+    print(f"Generating {language} indices in {output_dir}: {len(docs)} rows, "
+          f"{len(shards) - len(todo)}/{len(shards)} shards already checkpointed")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(embed_shard, docs[s * shard_rows:(s + 1) * shard_rows], build_dir, s, batch_size): s
+                   for s in todo}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error embedding shard {futures[future]}: {e}")
+                failed.append(futures[future])
+    if failed:
+        print(f"{len(failed)} shards failed, keeping the current index. Rerun to resume from the checkpoints.")
+        return False
+
+    vectors_np = np.concatenate([np.load(shard_path(build_dir, shard)) for shard in shards])
+    ids = np.array([doc[0] for doc in docs], dtype=np.int64)
+    # FAISS IDs are the row ids, so single rows can be replaced later
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors_np.shape[1]))
+    index.add_with_ids(vectors_np, ids)
+    save_index(index, {id: id for id in ids.tolist()}, language, output_dir)
+    shutil.rmtree(build_dir)
+    return True
+
+
+def save_index(index, mapping, language, output_dir):
+    """Write the index and its mapping (FAISS ID -> row id, with the index ntotal and sha1) and move them into place."""
+    index_path = os.path.join(output_dir, f"{language}.index")
+    mapping_path = os.path.join(output_dir, f"{language}_mapping.json")
+    faiss.write_index(index, index_path + '.tmp')
+    with open(mapping_path + '.tmp', 'w') as f:
+        json.dump({'ntotal': index.ntotal, 'index_sha1': file_sha1(index_path + '.tmp'), 'mapping': mapping}, f)
+    os.replace(mapping_path + '.tmp', mapping_path)
+    os.replace(index_path + '.tmp', index_path)
+    print(f"Saved FAISS index to {index_path}")
+    print(f"Saved mapping to {mapping_path}")
+
+
+def update_faiss_index(language, output_dir, removed_ids, rows, batch_size=MAX_BATCH_SIZE):
+    """
+    Remove the vectors of removed_ids and (re-)embed the given `(id, content)` rows in place.
+
+    Indexes built before the switch to IndexIDMap2 are converted first.
+
+    Returns:
+        False if there is no index to update, or its mapping does not match it (build it with generate_faiss.py)
+    """
+    index_path = os.path.join(output_dir, f"{language}.index")
+    mapping_path = os.path.join(output_dir, f"{language}_mapping.json")
+    if not os.path.exists(index_path) or not os.path.exists(mapping_path):
+        print(f"No FAISS index at {index_path}, build it with generate_faiss.py")
+        return False
+    index = faiss.read_index(index_path)
+    mapping = read_mapping(mapping_path, index_path, index)
+    if mapping is None:
+        print(f"{mapping_path} was written for another version of {index_path}, rebuild it with generate_faiss.py")
+        return False
+    if not isinstance(index, faiss.IndexIDMap):
+        # Flat index whose FAISS IDs are row numbers: re-key it by row id
+        ids = np.array([mapping[row] for row in range(index.ntotal)], dtype=np.int64)
+        vectors_np = index.reconstruct_n(0, index.ntotal)
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+        index.add_with_ids(vectors_np, ids)
+        mapping = {id: id for id in ids.tolist()}
+
+    stale = np.array(list(removed_ids) + [id for id, _ in rows], dtype=np.int64)
+    removed = index.remove_ids(faiss.IDSelectorBatch(stale)) if len(stale) else 0
+    for id in stale.tolist():
+        mapping.pop(id, None)
+    if rows:
+        vectors_np = np.concatenate([embed_texts([content for _, content in rows[start:start + batch_size]], cache=False)
+                                     for start in range(0, len(rows), batch_size)])
+        index.add_with_ids(vectors_np.astype('float32'), np.array([id for id, _ in rows], dtype=np.int64))
+        mapping.update({id: id for id, _ in rows})
+    print(f"Updated {language} index in {output_dir}: {removed} vectors removed, {len(rows)} embedded")
+    save_index(index, mapping, language, output_dir)
+    return True
+
+
+def main(table):
+    parser = argparse.ArgumentParser(description=f"Build the FAISS indexes of the {table} table")
+    parser.add_argument("--languages", nargs="+", default=["en", "zh"])
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--shard_rows", type=int, default=SHARD_ROWS)
+    args = parser.parse_args()
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), table)
+    for language in args.languages:
+        build_faiss_index(table, language, os.path.join(base_dir, language), args.workers, args.shard_rows)
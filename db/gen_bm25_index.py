@@ -0,0 +1,24 @@
+import os
+import sys
+from Connection import Connection
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../My_RAG')))
+from bm25_index import build_index, INDEX_DIR
+from token_store import load_token_store
+
+DB_PATH = 'db/dataset.db'
+
+def main(languages):
+    conn = Connection(DB_PATH)
+    for language in languages:
+        cursor = conn.execute("SELECT id, doc_id, domain, content FROM chunks WHERE language = ? ORDER BY id", (language,))
+        rows = cursor.fetchall()
+        print(f"Building {language} BM25 index from {len(rows)} chunks...")
+        build_index(rows, language, os.path.join(INDEX_DIR, language), load_token_store(language))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--languages', nargs='+', default=['en', 'zh'], help='Languages to index [default: en zh]')
+    args = parser.parse_args()
+    main(args.languages)
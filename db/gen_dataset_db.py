@@ -1,100 +1,286 @@
 import jsonlines
 import json
+import os
+import sqlite3
+import sys
+import time
 from Connection import Connection
 from chunker import single_chunk
-from utils import create_table_from_yaml
+from utils import create_table_from_yaml, index_statements, changed_indexes, content_hash
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../My_RAG')))
+from token_store import build_token_store, TOKEN_STORE_DIR
+from sentence_search import create_document_sentences, drop_document_sentences, index_document_sentences, rebuild_document_sentences_fts
+from sentence_store import create_sentences_table, drop_sentences_table, index_chunk_sentences
+from temporal_store import create_temporal_tables, drop_temporal_tables, index_chunk_entities
+from data_access import enable_wal
 
 SCHEMA_PATH = 'db/dataset_table-schema.yaml'
 DB_PATH = 'db/dataset.db'
 DATASET_PATH = 'dragonball_dataset/dragonball_docs.jsonl'
 SPECIAL_DATASET_PATH = 'db/special_dataset.jsonl'
+# Documents per executemany batch (and per transaction) of the bulk build
+BATCH_DOCS = 500
+# Negative cache_size is in KiB
+BUILD_CACHE_SIZE_KB = 256 * 1024
+
+DOCUMENT_INSERT = "INSERT INTO documents (id, doc_id, domain, language, name, content, jsonl, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+CHUNK_INSERT = "INSERT INTO chunks (id, doc_id, domain, language, name, content, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)"
 
 def create_tables():
+    """Recreate the tables, without the secondary indexes (created once the build has loaded them)."""
     conn = Connection(DB_PATH)
     conn.execute("DROP TABLE IF EXISTS documents")
     conn.execute("DROP TABLE IF EXISTS chunks")
-    create_table_from_yaml(SCHEMA_PATH, DB_PATH)
+    drop_document_sentences(conn.conn)
+    drop_sentences_table(conn.conn)
+    drop_temporal_tables(conn.conn)
+    # A full build rewrites the token stores and BM25 indexes (FAISS is rebuilt with generate_faiss.py)
+    drop_pending_tables(conn.conn)
+    create_table_from_yaml(SCHEMA_PATH, DB_PATH, indexes=False)
+    create_document_sentences(conn.conn, indexes=False)
+    create_sentences_table(conn.conn, indexes=False)
+    create_temporal_tables(conn.conn, indexes=False)
+    conn.close()
+
+def create_schema_indexes(conn):
+    """
+    Indexes declared in the schema file (IF NOT EXISTS, so also adds them to older
+    databases). An index declared with other columns than the database's is rebuilt.
+    """
+    changed = changed_indexes(conn, SCHEMA_PATH)
+    for name in changed:
+        conn.execute(f"DROP INDEX {name}")
+    for sql in index_statements(SCHEMA_PATH):
+        conn.execute(sql)
+    if changed:
+        conn.execute("ANALYZE")
+
+def create_pending_tables(conn):
+    """
+    Index work recorded by ingest_dataset in the transaction that changes the rows,
+    and cleared once the indexes are rewritten:
+    - pending_token_languages: languages whose token store and BM25 index are stale
+    - pending_index_changes: FAISS vectors to remove (removed = 1) or to (re-)embed
+    """
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS pending_token_languages (
+            language TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS pending_index_changes (
+            table_name TEXT NOT NULL,
+            language TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            removed INTEGER NOT NULL,
+            PRIMARY KEY (table_name, language, row_id, removed)
+        );
+    """)
+
+def drop_pending_tables(conn):
+    conn.executescript("""
+        DROP TABLE IF EXISTS pending_token_languages;
+        DROP TABLE IF EXISTS pending_index_changes;
+    """)
+
+def create_indexes(conn):
+    create_schema_indexes(conn)
+    create_sentences_table(conn)
+    create_temporal_tables(conn)
+    rebuild_document_sentences_fts(conn)
+    # Statistics for the query planner
+    conn.execute("ANALYZE")
+    conn.commit()
 
 def main(docs_path):
+    start = time.time()
     create_tables()
-    populate_documents(docs_path)
-    insert_special_documents()
-    populate_chunks(docs_path)
-    insert_special_chunks()
+    conn = connect_bulk(DB_PATH)
+    counts = bulk_load(conn, read_docs([docs_path, SPECIAL_DATASET_PATH]))
+    load_time = time.time() - start
+    print(f"Loaded {counts['documents']} documents, {counts['chunks']} chunks ({counts['rows']} rows) "
+          f"in {load_time:.1f}s, {counts['rows'] / max(load_time, 1e-9):.0f} rows/s")
+    create_indexes(conn)
+    conn.close()
+    print(f"Indexes created in {time.time() - start - load_time:.1f}s")
+    populate_token_store()
+    # Query workers read while ingest_dataset writes
+    enable_wal(DB_PATH)
+
+##################################
+# Here for the bulk build
+##################################
+
+def connect_bulk(path=DB_PATH):
+    """
+    Connection for a full rebuild: no rollback journal and no fsync.
+    A build that fails halfway leaves an unusable database, it is simply rerun.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(f"PRAGMA cache_size = -{BUILD_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+def read_docs(paths):
+    for path in paths:
+        with jsonlines.open(path, 'r') as reader:
+            yield from reader
+
+def bulk_load(conn, docs):
+    """
+    Stream documents into the documents, chunks and both sentence tables, BATCH_DOCS
+    documents per transaction. Ids are assigned here, in the order the rows used to be
+    inserted one by one (documents and chunks both in input order).
+
+    Returns:
+        {'documents', 'chunks', 'rows'}: counts of documents, chunks and all rows written
+    """
+    counts = {'documents': 0, 'chunks': 0}
+    start_changes = conn.total_changes
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == BATCH_DOCS:
+            load_batch(conn, batch, counts)
+            batch = []
+    if batch:
+        load_batch(conn, batch, counts)
+    counts['rows'] = conn.total_changes - start_changes
+    return counts
+
+def load_batch(conn, docs, counts):
+    documents = []
+    chunks = []
+    # language -> (chunk id, doc_id, content) of the chunks to split into sentences
+    chunk_sentences = {}
+    for doc in docs:
+        name = get_document_name(doc)
+        jsonl = json.dumps(doc)
+        counts['documents'] += 1
+        documents.append((counts['documents'], doc['doc_id'], doc['domain'], doc['language'], name, doc['content'], jsonl, content_hash(jsonl)))
+        for chunk in single_chunk(doc['content']):
+            counts['chunks'] += 1
+            content = chunk['page_content']
+            chunks.append((counts['chunks'], doc['doc_id'], doc['domain'], doc['language'], name, content, content_hash(content)))
+            chunk_sentences.setdefault(doc['language'], []).append((counts['chunks'], doc['doc_id'], content))
+    conn.executemany(DOCUMENT_INSERT, documents)
+    index_document_sentences(conn, [(id, doc_id, domain, content) for id, doc_id, domain, _, _, content, _, _ in documents])
+    conn.executemany(CHUNK_INSERT, chunks)
+    for language, rows in chunk_sentences.items():
+        index_chunk_sentences(conn, rows, language)
+        index_chunk_entities(conn, [(id, content) for id, _, content in rows], language)
+    conn.commit()
 
 ##################################
 # Here for documents table
 ##################################
 
-def insert_document(doc):
-    conn = Connection(DB_PATH)
-    domain = doc['domain']
+def get_document_name(doc):
     mapping = {
         "Finance": "company_name",
         "Law": "court_name",
         "Medical": "hospital_patient_name"
     }
-    name = doc[mapping[domain]]
-    if domain == "Medical":
+    name = doc[mapping[doc['domain']]]
+    if doc['domain'] == "Medical":
         name = name.split("_")[0]
-    conn.execute(
-        "INSERT INTO documents (doc_id, domain, language, name, content, jsonl) VALUES (?, ?, ?, ?, ?, ?)",
-        (doc['doc_id'], domain, doc['language'], name, doc['content'], json.dumps(doc))
+    return name
+
+def insert_document(conn, doc):
+    """Insert one document and return its id (the caller commits)."""
+    jsonl = json.dumps(doc)
+    cursor = conn.execute(
+        "INSERT INTO documents (doc_id, domain, language, name, content, jsonl, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (doc['doc_id'], doc['domain'], doc['language'], get_document_name(doc), doc['content'], jsonl, content_hash(jsonl))
     )
+    return cursor.lastrowid
         
 
-def populate_documents(file_path):
-    with jsonlines.open(file_path, 'r') as reader:
-        for doc in reader:
-            insert_document(doc)
+def populate_document_sentences():
+    """(Re)build the document sentences and their FTS5 index used by router_utils.search_db_by_content."""
+    conn = Connection(DB_PATH)
+    drop_document_sentences(conn.conn)
+    create_document_sentences(conn.conn, indexes=False)
+    rows = conn.execute("SELECT id, doc_id, domain, content FROM documents ORDER BY id").fetchall()
+    index_document_sentences(conn.conn, rows)
+    rebuild_document_sentences_fts(conn.conn)
+    conn.conn.commit()
 
 ##################################
 # Here for chunks table
 ##################################
 
-def insert_chunks(doc):
-    conn = Connection(DB_PATH)
-    chunks = single_chunk(doc['content'])
-    mapping = {
-        "Finance": "company_name",
-        "Law": "court_name",
-        "Medical": "hospital_patient_name"
-    }
-    name = doc[mapping[doc['domain']]]
-    if doc['domain'] == "Medical":
-        name = name.split("_")[0]
+def insert_chunks(conn, doc, chunks=None):
+    """Insert the chunks of a document (all of them unless given) and return their ids (the caller commits)."""
+    if chunks is None:
+        chunks = single_chunk(doc['content'])
+    name = get_document_name(doc)
+    ids = []
     for chunk in chunks:
-        conn.execute(
-            "INSERT INTO chunks (doc_id, domain, language, name, content) VALUES (?, ?, ?, ?, ?)",
-            (doc['doc_id'], doc['domain'], doc['language'], name, chunk['page_content'])
+        cursor = conn.execute(
+            "INSERT INTO chunks (doc_id, domain, language, name, content, content_hash) VALUES (?, ?, ?, ?, ?, ?)",
+            (doc['doc_id'], doc['domain'], doc['language'], name, chunk['page_content'], content_hash(chunk['page_content']))
         )
+        ids.append(cursor.lastrowid)
+    # Sentences (with offsets and tokens) used by the name / time chains
+    index_chunk_sentences(conn, [(id, doc['doc_id'], chunk['page_content']) for id, chunk in zip(ids, chunks)], doc['language'])
+    # Years / months / dates used by the time chain
+    index_chunk_entities(conn, [(id, chunk['page_content']) for id, chunk in zip(ids, chunks)], doc['language'])
+    return ids
+
+def populate_sentences():
+    """(Re)build the sentences table from the chunks table."""
+    conn = Connection(DB_PATH)
+    drop_sentences_table(conn.conn)
+    create_sentences_table(conn.conn, indexes=False)
+    for language in [row[0] for row in conn.execute("SELECT DISTINCT language FROM chunks").fetchall()]:
+        rows = conn.execute("SELECT id, doc_id, content FROM chunks WHERE language = ? ORDER BY id", (language,)).fetchall()
+        index_chunk_sentences(conn.conn, rows, language)
+    create_sentences_table(conn.conn)
+    conn.conn.commit()
 
-def populate_chunks(file_path=DATASET_PATH):
-    with jsonlines.open(file_path, 'r') as reader:
-        for doc in reader:
-            insert_chunks(doc)
+def populate_temporal_entities():
+    """(Re)build the chunk_years / chunk_months / chunk_dates tables from the chunks table."""
+    conn = Connection(DB_PATH)
+    drop_temporal_tables(conn.conn)
+    create_temporal_tables(conn.conn, indexes=False)
+    for language in [row[0] for row in conn.execute("SELECT DISTINCT language FROM chunks").fetchall()]:
+        rows = conn.execute("SELECT id, content FROM chunks WHERE language = ? ORDER BY id", (language,)).fetchall()
+        index_chunk_entities(conn.conn, rows, language)
+    create_temporal_tables(conn.conn)
+    conn.conn.commit()
 
 ##################################
-# Here for handling modified special dataset
+# Here for the tokenization cache of chunks
 ##################################
 
-def insert_special_documents():
-    with jsonlines.open(SPECIAL_DATASET_PATH, 'r') as reader:
-        for doc in reader:
-            insert_document(doc)
-
-def insert_special_chunks():
-    with jsonlines.open(SPECIAL_DATASET_PATH, 'r') as reader:
-        for chunk in reader:
-            insert_chunks(chunk)
+def populate_token_store(languages=None, previous=None):
+    """
+    (Re)build the token store of the given languages (default: all).
+    previous maps a language to its current TokenStore, whose unchanged entries are reused.
+    """
+    conn = Connection(DB_PATH)
+    if languages is None:
+        languages = [row[0] for row in conn.execute("SELECT DISTINCT language FROM chunks").fetchall()]
+    for language in languages:
+        rows = conn.execute("SELECT id, content FROM chunks WHERE language = ? ORDER BY id", (language,)).fetchall()
+        build_token_store(rows, language, os.path.join(TOKEN_STORE_DIR, language), (previous or {}).get(language))
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--regen', type=bool, default=False, help='Regenerate the database [default: False]')
     parser.add_argument('--docs_path', type=str, default=DATASET_PATH, help='Path to the documents file')
+    parser.add_argument('--sentences', action='store_true', help='Only (re)build the document sentence FTS index and the sentences table')
+    parser.add_argument('--temporal', action='store_true', help='Only (re)build the chunk_years / chunk_months / chunk_dates tables')
     args = parser.parse_args()
     if (args.regen):
         main(args.docs_path)
+    elif (args.sentences):
+        populate_document_sentences()
+        populate_sentences()
+    elif (args.temporal):
+        populate_temporal_entities()
     else:
         print("No action taken.")
\ No newline at end of file
@@ -0,0 +1,260 @@
+"""
+Incremental ingest of new or changed documents.
+
+Unlike `gen_dataset_db.py --regen True`, this keeps the existing tables and
+indexes and only touches what changed:
+- documents are matched on (doc_id, name) and compared by content_hash;
+  unchanged documents are skipped, new ones inserted, changed ones updated in place
+  (with their rows of the document sentence index)
+- the chunks of a changed document keep their ids up to the first changed
+  chunk; the rest are deleted and the new chunks inserted
+- the token store reuses the tokens of every unchanged chunk, the BM25 index is
+  rebuilt from it, and only the removed / new vectors are updated in the
+  chunks and documents FAISS indexes
+
+A document's rows are written in one transaction together with the index work
+they need (pending_token_languages / pending_index_changes). That work is
+cleared only once the token store, BM25 and FAISS indexes have been rewritten,
+and every ingest also applies what an earlier one left (a crash, Ollama down
+during the FAISS update, or a --skip_faiss run), so an interrupted ingest never
+leaves stale indexes behind documents that already look unchanged.
+
+```bash
+python db/ingest_dataset.py --docs_path new_docs.jsonl
+python db/ingest_dataset.py --remove_doc_ids 12 13
+```
+"""
+import json
+import os
+import sqlite3
+import sys
+import time
+import jsonlines
+from Connection import Connection
+from chunker import single_chunk
+from utils import content_hash
+from gen_dataset_db import DB_PATH, get_document_name, insert_document, insert_chunks, populate_token_store, populate_document_sentences, populate_sentences, populate_temporal_entities, create_schema_indexes, create_pending_tables
+import gen_bm25_index
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../My_RAG')))
+from token_store import TokenStore, TOKEN_STORE_DIR
+from sentence_search import has_document_sentences, index_document_sentences, delete_document_sentences
+from sentence_store import delete_chunk_sentences
+from temporal_store import has_temporal_tables, delete_chunk_entities
+from data_access import enable_wal
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from db.faiss.faiss_builder import update_faiss_index
+
+FAISS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'faiss'))
+
+
+class Changes:
+    """Rows removed from / (re)written to each language, per table."""
+
+    def __init__(self):
+        self.removed = {'documents': {}, 'chunks': {}}
+        self.written = {'documents': {}, 'chunks': {}}
+
+    def remove(self, table, language, ids):
+        self.removed[table].setdefault(language, []).extend(ids)
+
+    def write(self, table, language, rows):
+        self.written[table].setdefault(language, []).extend(rows)
+
+    def languages(self, table='chunks'):
+        return sorted(set(self.removed[table]) | set(self.written[table]))
+
+    def record(self, conn):
+        """Add the changes to the pending index work, in the caller's transaction."""
+        conn.executemany("INSERT OR IGNORE INTO pending_token_languages (language) VALUES (?)",
+                         [(language,) for language in self.languages()])
+        rows = []
+        for table in ('documents', 'chunks'):
+            for language, ids in self.removed[table].items():
+                rows += [(table, language, id, 1) for id in ids]
+            for language, written in self.written[table].items():
+                rows += [(table, language, id, 0) for id, _ in written]
+        conn.executemany("INSERT OR IGNORE INTO pending_index_changes (table_name, language, row_id, removed) VALUES (?, ?, ?, ?)", rows)
+
+
+def pending_changes(conn):
+    """
+    Index work of this and of the earlier ingests not applied yet (e.g. a FAISS
+    update that failed or was skipped): the languages whose token store is stale,
+    and the Changes of the FAISS indexes. Written rows get their current content;
+    those deleted since are removed instead.
+    """
+    token_languages = [row[0] for row in conn.execute("SELECT language FROM pending_token_languages ORDER BY language")]
+    changes = Changes()
+    for table, language, id, removed in conn.execute(
+            "SELECT table_name, language, row_id, removed FROM pending_index_changes ORDER BY row_id").fetchall():
+        row = None if removed else conn.execute(f"SELECT content FROM {table} WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            changes.remove(table, language, [id])
+        else:
+            changes.write(table, language, [(id, row[0])])
+    return token_languages, changes
+
+
+def ensure_content_hashes():
+    """Add and backfill the content_hash columns, the schema indexes, the pending index work, the sentence and the temporal entity tables of databases built before they existed."""
+    conn = Connection(DB_PATH)
+    for table in ('documents', 'chunks'):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+        if 'content_hash' not in columns:
+            print(f"Adding content_hash to {table}")
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN content_hash TEXT")
+    documents = conn.execute("SELECT id, jsonl FROM documents WHERE content_hash IS NULL").fetchall()
+    chunks = conn.execute("SELECT id, content FROM chunks WHERE content_hash IS NULL").fetchall()
+    conn.conn.executemany("UPDATE documents SET content_hash = ? WHERE id = ?", [(content_hash(text), id) for id, text in documents])
+    conn.conn.executemany("UPDATE chunks SET content_hash = ? WHERE id = ?", [(content_hash(text), id) for id, text in chunks])
+    create_schema_indexes(conn.conn)
+    create_pending_tables(conn.conn)
+    conn.conn.commit()
+    if not has_document_sentences(conn.conn):
+        print("Building the document sentence index")
+        populate_document_sentences()
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sentences'").fetchone() is None:
+        print("Building the sentences table")
+        populate_sentences()
+    if not has_temporal_tables(conn.conn):
+        print("Building the temporal entity tables")
+        populate_temporal_entities()
+
+
+def delete_chunks(conn, ids):
+    delete_chunk_sentences(conn, ids)
+    delete_chunk_entities(conn, ids)
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' for _ in batch)})", batch)
+
+
+def upsert_document(conn, doc):
+    """
+    Insert or update one document and its chunks, together with the index work
+    they need, in one transaction. Returns 'added', 'updated' or 'unchanged'.
+    """
+    name = get_document_name(doc)
+    jsonl = json.dumps(doc)
+    row = conn.execute(
+        "SELECT id, domain, language, content_hash FROM documents WHERE doc_id = ? AND name = ?",
+        (doc['doc_id'], name)
+    ).fetchone()
+    if row is not None and row[3] == content_hash(jsonl):
+        return 'unchanged'
+
+    changes = Changes()
+    with conn:
+        if row is None:
+            document_id = insert_document(conn, doc)
+            old_chunks = []
+        else:
+            document_id = row[0]
+            conn.execute(
+                "UPDATE documents SET domain = ?, language = ?, content = ?, jsonl = ?, content_hash = ? WHERE id = ?",
+                (doc['domain'], doc['language'], doc['content'], jsonl, content_hash(jsonl), document_id)
+            )
+            if row[1] != doc['domain'] or row[2] != doc['language']:
+                changes.remove('documents', row[2], [document_id])
+            delete_document_sentences(conn, [document_id])
+            old_chunks = conn.execute(
+                "SELECT id, language, domain, content_hash FROM chunks WHERE doc_id = ? AND name = ? ORDER BY id",
+                (doc['doc_id'], name)
+            ).fetchall()
+        changes.write('documents', doc['language'], [(document_id, doc['content'])])
+        index_document_sentences(conn, [(document_id, doc['doc_id'], doc['domain'], doc['content'])])
+
+        # Keep the chunks up to the first one that changed, replace the rest
+        new_chunks = single_chunk(doc['content'])
+        keep = 0
+        while (keep < min(len(old_chunks), len(new_chunks))
+               and old_chunks[keep][1:] == (doc['language'], doc['domain'], content_hash(new_chunks[keep]['page_content']))):
+            keep += 1
+        stale = old_chunks[keep:]
+        delete_chunks(conn, [chunk[0] for chunk in stale])
+        for chunk in stale:
+            changes.remove('chunks', chunk[1], [chunk[0]])
+        added = new_chunks[keep:]
+        ids = insert_chunks(conn, doc, added)
+        changes.write('chunks', doc['language'], [(id, chunk['page_content']) for id, chunk in zip(ids, added)])
+        changes.record(conn)
+    return 'added' if row is None else 'updated'
+
+
+def remove_documents(conn, doc_ids):
+    """Delete the documents of doc_ids and their chunks, with the index work, in one transaction."""
+    changes = Changes()
+    placeholders = ','.join('?' for _ in doc_ids)
+    with conn:
+        documents = conn.execute(f"SELECT id, language FROM documents WHERE doc_id IN ({placeholders})", doc_ids).fetchall()
+        for id, language in documents:
+            changes.remove('documents', language, [id])
+        delete_document_sentences(conn, [document[0] for document in documents])
+        chunks = conn.execute(f"SELECT id, language FROM chunks WHERE doc_id IN ({placeholders})", doc_ids).fetchall()
+        for id, language in chunks:
+            changes.remove('chunks', language, [id])
+        delete_chunks(conn, [chunk[0] for chunk in chunks])
+        conn.execute(f"DELETE FROM documents WHERE doc_id IN ({placeholders})", doc_ids)
+        changes.record(conn)
+
+
+def update_indexes(conn, token_languages, changes, skip_faiss=False):
+    """
+    Apply the pending index work (see pending_changes). Each part is cleared
+    from the database only once its index has been written.
+    """
+    if token_languages:
+        # Only new or changed chunks are tokenized, the rest comes from the current store
+        previous = {language: TokenStore.load(os.path.join(TOKEN_STORE_DIR, language), language) for language in token_languages}
+        populate_token_store(token_languages, previous)
+        gen_bm25_index.main(token_languages)
+        with conn:
+            conn.executemany("DELETE FROM pending_token_languages WHERE language = ?", [(language,) for language in token_languages])
+    if skip_faiss:
+        return
+    for table in ('chunks', 'documents'):
+        for language in changes.languages(table):
+            output_dir = os.path.join(FAISS_DIR, table, language)
+            # Without an index there is nothing to update: generate_faiss.py builds it from the current rows
+            if (update_faiss_index(language, output_dir, changes.removed[table].get(language, []), changes.written[table].get(language, []))
+                    or not os.path.exists(os.path.join(output_dir, f"{language}.index"))):
+                with conn:
+                    conn.execute("DELETE FROM pending_index_changes WHERE table_name = ? AND language = ?", (table, language))
+
+
+def main(docs_path=None, remove_doc_ids=[], skip_faiss=False):
+    start = time.time()
+    enable_wal(DB_PATH)
+    ensure_content_hashes()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if conn.execute("SELECT 1 FROM pending_index_changes UNION ALL SELECT 1 FROM pending_token_languages").fetchone():
+            print("Resuming the index updates left by an earlier ingest")
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0}
+        if remove_doc_ids:
+            remove_documents(conn, remove_doc_ids)
+        if docs_path:
+            with jsonlines.open(docs_path, 'r') as reader:
+                for doc in reader:
+                    counts[upsert_document(conn, doc)] += 1
+        token_languages, changes = pending_changes(conn)
+        removed_chunks = sum(len(ids) for ids in changes.removed['chunks'].values())
+        written_chunks = sum(len(rows) for rows in changes.written['chunks'].values())
+        print(f"Documents: {counts['added']} added, {counts['updated']} updated, {counts['unchanged']} unchanged, "
+              f"{len(remove_doc_ids)} doc_ids removed; chunks to index: {removed_chunks} removed, {written_chunks} added")
+        update_indexes(conn, token_languages, changes, skip_faiss)
+    finally:
+        conn.close()
+    print(f"Ingest done in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs_path', type=str, default=None, help='Documents (jsonl) to add or update')
+    parser.add_argument('--remove_doc_ids', type=int, nargs='*', default=[], help='doc_ids to delete')
+    parser.add_argument('--skip_faiss', action='store_true', help='Do not update the FAISS indexes')
+    args = parser.parse_args()
+    main(args.docs_path, args.remove_doc_ids, args.skip_faiss)
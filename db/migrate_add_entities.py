@@ -16,6 +16,8 @@ from pathlib import Path
 # Add parent directory to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from My_RAG.entity_extractor import extract_entities
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../My_RAG')))
+from temporal_store import create_temporal_tables, index_chunk_entities
 
 DB_PATH_OLD = "db/dataset.db"
 DB_PATH_NEW = "db/dataset_v2.db"
@@ -62,7 +64,13 @@ def create_new_schema(conn):
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_people ON chunks(people)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_docs_years ON documents(years)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_docs_people ON documents(people)")
-    
+
+    # Indexes of the retrieval queries (see dataset_table-schema-v2.yaml)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_doc_id ON documents(doc_id, language)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_language_domain ON documents(language, domain, doc_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks(doc_id, language)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_language_domain ON chunks(language, domain)")
+
     conn.commit()
     print("✓ Created new schema with entity fields")
 
@@ -132,6 +140,15 @@ def migrate_chunks(old_conn, new_conn):
     new_conn.commit()
     print(f"✓ Migrated {len(chunks)} chunks")
 
+def migrate_temporal_entities(new_conn):
+    """Fill the normalized chunk_years / chunk_months / chunk_dates tables used by the time router."""
+    create_temporal_tables(new_conn)
+    for language in [row[0] for row in new_conn.execute("SELECT DISTINCT language FROM chunks").fetchall()]:
+        rows = new_conn.execute("SELECT id, content FROM chunks WHERE language = ?", (language,)).fetchall()
+        index_chunk_entities(new_conn, rows, language)
+    new_conn.commit()
+    print("✓ Indexed temporal entities of the chunks")
+
 def verify_migration(conn):
     """Verify the migration was successful."""
     cursor = conn.cursor()
@@ -201,6 +218,7 @@ def main():
         # Migrate data
         migrate_documents(old_conn, new_conn)
         migrate_chunks(old_conn, new_conn)
+        migrate_temporal_entities(new_conn)
         
         # Verify migration
         verify_migration(new_conn)
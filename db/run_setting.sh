@@ -19,6 +19,10 @@ python ./db/gen_dataset_db.py \
     --docs_path ./dragonball_dataset/dragonball_docs.jsonl
 echo "[INFO] All dataset db regenerated."
 
+echo "[INFO] rebuilding BM25 index for chunks"
+python ./db/gen_bm25_index.py
+echo "[INFO] BM25 index rebuilt."
+
 # ask_for_confirmation "Do you want to delete existing [queries] table and regenerate? [Y/N]"
 # echo "[INFO] regenerating dataset db for queries"
 
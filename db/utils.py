@@ -1,14 +1,51 @@
 from Connection import Connection
+import hashlib
 import yaml
 import sqlite3
 
-def create_table_from_yaml(yaml_file, db_file):
+def content_hash(text):
+    """Hash stored with documents/chunks rows to detect changed content on ingest."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def load_schema(yaml_file):
     with open(yaml_file, 'r') as file:
         schema_list = yaml.safe_load(file)
     
     # Ensure it's a list to handle both single and multiple table definitions
     if isinstance(schema_list, dict):
         schema_list = [schema_list]
+    return schema_list
+
+def index_statements(yaml_file):
+    """
+    CREATE INDEX statements of the `indexes` declared with the tables, e.g.
+        indexes:
+        - name: chunks_doc_id
+          columns: [doc_id, language]
+          unique: false
+    """
+    statements = []
+    for schema in load_schema(yaml_file):
+        for index in schema.get('indexes', []):
+            unique = 'UNIQUE ' if index.get('unique') else ''
+            statements.append(
+                f"CREATE {unique}INDEX IF NOT EXISTS {index['name']} ON {schema['table_name']} ({', '.join(index['columns'])});"
+            )
+    return statements
+
+def changed_indexes(conn, yaml_file):
+    """Names of the declared indexes that exist in the database with other columns."""
+    changed = []
+    for schema in load_schema(yaml_file):
+        for index in schema.get('indexes', []):
+            columns = [row[2] for row in conn.execute(f"PRAGMA index_info({index['name']})").fetchall()]
+            if columns and columns != index['columns']:
+                changed.append(index['name'])
+    return changed
+
+def create_table_from_yaml(yaml_file, db_file, indexes=True):
+    """Create the tables of a schema file, and their indexes unless a bulk load creates them afterwards."""
+    schema_list = load_schema(yaml_file)
     
     conn = Connection(db_file)
     
@@ -37,3 +74,8 @@ def create_table_from_yaml(yaml_file, db_file):
             print(f"Success! Table '{table_name}' created in '{db_file}'.")
         except sqlite3.Error as e:
             print(f"An error occurred: {e}")
+    
+    if indexes:
+        for index_query in index_statements(yaml_file):
+            print(f"Generated SQL: {index_query}")
+            conn.execute(index_query)